@@ -0,0 +1,77 @@
+""" bench_batching - datagrams sent per message with and without batching
+
+    Simulates 1000 main loop rounds of a busy node with 30 peers. Every
+    round it forwards 8 chat relays (400 bytes) and 20 keepalives to
+    GOSSIP_FANOUT random peers, and requests 2 missing messages from one
+    peer. The peers are either all PROTOCOL_VERSION 1 or all version 3.
+    Sockets are replaced with a counter, nothing goes to the network.
+
+    Usage: python benchmarks/bench_batching.py
+"""
+from ipaddress import IPv4Address
+from random import Random
+
+from smplchat.settings import GOSSIP_FANOUT
+from smplchat.udp_comms import dispatcher as dispatcher_module
+from smplchat.udp_comms import Dispatcher, packer, PROTOCOL_VERSION
+from smplchat.message import KeepaliveRelayMessage, OldRequestMessage
+
+ROUNDS = 1000
+PEERS = [IPv4Address(0x0a000000 + i) for i in range(30)]
+
+class CountingSocket:
+    """ stands in for socket.socket and counts sendto calls """
+    datagrams = 0
+    sockets = 0
+
+    def __init__(self, *_):
+        CountingSocket.sockets += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def sendto(self, data, _):
+        """ counts the datagram """
+        CountingSocket.datagrams += 1
+        return len(data)
+
+def run(version: int) -> tuple[int, int, int]:
+    """ returns (messages, datagrams, sockets) """
+    rnd = Random(1)
+    CountingSocket.datagrams = CountingSocket.sockets = 0
+    dispatcher = Dispatcher()
+    for ip in PEERS:
+        dispatcher.hello_from(ip, version)
+    relay = b"\x00" + bytes(399)
+    messages = 0
+    uid = 0
+    for _ in range(ROUNDS):
+        for _ in range(8):
+            dispatcher.send(relay, rnd.sample(PEERS, GOSSIP_FANOUT))
+            messages += GOSSIP_FANOUT
+        for _ in range(20):
+            uid += 1
+            dispatcher.send(KeepaliveRelayMessage(uid, IPv4Address(1)),
+                            rnd.sample(PEERS, GOSSIP_FANOUT))
+            messages += GOSSIP_FANOUT
+        for _ in range(2):
+            uid += 1
+            dispatcher.send(OldRequestMessage(uid), rnd.sample(PEERS, 1))
+            messages += 1
+        dispatcher.flush()
+    return messages, CountingSocket.datagrams, CountingSocket.sockets
+
+def main():
+    """ runs the measurement """
+    dispatcher_module.socket = CountingSocket
+    packer(OldRequestMessage(1))	# warm up
+    for version in (1, PROTOCOL_VERSION):
+        messages, datagrams, sockets = run(version)
+        print(f"peers v{version}: {messages} messages in {datagrams} datagrams "
+              f"({datagrams / messages:.2f} per message), {sockets} sockets opened")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+""" bench_codec - packed and unpacked messages per second for every MessageType
+
+    Relay messages carry 50 old message ids like the ones new_message
+    builds, nicks are 10 and texts 100 characters.
+
+    Usage: python benchmarks/bench_codec.py
+"""
+from ipaddress import IPv4Address
+from timeit import Timer
+
+from smplchat.udp_comms import packer, unpacker
+from smplchat.message import (
+    MessageType,
+    ChatRelayMessage,
+    JoinRelayMessage,
+    LeaveRelayMessage,
+    KeepaliveRelayMessage,
+    JoinRequestMessage,
+    JoinReplyMessage,
+    OldRequestMessage,
+    OldReplyMessage)
+
+UID = 1700000000 << 32 | 12345
+IDS = [UID - i * 7919 for i in range(1, 51)]
+IP = IPv4Address("10.1.2.3")
+NICK = "nickname_1"
+TEXT = "lorem ipsum dolor sit amet " * 3 + "consectetur adipiscing elit, sed"
+
+MESSAGES = {
+    MessageType.CHAT_RELAY: ChatRelayMessage(UID, IP, IDS, NICK, TEXT),
+    MessageType.JOIN_RELAY: JoinRelayMessage(UID, IP, IDS, NICK),
+    MessageType.LEAVE_RELAY: LeaveRelayMessage(UID, IP, IDS, NICK),
+    MessageType.KEEPALIVE_RELAY: KeepaliveRelayMessage(UID, IP),
+    MessageType.JOIN_REQUEST: JoinRequestMessage(UID, NICK),
+    MessageType.JOIN_REPLY: JoinReplyMessage(
+        IDS, [IPv4Address(0x0a000000 + i) for i in range(50)]),
+    MessageType.OLD_REQUEST: OldRequestMessage(UID),
+    MessageType.OLD_REPLY: OldReplyMessage(UID, NICK, TEXT),
+}
+
+def rate(func) -> float:
+    """ calls per second, best of 5 """
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(5, number))
+
+def main():
+    """ runs the measurement """
+    print(f"{'type':16} {'pack/s':>10} {'unpack/s':>10}")
+    for msg_type, msg in MESSAGES.items():
+        data = packer(msg)
+        print(f"{msg_type.name:16} {rate(lambda m=msg: packer(m)):10.0f} "
+              f"{rate(lambda d=data: unpacker(d)):10.0f}")
+
+if __name__ == "__main__":
+    main()
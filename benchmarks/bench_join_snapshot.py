@@ -0,0 +1,68 @@
+""" bench_join_snapshot - time for a joining node to get its backlog
+
+    Two AsyncNodes on 127.0.0.1 and 127.0.0.2 (same port) share one event
+    loop. The accepting node has HISTORY messages of 100 characters. The
+    joining node joins and is timed until its history is complete:
+    with the snapshot stream it should get all SNAPSHOT_SIZE latest ones,
+    and without it (both nodes speak protocol version 5) the ids of the
+    JOIN_REPLY, fetched with batched OLD_BATCH_REQUESTs.
+
+    Usage: python benchmarks/bench_join_snapshot.py
+"""
+import asyncio
+import socket
+from ipaddress import IPv4Address
+from time import perf_counter, time
+from unittest.mock import patch
+
+from smplchat.async_node import AsyncNode
+from smplchat.message import ChatRelayMessage
+from smplchat.settings import SNAPSHOT_SIZE, LATEST_LIMIT
+
+HISTORY = 1000
+ROUNDS = 20
+JOINER = IPv4Address("127.0.0.1")
+ACCEPTOR = IPv4Address("127.0.0.2")
+
+def free_port() -> int:
+    with socket.socket(type=socket.SOCK_DGRAM) as sock:
+        sock.bind((str(JOINER), 0))
+        return sock.getsockname()[1]
+
+async def join_once(expected: int) -> float:
+    """ seconds until the joining node has expected full messages """
+    port = free_port()
+    acceptor = AsyncNode(ACCEPTOR, "acceptor", bind_ip=ACCEPTOR, port=port)
+    joiner = AsyncNode(JOINER, "joiner", bind_ip=JOINER, port=port)
+    await acceptor.start()
+    await joiner.start()
+    base = int(time()) - HISTORY
+    for i in range(HISTORY):
+        acceptor.core.msg_list.add(ChatRelayMessage(
+                uniq_msg_id=(base + i) << 32 | i, sender_ip=ACCEPTOR, old_message_ids=[],
+                sender_nick="bob", msg_text="x" * 100))
+    start = perf_counter()
+    await joiner.join(ACCEPTOR)
+    while len(joiner.core.msg_list.latest_ids()) < expected:
+        await asyncio.sleep(0.0005)
+        if perf_counter() - start > 10:
+            raise TimeoutError(f"{len(joiner.core.msg_list.latest_ids())} of {expected}")
+    elapsed = perf_counter() - start
+    await joiner.close(leave=False)
+    await acceptor.close(leave=False)
+    return elapsed
+
+def run(expected: int) -> float:
+    """ median seconds of ROUNDS joins """
+    times = sorted(asyncio.run(join_once(expected)) for _ in range(ROUNDS))
+    return times[len(times) // 2]
+
+def main():
+    snapshot = run(SNAPSHOT_SIZE)
+    print(f"snapshot stream:  {SNAPSHOT_SIZE:4} messages in {snapshot * 1000:6.1f} ms")
+    with patch("smplchat.node.SNAPSHOT_VERSION", 99):
+        fetch = run(LATEST_LIMIT * 2)
+    print(f"batched fetch:    {LATEST_LIMIT * 2:4} messages in {fetch * 1000:6.1f} ms")
+
+if __name__ == "__main__":
+    main()
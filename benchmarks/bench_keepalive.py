@@ -0,0 +1,91 @@
+""" bench_keepalive - memory and cleanup pause of KeepaliveList with 5k peers
+
+    Every peer sends a keepalive every KEEPALIVE_INTERVAL seconds and each
+    one reaches us RELAY_SEEN_LIMIT times. Simulated time runs for two
+    NODE_TIMEOUTs and cleanup is called every CLEANUP_INTERVAL seconds.
+    The old per-uid entry implementation is kept here for comparison.
+
+    Usage: python benchmarks/bench_keepalive.py
+"""
+import tracemalloc
+from time import perf_counter
+
+from smplchat.settings import (
+    NODE_TIMEOUT,
+    KEEPALIVE_INTERVAL,
+    CLEANUP_INTERVAL,
+    RELAY_SEEN_LIMIT)
+from smplchat.client_list import keepalive
+
+PEERS = 5000
+
+class LegacyKeepaliveList:
+    """ KeepaliveList as it was before time buckets """
+    class Entry:
+        """ entries for the list """
+        def __init__(self, now):
+            self.seen = 1
+            self.addtime = int(now)
+
+    def __init__(self, clock):
+        self.__clock = clock
+        self.__entries = {}
+
+    def cleanup(self):
+        """ cleans up too old entries """
+        now = int(self.__clock())
+        for uid, entry in list(self.__entries.items()):
+            if now - entry.addtime > NODE_TIMEOUT:
+                del self.__entries[uid]
+
+    def add(self, uid):
+        """ add entry or update seen count """
+        if uid in self.__entries:
+            self.__entries[uid].seen += 1
+        else:
+            self.__entries[uid] = self.Entry(self.__clock())
+
+class Clock:
+    """ simulated time """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def run(make, measure_memory: bool):
+    """ returns (peak bytes, longest cleanup seconds) """
+    clock = Clock()
+    kal = make(clock)
+    per_second = PEERS // KEEPALIVE_INTERVAL
+    uid = 0
+    pauses = []
+    if measure_memory:
+        tracemalloc.start()
+    for second in range(1, 2 * NODE_TIMEOUT + 1):
+        clock.now = float(second)
+        for _ in range(per_second):
+            uid += 1
+            for _ in range(RELAY_SEEN_LIMIT):
+                kal.add(uid)
+        if second % CLEANUP_INTERVAL == 0:
+            start = perf_counter()
+            kal.cleanup()
+            pauses.append(perf_counter() - start)
+    peak = 0
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return peak, max(pauses)
+
+def main():
+    """ runs the measurement """
+    for name, make in (("legacy", LegacyKeepaliveList),
+                       ("buckets", keepalive.KeepaliveList)):
+        peak, _ = run(make, True)
+        _, pause = run(make, False)
+        print(f"{name:8} peak {peak / 2**20:6.1f} MiB, "
+              f"longest cleanup {pause * 1000:7.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+""" bench_message_memory - bytes per MessageList entry with 100k messages
+
+    Usage: python benchmarks/bench_message_memory.py [chunked|columnar]
+"""
+import sys
+import tracemalloc
+from random import Random
+from ipaddress import IPv4Address
+
+from smplchat.message import ChatRelayMessage
+from smplchat.message_list import list as message_list
+
+ENTRIES = 100000
+NICKS = [f"user{i}" for i in range(50)]
+
+def messages(rnd: Random):
+    """ chat messages like they come out of the unpacker: fresh strings,
+        every 20th message refers to 5 older messages not seen yet """
+    uid = 1700000000 << 32
+    for i in range(ENTRIES):
+        uid += rnd.randrange(1, 1 << 33)
+        text = "".join(rnd.choice("abcdefghij klmnopqrstuvwxyz")
+                       for _ in range(rnd.randrange(5, 80)))
+        yield ChatRelayMessage(
+            uniq_msg_id=uid,
+            sender_ip=IPv4Address("10.0.0.1"),
+            old_message_ids=[uid - j - 1 for j in range(5)] if i % 20 == 0 else [],
+            sender_nick=NICKS[i % len(NICKS)].encode().decode(),
+            msg_text=text)
+
+def main():
+    """ runs the measurement """
+    if len(sys.argv) > 1:
+        message_list.MESSAGE_BACKEND = sys.argv[1]
+    rnd = Random(1)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    ml = message_list.MessageList()
+    for msg in messages(rnd):
+        ml.add(msg)
+        ml.add(msg)	# seen bump
+    ml.get_textual_contents(50)
+    used = tracemalloc.get_traced_memory()[0] - before
+    entries = len(ml.get())
+    print(f"{type(ml._MessageList__messages).__name__}: {entries} entries, "
+          f"{used / 2**20:.1f} MiB, {used / entries:.0f} bytes/entry")
+
+if __name__ == "__main__":
+    main()
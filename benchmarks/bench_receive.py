@@ -0,0 +1,83 @@
+""" bench_receive - cost of receiving datagrams, recvfrom vs Listener
+
+    Sends ROUNDS x 100 chat relays (300 bytes, 30 distinct senders) to a
+    socket on 127.0.0.1 and times draining them, either the old way
+    (recvfrom(10000) and an IPv4Address per datagram) or with
+    Listener.get_messages (recvfrom_into to buffer slots, cached
+    addresses). Both peek the header of every message like the main
+    loop does before deciding to decode. Only draining is timed.
+
+    Usage: python benchmarks/bench_receive.py
+"""
+import socket
+from ipaddress import IPv4Address
+from time import perf_counter
+from unittest.mock import patch
+
+from smplchat.udp_comms import Listener, packer, peek_header, split_batch
+from smplchat.message import ChatRelayMessage
+
+ROUNDS = 300
+PER_ROUND = 100
+LOCAL = IPv4Address("127.0.0.1")
+
+def datagrams():
+    return [packer(ChatRelayMessage(uniq_msg_id=i, sender_ip=i % 30, old_message_ids=[],
+                                    sender_nick="bob", msg_text="x" * 270))
+            for i in range(PER_ROUND)]
+
+def free_port() -> int:
+    with socket.socket(type=socket.SOCK_DGRAM) as sock:
+        sock.bind((str(LOCAL), 0))
+        return sock.getsockname()[1]
+
+def drain_recvfrom(sock):
+    count = 0
+    while True:
+        try:
+            data, addr = sock.recvfrom(10000)
+        except BlockingIOError:
+            return count
+        IPv4Address(addr[0])
+        for msg in split_batch(data):
+            peek_header(msg)
+            count += 1
+
+def drain_listener(listener):
+    count = 0
+    while messages := listener.get_messages():
+        for msg, _ in messages:
+            peek_header(msg)
+            count += 1
+    return count
+
+def run(name, drain, target, address):
+    data = datagrams()
+    senders = [socket.socket(type=socket.SOCK_DGRAM) for _ in range(30)]
+    elapsed = 0.0
+    received = 0
+    for _ in range(ROUNDS):
+        for i, d in enumerate(data):
+            senders[i % 30].sendto(d, address)
+        start = perf_counter()
+        received += drain(target)
+        elapsed += perf_counter() - start
+    for sock in senders:
+        sock.close()
+    print(f"{name:10} {received / elapsed:10.0f} datagrams/s, "
+          f"{elapsed / received * 1e6:5.2f} us each")
+
+def main():
+    port = free_port()
+    sock = socket.socket(type=socket.SOCK_DGRAM)
+    sock.bind((str(LOCAL), port))
+    sock.setblocking(False)
+    run("recvfrom", drain_recvfrom, sock, (str(LOCAL), port))
+    sock.close()
+    with patch("smplchat.udp_comms.listener.PORT", free_port()):
+        listener = Listener(LOCAL)
+    run("Listener", drain_listener, listener, listener.sock.getsockname())
+    listener.stop()
+
+if __name__ == "__main__":
+    main()
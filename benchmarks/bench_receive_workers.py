@@ -0,0 +1,78 @@
+""" bench_receive_workers - relay throughput of WorkerPool by worker count
+
+    A load generator process sends chat relays with unique uids from 32
+    source ports to a WorkerPool on 127.0.0.1 as fast as it can. Workers
+    decode, dedup and funnel every relay to this process, which counts
+    them for DURATION seconds. SO_REUSEPORT spreads the source ports over
+    the workers. Numbers depend on the cores available: with fewer cores
+    than workers + 2 the processes just take turns.
+
+    Usage: python benchmarks/bench_receive_workers.py [workers ...]
+"""
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
+from ipaddress import IPv4Address
+from time import monotonic, sleep
+
+from smplchat.udp_comms import WorkerPool, packer
+from smplchat.message import ChatRelayMessage
+
+DURATION = 3.0
+SOURCES = 32
+LOCAL = IPv4Address("127.0.0.1")
+
+def generate(port: int, stop):
+    """ sends relays round robin from SOURCES sockets until stop is set """
+    socks = [socket.socket(type=socket.SOCK_DGRAM) for _ in range(SOURCES)]
+    template = packer(ChatRelayMessage(uniq_msg_id=0, sender_ip=int(LOCAL) + 1,
+                                       old_message_ids=list(range(1, 11)),
+                                       sender_nick="load", msg_text="x" * 100))
+    address = (str(LOCAL), port)
+    uid = 0
+    while not stop.is_set():
+        for sock in socks:
+            uid += 1
+            data = template[:1] + uid.to_bytes(8, "big") + template[9:]
+            try:
+                sock.sendto(data, address)
+            except OSError:
+                pass
+
+def run(workers: int) -> float:
+    """ returns funneled relays per second """
+    with socket.socket(type=socket.SOCK_DGRAM) as probe:
+        probe.bind((str(LOCAL), 0))
+        port = probe.getsockname()[1]
+    pool = WorkerPool(workers, IPv4Address("10.255.255.254"), bind_ip=LOCAL, port=port)
+    stop = multiprocessing.Event()
+    generator = multiprocessing.Process(target=generate, args=(port, stop), daemon=True)
+    generator.start()
+    sleep(0.5)	# warm up
+    pool.get_messages(1 << 30)
+    count = 0
+    start = monotonic()
+    with selectors.DefaultSelector() as selector:
+        selector.register(pool, selectors.EVENT_READ)
+        while monotonic() - start < DURATION:
+            selector.select(0.1)
+            count += len(pool.get_messages(4096))
+    elapsed = monotonic() - start
+    stop.set()
+    generator.join()
+    pool.stop()
+    return count / elapsed
+
+def main():
+    counts = [int(a) for a in sys.argv[1:]] or [1, 2, 4]
+    print(f"{os.cpu_count()} cpus")
+    base = None
+    for workers in counts:
+        rate = run(workers)
+        base = base or rate
+        print(f"{workers} workers: {rate:9.0f} relays/s  x{rate / base:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+""" bench_wire_size - average bytes per relay with and without compact ids
+
+    Replays a simulated chat: 20 users, 5000 messages with exponentially
+    distributed gaps (mean 8 s), text lengths 5..120 characters. Every
+    relay carries the LATEST_LIMIT newest ids of the sender's history,
+    where 5% of the messages arrive out of order. JOIN_REPLY carries twice
+    as many ids and 30 peers.
+
+    Usage: python benchmarks/bench_wire_size.py
+"""
+from ipaddress import IPv4Address
+from random import Random
+
+from smplchat.settings import LATEST_LIMIT
+from smplchat.udp_comms import packer
+from smplchat.message import (
+    ChatRelayMessage,
+    JoinReplyMessage)
+
+MESSAGES = 5000
+USERS = [f"user{i}" for i in range(20)]
+
+def workload(rnd: Random, history: list[int]):
+    """ yields chat relays as they would be sent, history collects uids
+        in the order they were received """
+    now = 1700000000.0
+    for _ in range(MESSAGES):
+        now += rnd.expovariate(1 / 8)
+        uid = (int(now) << 32) + rnd.getrandbits(32)
+        msg = ChatRelayMessage(
+            uniq_msg_id=uid,
+            sender_ip=IPv4Address(0x0a000000 + rnd.randrange(len(USERS))),
+            old_message_ids=history[-LATEST_LIMIT:],
+            sender_nick=rnd.choice(USERS),
+            msg_text="x" * rnd.randrange(5, 121))
+        yield msg
+        if history and rnd.random() < 0.05:
+            history.insert(len(history) - 1, uid)	# arrived late
+        else:
+            history.append(uid)
+
+def main():
+    """ runs the measurement """
+    rnd = Random(1)
+    history = []
+    legacy = compact = count = 0
+    for msg in workload(rnd, history):
+        legacy += len(packer(msg))
+        compact += len(packer(msg, compact=True))
+        count += 1
+    print(f"CHAT_RELAY  legacy {legacy / count:6.1f} B, compact {compact / count:6.1f} B "
+          f"({100 * (1 - compact / legacy):.0f}% smaller)")
+    reply = JoinReplyMessage(
+        old_message_ids=history[-2 * LATEST_LIMIT:],
+        ip_addresses=[IPv4Address(0x0a000000 + i) for i in range(30)])
+    print(f"JOIN_REPLY  legacy {len(packer(reply)):6d} B, "
+          f"compact {len(packer(reply, compact=True)):6d} B")
+
+if __name__ == "__main__":
+    main()
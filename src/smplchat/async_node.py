@@ -0,0 +1,217 @@
+""" async_node.py - chat node on an asyncio event loop """
+import asyncio
+from ipaddress import IPv4Address
+from time import monotonic
+from smplchat.message import Message
+from smplchat.node import NodeCore
+from smplchat.udp_comms import Dispatcher, Sender, WorkerPool, split_batch
+from smplchat.utils import dprint
+from smplchat.settings import PORT, RECEIVE_WORKERS
+
+
+class _TransportSender:
+    """ Sender interface on top of a datagram transport """
+    def __init__(self, transport: asyncio.DatagramTransport, port: int):
+        self.__transport = transport
+        self.__port = port
+        self.sent = 0
+
+    def sendto(self, data: bytes, ip: IPv4Address):
+        """ Sends one datagram to ip """
+        self.__transport.sendto(data, (str(ip), self.__port))
+        self.sent += 1
+
+    def send_batch(self, datagrams) -> int:
+        """ Sends (data, ip) pairs, returns how many were sent """
+        count = 0
+        for data, ip in datagrams:
+            self.sendto(data, ip)
+            count += 1
+        return count
+
+    def stats(self) -> str:
+        """ Counters as text """
+        buffered = self.__transport.get_write_buffer_size()
+        return f"sent {self.sent}, buffered {buffered} bytes"
+
+
+class _NodeProtocol(asyncio.DatagramProtocol):
+    """ Feeds received datagrams to the node """
+    def __init__(self, node: "AsyncNode"):
+        self.__node = node
+
+    def datagram_received(self, data: bytes, addr):
+        self.__node.received(data, IPv4Address(addr[0]))
+
+    def error_received(self, exc: Exception):
+        dprint(f"Datagram error: {exc}")
+
+
+class AsyncNode:
+    """ AsyncNode - NodeCore driven by asyncio.
+
+        Receiving and sending go through a DatagramProtocol bound to
+        bind_ip:port. Keepalives run as a task and maintenance (fetch
+        retries, expiry) as a loop timer set to the next deadline, so
+        nothing wakes up before it is due. Many nodes can share one event
+        loop.
+
+            node = AsyncNode(self_ip, "bob")
+            await node.start()
+            await node.post("hello")
+            async for msg in node.messages():
+                print(msg.sender_nick, msg.msg_text)
+
+        on_activity is called after every received datagram, for example
+        to tell a user interface to redraw.
+
+        With workers over 1 a WorkerPool receives and relays instead of
+        the protocol, the loop reads its funnel and sends from its socket.
+    """
+    def __init__(self, self_ip: IPv4Address, nick: str,
+                 bind_ip: IPv4Address = IPv4Address("0.0.0.0"),
+                 port: int = PORT, store=None, on_activity=None, *,
+                 workers: int = RECEIVE_WORKERS):
+        self.__self_ip = self_ip
+        self.__nick = nick
+        self.__bind = (str(bind_ip), port)
+        self.__port = port
+        self.__store = store
+        self.__on_activity = on_activity
+        self.__workers = workers
+        self.__pool: WorkerPool | None = None
+        self.__transport = None
+        self.__tasks: list[asyncio.Task] = []
+        self.__timer: asyncio.TimerHandle | None = None	# next maintenance
+        self.__due: float | None = None	# monotonic time of the timer
+        self.__queues: set[asyncio.Queue] = set()	# of messages() iterators
+        self.received_count = 0
+        self.core: NodeCore | None = None
+
+    async def start(self):
+        """ Binds the socket and starts the timer tasks """
+        loop = asyncio.get_running_loop()
+        if self.__workers > 1:
+            self.__pool = WorkerPool(self.__workers, self.__self_ip,
+                                     IPv4Address(self.__bind[0]), self.__port)
+            sender = Sender(self.__pool.sock, port=self.__port)
+            loop.add_reader(self.__pool.fileno(), self.__funneled)
+        else:
+            self.__transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _NodeProtocol(self), local_addr=self.__bind)
+            sender = _TransportSender(self.__transport, self.__port)
+        self.core = NodeCore(self.__self_ip, self.__nick, Dispatcher(sender),
+                             self.__store)
+        self.__tasks = [loop.create_task(self.__keepalive_task())]
+        self.__reschedule()
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """ (ip, port) the socket is bound to """
+        if self.__pool is not None:
+            return self.__pool.sock.getsockname()[:2]
+        return self.__transport.get_extra_info("sockname")[:2]
+
+    def stats(self) -> str:
+        """ Receive counters as text """
+        if self.__pool is not None:
+            return self.__pool.stats()
+        return f"{self.received_count} datagrams received"
+
+    def received(self, data: bytes, remote_ip: IPv4Address):
+        """ Handles one datagram, called by the protocol """
+        self.received_count += 1
+        self.__handle(((rx_msg, remote_ip) for rx_msg in split_batch(data)), True)
+
+    def __funneled(self):
+        """ handles messages the receive workers have relayed already """
+        self.__handle(self.__pool.get_messages(), False)
+
+    def __handle(self, messages, forward: bool):
+        for rx_msg, remote_ip in messages:
+            try:
+                self.core.receive(rx_msg, remote_ip, forward=forward)
+            except Exception as e:	# pylint: disable=broad-exception-caught
+                # a bad datagram must not stop the event loop
+                dprint(f"Dropped datagram from {remote_ip}: {e}")
+        self.core.dispatcher.flush()
+        # a missing message or snapshot chunk may be due before the timer
+        due = self.core.next_maintenance()
+        if due is not None and (self.__due is None or due < self.__due):
+            self.__reschedule()
+        if self.__on_activity is not None:
+            self.__on_activity()
+
+    async def __keepalive_task(self):
+        while True:
+            await asyncio.sleep(max(0.0, self.core.next_keepalive() - monotonic()))
+            self.core.send_keepalive()
+            self.core.dispatcher.flush()
+
+    def __reschedule(self):
+        """ sets maintenance timer to the next deadline of the core """
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        due = self.__due = self.core.next_maintenance()
+        if due is not None:
+            loop = asyncio.get_running_loop()
+            delay = max(0.0, due - monotonic())
+            self.__timer = loop.call_at(loop.time() + delay, self.__maintain)
+
+    def __maintain(self):
+        self.__timer = self.__due = None
+        self.core.maintain()
+        self.core.dispatcher.flush()
+        self.__reschedule()
+
+    async def post(self, text: str) -> Message:
+        """ Sends a chat message of our own """
+        msg = self.core.post(text)
+        self.core.dispatcher.flush()
+        return msg
+
+    async def join(self, remote_ip: IPv4Address):
+        """ Sends join request to remote_ip """
+        self.core.join(remote_ip)
+        self.core.dispatcher.flush()
+
+    async def messages(self):
+        """ Yields chat messages delivered from other nodes until the
+            node is closed """
+        queue: asyncio.Queue = asyncio.Queue()
+        self.__queues.add(queue)
+        self.core.subscribe(queue.put_nowait)
+        try:
+            while True:
+                msg = await queue.get()
+                if msg is None:
+                    return
+                yield msg
+        finally:
+            self.core.unsubscribe(queue.put_nowait)
+            self.__queues.discard(queue)
+
+    async def close(self, leave: bool = True):
+        """ Sends leave relay if leave, then stops tasks and the socket """
+        if self.__transport is None and self.__pool is None:
+            return	# not started or already closed
+        if leave:
+            self.core.leave()
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+        if self.__pool is not None:
+            asyncio.get_running_loop().remove_reader(self.__pool.fileno())
+            self.__pool.stop()
+            self.__pool = None
+        else:
+            self.__transport.close()
+            self.__transport = None
+        self.core.dispatcher.close()
+        for queue in self.__queues:
+            queue.put_nowait(None)	# ends messages() iterators
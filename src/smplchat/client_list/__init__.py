@@ -1,3 +1,5 @@
 """ client_list - Handles addresses of clients addresses and timeouts them """
 from .clients import ClientList
 from .keepalive import KeepaliveList
+from .dedup import RelayDedup
+from .timing_wheel import TimingWheel
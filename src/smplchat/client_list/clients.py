@@ -5,36 +5,70 @@ from random import sample
 from smplchat.settings import NODE_TIMEOUT
 
 class ClientList:
-    """ Adds, Removes, and Timeouts other nodes addresses """
-    def __init__(self, own_ip: IPv4Address):
+    """ Adds, Removes, and Timeouts other nodes addresses
+
+        Besides the timestamp dict the peers are kept in an array so that
+        random peers can be picked by index. Removal swaps the last peer
+        into the hole, so both add and remove stay O(1).
+
+        If wheel (TimingWheel) is given, every peer has a timer in it that
+        is pushed forward when the peer is heard of, and the peer is
+        removed when the timer runs out. cleanup() is not needed then.
+    """
+    def __init__(self, own_ip: IPv4Address, wheel=None):
         self.__own: IPv4Address = own_ip
+        self.__wheel = wheel
         self.__iplist: dict[IPv4Address, int] = {}
+        self.__peers: list[IPv4Address] = []
+        self.__pos: dict[IPv4Address, int] = {}	# ip -> index in __peers
 
     def add(self, ip_addr:IPv4Address):
         """ Adds ip address to the list or updates timestamp """
         if ip_addr != self.__own:
+            if ip_addr not in self.__iplist:
+                self.__pos[ip_addr] = len(self.__peers)
+                self.__peers.append(ip_addr)
             self.__iplist[ip_addr] = int(time())
+            if self.__wheel is not None:
+                self.__wheel.schedule((self, ip_addr), NODE_TIMEOUT + 1, self.__timeout)
 
     def add_list(self, ip_addresses: list[IPv4Address]):
         """ Adds list of ip addresses to the list """
         for x in ip_addresses:
             self.add(x)
 
+    def __remove(self, ip_addr: IPv4Address):
+        """ Removes ip address by swapping last peer in its place """
+        del self.__iplist[ip_addr]
+        i = self.__pos.pop(ip_addr)
+        last = self.__peers.pop()
+        if last != ip_addr:
+            self.__peers[i] = last
+            self.__pos[last] = i
+
+    def __timeout(self, key):
+        self.__remove(key[1])
+
     def cleanup(self):
         """ Cleans up ip addresses that we havent heard of in some time """
         cur_ts = int(time())
         for ip_addr, ts in list(self.__iplist.items()):
             if cur_ts - ts > NODE_TIMEOUT:
-                del self.__iplist[ip_addr]
+                self.__remove(ip_addr)
+                if self.__wheel is not None:
+                    self.__wheel.cancel((self, ip_addr))
 
     def get(self, n, exclude: IPv4Address = None) -> list[IPv4Address]:
         """ Returns random n-list of ip addresses currently involved """
-        peers = list(self.__iplist.keys())
-        if exclude and exclude in peers:
-            peers.remove(exclude)
-        if len(peers) <= n:
-            return peers
-        return sample(peers, n)
+        count = len(self.__peers)
+        skip = self.__pos.get(exclude)
+        if count - (skip is not None) <= n:
+            return [ip for ip in self.__iplist if ip != exclude]
+        if skip is None:
+            return [self.__peers[i] for i in sample(range(count), n)]
+        # sample from all but the last index and let the last stand in for skip
+        return [self.__peers[count - 1 if i == skip else i]
+                for i in sample(range(count - 1), n)]
 
     def get_all(self) -> list[IPv4Address]:
         """ Returns all peers """
@@ -0,0 +1,68 @@
+""" client_list.dedup - bounded memory accounting of seen relay messages """
+from collections import deque
+from time import monotonic
+from smplchat.settings import (
+    DEDUP_CAPACITY,
+    DEDUP_GENERATIONS,
+    DEDUP_ROTATE_INTERVAL)
+
+
+class RelayDedup:
+    """ RelayDedup - counts how many times relay uids have been seen.
+
+        Counters live in a few generations of hash maps. New uids go to the
+        newest generation. When it is full or older than rotate_interval a
+        new one is started and the oldest is dropped as a whole, so memory
+        stays under capacity entries and nothing has to be scanned.
+        A uid seen again is moved to the newest generation.
+    """
+    def __init__(self, capacity: int = DEDUP_CAPACITY,
+                 generations: int = DEDUP_GENERATIONS,
+                 rotate_interval: float = DEDUP_ROTATE_INTERVAL,
+                 clock=None):
+        self.__clock = clock or monotonic
+        self.__generations: deque[dict[int, int]] = deque([{}])
+        self.__max_generations = max(1, generations)
+        self.__generation_size = max(1, capacity // self.__max_generations)
+        self.__rotate_interval = rotate_interval
+        self.__rotated = self.__clock()
+
+    def __len__(self):
+        return sum(map(len, self.__generations))
+
+    def rotate(self):
+        """ starts a new generation and drops the oldest if there are too many """
+        self.__generations.appendleft({})
+        if len(self.__generations) > self.__max_generations:
+            self.__generations.pop()
+        self.__rotated = self.__clock()
+
+    def expire(self):
+        """ rotates once for every rotate_interval passed since last rotation """
+        passed = int((self.__clock() - self.__rotated) // self.__rotate_interval)
+        for _ in range(min(passed, self.__max_generations)):
+            self.rotate()
+
+    def seen_count(self, uid: int) -> int:
+        """ returns how many times we have seen this uid already """
+        for generation in self.__generations:
+            if uid in generation:
+                return generation[uid]
+        return 0
+
+    def add(self, uid: int) -> int:
+        """ adds uid or increments its counter, returns the count before """
+        if self.__clock() - self.__rotated >= self.__rotate_interval:
+            self.expire()
+        elif len(self.__generations[0]) >= self.__generation_size:
+            self.rotate()
+        newest = self.__generations[0]
+        count = newest.get(uid)
+        if count is None:
+            count = 0
+            for generation in self.__generations:
+                if uid in generation:
+                    count = generation.pop(uid)
+                    break
+        newest[uid] = count + 1
+        return count
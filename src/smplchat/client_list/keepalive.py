@@ -1,36 +1,31 @@
 """ client_list.keep_alive - simple class for accounting keepalive realy messages """
-from dataclasses import dataclass
-from time import time
-from smplchat.settings import NODE_TIMEOUT
+from smplchat.settings import NODE_TIMEOUT, KEEPALIVE_BUCKETS, KEEPALIVE_CAPACITY
+from .dedup import RelayDedup
 
-@dataclass
-class KeepaliveEntry:
-    """ entries for the list """
-    def __init__(self):
-        self.seen=1
-        self.addtime=int(time())
+class KeepaliveList(RelayDedup):
+    """ the list - remembers keepalive uids for up to NODE_TIMEOUT seconds.
 
-class KeepaliveList:
-    """ the list """
-    def __init__(self):
-        self.__entries={}
+        Uids are kept in KEEPALIVE_BUCKETS time buckets, each covering
+        NODE_TIMEOUT / KEEPALIVE_BUCKETS seconds, and expire a whole bucket
+        at a time. At most KEEPALIVE_CAPACITY uids are kept; when the newest
+        bucket fills up early the oldest one is dropped sooner.
 
-    def cleanup(self):
-        """ cleans up too old entries """
-        now = int(time())
-        for uid, entry in list(self.__entries.items()):
-            if now - entry.addtime > NODE_TIMEOUT:
-                del self.__entries[uid]
+        If wheel (TimingWheel) is given, buckets are expired by it as they
+        age instead of waiting for cleanup().
+    """
+    def __init__(self, clock=None, wheel=None):
+        super().__init__(capacity=KEEPALIVE_CAPACITY,
+                         generations=KEEPALIVE_BUCKETS,
+                         rotate_interval=NODE_TIMEOUT / KEEPALIVE_BUCKETS,
+                         clock=clock)
+        self.__wheel = wheel
+        if wheel is not None:
+            wheel.schedule((self, "expire"), NODE_TIMEOUT / KEEPALIVE_BUCKETS, self.__expire)
 
-    def add(self, uid):
-        """ add entry or update seen count"""
-        if uid in self.__entries:
-            self.__entries[uid].seen+=1
-        else:
-            self.__entries[uid]=KeepaliveEntry()
+    def __expire(self, key):
+        self.expire()
+        self.__wheel.schedule(key, NODE_TIMEOUT / KEEPALIVE_BUCKETS, self.__expire)
 
-    def seen_count(self, uid):
-        """ returns how many times we have seen this uid already """
-        if not uid in self.__entries:
-            return 0
-        return self.__entries[uid].seen
+    def cleanup(self):
+        """ drops buckets that are older than NODE_TIMEOUT """
+        self.expire()
@@ -0,0 +1,109 @@
+""" client_list.timing_wheel - shared expiry service for the lists """
+from math import ceil
+from time import monotonic
+
+TICK = 1.0	# seconds per tick
+SLOTS = 64	# slots per level
+LEVELS = 3	# levels, timers further than SLOTS**LEVELS ticks wait on top level
+
+
+class TimingWheel:
+    """ TimingWheel - hierarchical timing wheel of keyed timers.
+
+        Level 0 has a slot for each of the next SLOTS ticks, every slot of
+        level 1 covers SLOTS ticks, level 2 slots cover SLOTS**2 ticks and
+        so on. Each tick runs the timers of one level 0 slot, and when a
+        lower level wraps around the next slot of the level above is moved
+        down. Scheduling, cancelling and expiring are O(1) per timer.
+
+        Timers are identified by hashable keys. Scheduling an existing key
+        again moves its timer. callback(key) is called on the first tick at
+        or after the deadline, from advance().
+    """
+    def __init__(self, tick: float = TICK, slots: int = SLOTS,
+                 levels: int = LEVELS, clock=None):
+        self.__clock = clock or monotonic
+        self.__tick = tick
+        self.__slots = slots
+        self.__wheels: list[list[dict]] = [
+                [{} for _ in range(slots)] for _ in range(levels)]
+        # key -> (due tick, callback, slot that holds the key)
+        self.__timers: dict = {}
+        self.__current = int(self.__clock() // tick)
+
+    def __len__(self):
+        return len(self.__timers)
+
+    def __contains__(self, key):
+        return key in self.__timers
+
+    def schedule(self, key, delay: float, callback):
+        """ Calls callback(key) after delay seconds, replaces earlier timer
+            of the same key """
+        self.cancel(key)
+        due = max(ceil((self.__clock() + delay) / self.__tick), self.__current + 1)
+        self.__place(key, due, callback)
+
+    def cancel(self, key):
+        """ Removes timer of key if there is one """
+        timer = self.__timers.pop(key, None)
+        if timer is not None:
+            del timer[2][key]
+
+    def __place(self, key, due: int, callback):
+        span = 1
+        for level, wheel in enumerate(self.__wheels):
+            last = level == len(self.__wheels) - 1
+            if due - self.__current < span * self.__slots or last:
+                # too far for the top level, park it in its furthest slot
+                at = min(due, self.__current + span * (self.__slots - 1))
+                slot = wheel[at // span % self.__slots]
+                break
+            span *= self.__slots
+        slot[key] = None
+        self.__timers[key] = (due, callback, slot)
+
+    def __cascade(self, level: int, span: int):
+        """ moves timers of the current slot of level one level down """
+        wheel = self.__wheels[level]
+        i = self.__current // span % self.__slots
+        slot, wheel[i] = wheel[i], {}
+        for key in slot:
+            due, callback, _ = self.__timers[key]
+            self.__place(key, due, callback)
+
+    def advance(self) -> int:
+        """ Runs ticks up to the current time, returns timers expired """
+        now = int(self.__clock() // self.__tick)
+        expired = 0
+        while self.__current < now:
+            self.__current += 1
+            for level in range(len(self.__wheels) - 1, 0, -1):
+                span = self.__slots ** level
+                if self.__current % span == 0:
+                    self.__cascade(level, span)
+            wheel = self.__wheels[0]
+            i = self.__current % self.__slots
+            slot, wheel[i] = wheel[i], {}
+            for key in list(slot):
+                timer = self.__timers.get(key)
+                if timer is None or timer[2] is not slot:
+                    continue	# cancelled or moved by an earlier callback
+                del self.__timers[key]
+                timer[1](key)
+                expired += 1
+        return expired
+
+    def next_deadline(self) -> float | None:
+        """ Returns clock time of the earliest timer or None """
+        best = None
+        span = 1
+        for wheel in self.__wheels:
+            for step in range(1, self.__slots + 1):
+                slot = wheel[(self.__current // span + step) % self.__slots]
+                if slot:
+                    due = min(self.__timers[key][0] for key in slot)
+                    best = due if best is None else min(best, due)
+                    break
+            span *= self.__slots
+        return None if best is None else best * self.__tick
@@ -1,27 +1,95 @@
 """ main.py - smplchat """
+import asyncio
+import sys
 from ipaddress import IPv4Address, AddressValueError
-from time import time
-from smplchat.message_list import MessageList, initial_messages
-from smplchat.udp_comms import Dispatcher, Listener, unpacker
+from signal import SIGINT
+from smplchat.message_list import HistoryStore, initial_messages
+from smplchat.udp_comms import Dispatcher, Listener, Sender, SendQueue, WorkerPool
 from smplchat.tui import UserInterface
-from smplchat.message import (
-        MessageType,
-        KeepaliveRelayMessage,
-        JoinRequestMessage,
-        JoinReplyMessage,
-        OldRequestMessage,
-        OldReplyMessage,
-        is_relay_message,
-        new_message)
-from smplchat.client_list import ClientList, KeepaliveList
+from smplchat.node import NodeCore
+from smplchat.async_node import AsyncNode
+from smplchat.poller import Poller
 from smplchat.utils import get_my_ip, dprint
 from smplchat.settings import (
-        GOSSIP_FANOUT,
-        RELAY_SEEN_LIMIT,
-        KEEPALIVE_INTERVAL,
         CLEANUP_INTERVAL,
+        HISTORY_DIR,
+        HISTORY_SEGMENT_SIZE,
+        HISTORY_KEEP,
         NICK,
-        JOIN)
+        JOIN,
+        EVENT_LOOP,
+        RECEIVE_WORKERS)
+
+def handle_input(node: NodeCore, intxt: str, stats=()) -> bool:
+    """ Runs a command or sends a line typed by the user. Returns False
+        when the user quits. /stats shows also stats() of objects in
+        stats. """
+    msg_list = node.msg_list
+    if intxt.startswith("/quit"):
+        # sends leave relay message and quits app
+        node.leave()
+        return False
+
+    if intxt.startswith("/nick"):
+        # changes nick and send chat relays message as system
+        new_nick = None
+        try:
+            new_nick = intxt.split()[1]
+        except IndexError:
+            msg_list.sys_message("*** Nick needs a name")
+        node.rename(new_nick)
+
+    elif intxt.startswith("/help"):
+        initial_messages(msg_list)
+
+    elif intxt.startswith("/peers"):
+        peers = node.client_list.get_all()
+        if not peers:
+            msg_list.sys_message("*** No known peers")
+        else:
+            limit = 30
+            peer_str = ", ".join(str(ip) for ip in peers[:limit]) # only ips for now
+            if len(peers) > limit:
+                peer_str += f", ... (+{len(peers) - limit} more)"
+            msg_list.sys_message(
+                f"*** Known peers ({len(peers)}): {peer_str}"
+            )
+
+    elif intxt.startswith("/stats"):
+        msg_list.sys_message(f"*** {node.dispatcher.sender.stats()}")
+        for source in stats:
+            msg_list.sys_message(f"*** {source.stats()}")
+
+    elif intxt.startswith("/join"):
+        remote_ip = None
+        try:
+            remote_ip = IPv4Address(intxt.split()[1])
+        except IndexError:
+            msg_list.sys_message("*** Join needs address")
+        except AddressValueError:
+            msg_list.sys_message(
+                    f"*** Malformed address {intxt.split()[1]}")
+        if remote_ip:
+            # clear messages before join if not already joined
+            if not node.client_list.get(1):
+                msg_list.clear_user_messages()
+            msg_list.sys_message(
+                    f"*** Join request sent to {str(remote_ip)}")
+            node.join(remote_ip)
+
+    else: # only text to send
+        node.post(intxt)
+    return True
+
+def greet(node: NodeCore):
+    """ Startup messages and autojoin """
+    initial_messages(node.msg_list) # adds some helpful messages to the list
+    node.msg_list.sys_message( f"*** Your IP: {str(node.self_ip)}" )
+
+    # autojoin ip if env for it set
+    if JOIN:
+        node.msg_list.sys_message(f"*** Join request sent to {str(JOIN)}")
+        node.join(JOIN)
 
 def main():
     """ main - the entry point to the application """
@@ -41,26 +109,35 @@ def main():
             print("\nExited smplchat")
             return
 
-    # core initializations
-    client_list = ClientList(self_ip) # Initialize ip-list
-    listener = Listener() # listening socket
-    msg_list = MessageList()
-    keepalive_list = KeepaliveList()
-    dispatcher = Dispatcher() # dispatch sockets
-    last_keepalive = time()
-    last_maintenance = time()
-
-    initial_messages(msg_list) # adds some helpful messages to the list
-    msg_list.sys_message( f"*** Your IP: {str(self_ip)}" )
+    store = None
+    if HISTORY_DIR:
+        store = HistoryStore(HISTORY_DIR, segment_size=HISTORY_SEGMENT_SIZE,
+                keep=HISTORY_KEEP, compact_interval=CLEANUP_INTERVAL)
+    try:
+        if EVENT_LOOP == "asyncio":
+            asyncio.run(run_asyncio(self_ip, nick, store))
+        else:
+            run_selector(self_ip, nick, store)
+    finally:
+        if store is not None:
+            store.close()
+        print("Exited smplchat")
 
-    # autojoin ip if env for it set
-    if JOIN:
-        msg_list.sys_message(f"*** Join request sent to {str(JOIN)}")
-        dispatcher.send(
-                new_message(msg_type=MessageType.JOIN_REQUEST, nick=nick),
-                [JOIN])
+def run_selector(self_ip: IPv4Address, nick: str, store):
+    """ Main loop that sleeps in a selector between events """
+    # core initializations
+    if RECEIVE_WORKERS > 1:
+        # worker processes receive and relay, chat comes through a funnel
+        listener = WorkerPool(RECEIVE_WORKERS, self_ip)
+    else:
+        listener = Listener() # listening socket
+    send_queue = SendQueue(Sender(listener.sock)) # send from our listening port
+    node = NodeCore(self_ip, nick, Dispatcher(send_queue), store)
+    greet(node)
 
-    tui = UserInterface(msg_list, nick)
+    tui = UserInterface(node.msg_list, nick)
+    # sleeps until a datagram, a key press, a signal or the next timer
+    poller = Poller(listener, sys.stdin)
 
     # main event loop: processes messaging and tui input/output
     try:
@@ -68,163 +145,69 @@ def main():
 
             # Process input form listener
             for rx_msg, remote_ip in listener.get_messages():
-                msg = unpacker(rx_msg)
-
-                # keepalive relay
-                if isinstance(msg, KeepaliveRelayMessage):
-                    client_list.add(msg.sender_ip) # keepalive sender is alive
-                    if keepalive_list.seen_count(msg.uniq_msg_id) < RELAY_SEEN_LIMIT:
-                        dispatcher.send(msg, client_list.get(GOSSIP_FANOUT, exclude=remote_ip))
-                    keepalive_list.add(msg.uniq_msg_id)
-
-                # chat/join/leave relay
-                elif is_relay_message(msg):
-                    client_list.add(remote_ip) # relayer is alive
-                    # resend first 2 times
-                    if msg_list.seen_count(msg.uniq_msg_id) < RELAY_SEEN_LIMIT:
-                        # original sender is alive so add to the list
-                        client_list.add(msg.sender_ip)
-                        # relay messages to other peers
-                        dispatcher.send(
-                                msg, client_list.get(GOSSIP_FANOUT, exclude=remote_ip))
-                        msg_list.add(msg) # add or update seen counter
-
-                # join request
-                elif isinstance(msg, JoinRequestMessage):
-                    msg_list.sys_message(
-                            f"*** Join request from <{msg.sender_nick}>, "
-                            f"IP: {str(remote_ip)}")
-                    client_list.add(remote_ip)
-                    # Send join reply
-                    out_msg = new_message(msg_type=MessageType.JOIN_REPLY,
-                            ip=self_ip, msg_list=msg_list,
-                            client_list=client_list)
-                    dispatcher.send(out_msg, [remote_ip])
-                    # Send join relay message
-                    out_msg = new_message(msg_type=MessageType.JOIN_RELAY,
-                            nick=msg.sender_nick, ip=remote_ip,
-                            msg_list=msg_list )
-                    msg_list.add(out_msg)
-                    dispatcher.send(out_msg, client_list.get(GOSSIP_FANOUT))
-
-                # join reply to our join request
-                elif isinstance(msg, JoinReplyMessage):
-                    msg_list.sys_message(
-                            f"*** Join accepted {str(remote_ip)} ")
-                    client_list.add(remote_ip)
-                    client_list.add_list(msg.ip_addresses)
-
-                # old history reply and request
-                elif isinstance(msg, OldReplyMessage):
-                    msg_list.add(msg)
-
-                elif isinstance(msg, OldRequestMessage):
-                    found = msg_list.get_by_uid(msg.uniq_msg_id)
-                    if found is not None:
-                        msg = new_message(MessageType.OLD_REPLY,
-                                old_type=MessageType.CHAT_RELAY,
-                                uid=msg.uniq_msg_id,
-                                nick=found.nick, text=found.message)
-                        dispatcher.send(msg, [remote_ip])
+                try:
+                    node.receive(rx_msg, remote_ip, forward=not listener.relays)
+                except Exception as e:	# pylint: disable=broad-exception-caught
+                    # a bad datagram must not stop the main loop
+                    dprint(f"Dropped datagram from {remote_ip}: {e}")
 
             # Process input from UI
-            intxt = tui.update(nick)
-            if intxt is None:
-                pass
-
-            elif intxt.startswith("/quit"):
-                # sends leave relay message and quits app
-                msg = new_message(msg_type=MessageType.LEAVE_RELAY, nick=nick,
-                        ip=self_ip, msg_list=msg_list)
-                dispatcher.send(msg, client_list.get(GOSSIP_FANOUT))
-                tui.stop()
+            intxt = tui.update(node.nick)
+            if intxt is not None and not handle_input(node, intxt, (listener,)):
                 break
 
-            elif intxt.startswith("/nick"):
-                # changes nick and send chat relays message as system
-                new_nick = None
-                try:
-                    new_nick = intxt.split()[1]
-                except IndexError:
-                    msg_list.sys_message("*** Nick needs a name")
-                msg = new_message(
-                        msg_type=MessageType.CHAT_RELAY, nick="system",
-                        text=f"*** <{nick}> is now known as <{new_nick}>",
-                        ip=self_ip, msg_list=msg_list )
-                nick = new_nick
-                msg_list.add(msg)
-                dispatcher.send(msg, client_list.get(GOSSIP_FANOUT))
-
-            elif intxt.startswith("/help"):
-                initial_messages(msg_list)
-
-            elif intxt.startswith("/peers"):
-                peers = client_list.get_all()
-                if not peers:
-                    msg_list.sys_message("*** No known peers")
-                else:
-                    limit = 30
-                    peer_str = ", ".join(str(ip) for ip in peers[:limit]) # only ips for now
-                    if len(peers) > limit:
-                        peer_str += f", ... (+{len(peers) - limit} more)"
-                    msg_list.sys_message(
-                        f"*** Known peers ({len(peers)}): {peer_str}"
-                    )
-
-            elif intxt.startswith("/join"):
-                msg = new_message(msg_type=MessageType.JOIN_REQUEST, nick=nick)
-                remote_ip = None
-                try:
-                    remote_ip = IPv4Address(intxt.split()[1])
-                except IndexError:
-                    msg_list.sys_message("*** Join needs address")
-                except AddressValueError:
-                    msg_list.sys_message(
-                            f"*** Malformed address {intxt.split()[1]}")
-                if remote_ip:
-                    # clear messages before join if not already joined
-                    if not client_list.get(1):
-                        msg_list.clear_user_messages()
-                    msg_list.sys_message(
-                            f"*** Join request sent to {str(remote_ip)}")
-                    dispatcher.send(msg, [remote_ip])
-
-            else: # only text to send
-                msg = new_message(msg_type=MessageType.CHAT_RELAY, nick=nick,
-                        text=intxt, ip=self_ip, msg_list=msg_list)
-                msg_list.add(msg)
-                dispatcher.send(msg, client_list.get(GOSSIP_FANOUT))
-
-            # Fetch missing messages from peers
-            waiting_message = msg_list.get_waiting_message()
-            if waiting_message is not None:
-                msg = new_message(MessageType.OLD_REQUEST, uid=waiting_message)
-                dispatcher.send(msg,client_list.get(1))
-
-            now = time()
-
-            # keepalive check and dispatch
-            if now - last_keepalive >= KEEPALIVE_INTERVAL:
-                peers = client_list.get(GOSSIP_FANOUT)
-                if peers:
-                    ka_msg = new_message(
-                        msg_type=MessageType.KEEPALIVE_RELAY,
-                        ip=self_ip,
-                    )
-                    dispatcher.send(ka_msg, peers)
-                last_keepalive = now
-
-            # maintenance
-            if now - last_maintenance >= CLEANUP_INTERVAL:
-                keepalive_list.cleanup()
-                msg_list.cleanup()
-                client_list.cleanup()
-                last_maintenance = now
+            # keepalive, fetches, expiry and batched sends that are due
+            node.tick()
+
+            # sleep until something happens or the next timer is due;
+            # curses may hold more typed lines, so don't sleep after one,
+            # nor while received messages are still queued
+            if intxt is not None or len(listener):
+                continue
+            poller.wait(node.next_deadline())
     finally:
         # exit cleanup
+        poller.close()
+        send_queue.stop()
         listener.stop()
         tui.stop()
-        print("Exited smplchat")
+
+async def run_asyncio(self_ip: IPv4Address, nick: str, store):
+    """ Main loop on asyncio: AsyncNode does networking and timers, the
+        tui is updated on key presses and received datagrams """
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    node = AsyncNode(self_ip, nick, store=store, on_activity=wake.set)
+    await node.start()
+    greet(node.core)
+    node.core.dispatcher.flush()
+
+    tui = UserInterface(node.core.msg_list, nick)
+    quitting = []
+    def interrupt():
+        quitting.append(True)
+        wake.set()
+    loop.add_signal_handler(SIGINT, interrupt)
+    loop.add_reader(sys.stdin, wake.set)
+    try:
+        while True:
+            intxt = "/quit" if quitting else tui.update(node.core.nick)
+            if intxt is not None:
+                if not handle_input(node.core, intxt, (node,)):
+                    break
+                node.core.dispatcher.flush()
+                continue
+            # redraw at least once a second for expired and given up entries
+            wake.clear()
+            try:
+                await asyncio.wait_for(wake.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        loop.remove_reader(sys.stdin)
+        loop.remove_signal_handler(SIGINT)
+        await node.close(leave=False)
+        tui.stop()
 
 if __name__ == "__main__":
     main()
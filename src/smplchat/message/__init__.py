@@ -10,5 +10,12 @@ from .message import (
     JoinReplyMessage,
     OldRequestMessage,
     OldReplyMessage,
+    OldBatchRequestMessage,
+    OldBatchReplyMessage,
+    SnapshotMessage,
+    SnapshotNackMessage,
+    HelloMessage,
+    DigestMessage,
+    DigestReplyMessage,
     is_relay_message)
 from .message_gen import new_message
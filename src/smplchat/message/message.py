@@ -1,5 +1,5 @@
 """ smplchat.message - message dataclasses are defined here """
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import IntEnum
 from ipaddress import IPv4Address
 
@@ -13,10 +13,24 @@ class MessageType(IntEnum):
     JOIN_REPLY = 129
     OLD_REQUEST = 130
     OLD_REPLY = 131
+    HELLO = 132
+    BATCH = 133	# container of several messages, see udp_comms.packer
+    DIGEST = 134
+    DIGEST_REPLY = 135
+    OLD_BATCH_REQUEST = 136
+    OLD_BATCH_REPLY = 137
+    SNAPSHOT = 138
+    SNAPSHOT_NACK = 139
 
 @dataclass
 class Message:
-    """ message - basis for every type of message """
+    """ message - basis for every type of message
+
+        raw - packed bytes of the message once it has been packed or, for
+              relays, the datagram it was unpacked from. Don't change a
+              message after it has raw bytes.
+    """
+    raw: bytes | None = field(default=None, init=False, repr=False, compare=False)
 
 @dataclass
 class ChatRelayMessage(Message):
@@ -75,6 +89,53 @@ class OldReplyMessage(Message):
     sender_nick: str
     msg_text: str
 
+@dataclass
+class OldBatchRequestMessage(Message):
+    """ old batch request message - requests several messages by id """
+    uids: list[int]
+
+@dataclass
+class OldBatchReplyMessage(Message):
+    """ old batch reply message - (uid, nick, text) of requested messages """
+    messages: list[tuple[int, str, str]]
+
+@dataclass
+class SnapshotMessage(Message):
+    """ snapshot message - chunk seq of total of history sent to a joining
+                           node, (uid, nick, text) of messages in order """
+    snapshot_id: int
+    seq: int
+    total: int
+    messages: list[tuple[int, str, str]]
+
+@dataclass
+class SnapshotNackMessage(Message):
+    """ snapshot nack message - asks chunks seqs of snapshot again """
+    snapshot_id: int
+    seqs: list[int]
+
+@dataclass
+class HelloMessage(Message):
+    """ hello message - tells peer which protocol version we speak. Nodes
+                        that don't know it ignore it. """
+    version: int
+
+@dataclass
+class DigestMessage(Message):
+    """ digest message - summary of history for anti-entropy, list of
+                         (bucket, message count, hash) of time buckets
+                         newer than floor """
+    floor: int
+    buckets: list[tuple[int, int, int]]
+
+@dataclass
+class DigestReplyMessage(Message):
+    """ digest reply message - ids of messages we have in buckets that
+                               differ from the digest. Peer asks for the
+                               ones it lacks and tells the ids we lack. """
+    buckets: list[int]
+    uids: list[int]
+
 def is_relay_message(msg: Message):
     """ helper to figure out if message is relay type """
     return isinstance( msg, (
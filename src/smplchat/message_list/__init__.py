@@ -1,3 +1,4 @@
 """ message_list.__init__ - Handles message list updates and cleanups """
 from .list import MessageList, MessageEntry
 from .initial_messages import initial_messages
+from .store import HistoryStore
@@ -0,0 +1,282 @@
+""" chunked - Ordered entry storage split into bounded chunks """
+from itertools import chain
+
+CHUNK_SIZE = 256	# max entries in one chunk before it is split in half
+
+
+class ListChunk:
+    """ One run of consecutive entries kept as entry objects.
+
+        uids - uid of every entry (None if entry has no uid)
+        entries - the entries
+        lines - cached formatted lines or None if chunk has none cached
+    """
+    __slots__ = ("uids", "entries", "lines")
+
+    def __init__(self, uids=None, entries=None):
+        self.uids: list = uids or []
+        self.entries: list = entries or []
+        self.lines: list | None = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def uid_positions(self, start: int = 0) -> list[tuple[int, int]]:
+        """ (position, uid) of entries from position start on that have uid """
+        return [(i, u) for i, u in enumerate(self.uids[start:], start) if u is not None]
+
+    def get(self, i: int):
+        """ entry in position i """
+        return self.entries[i]
+
+    def set(self, i: int, entry):
+        """ replaces entry in position i """
+        self.entries[i] = entry
+
+    def bump_seen(self, i: int):
+        """ increments seen counter of entry in position i """
+        self.entries[i].seen += 1
+
+    def insert(self, i: int, entries: list):
+        """ inserts entries to position i """
+        self.uids[i:i] = [getattr(e, "uid", None) for e in entries]
+        self.entries[i:i] = entries
+
+    def remove(self, i: int):
+        """ removes entry in position i """
+        del self.uids[i]
+        del self.entries[i]
+
+    def split(self, i: int):
+        """ moves entries from position i onwards to a new chunk """
+        new = ListChunk(self.uids[i:], self.entries[i:])
+        del self.uids[i:]
+        del self.entries[i:]
+        return new
+
+    def drop_front(self, count: int) -> list[int]:
+        """ removes count first entries, returns their uids """
+        uids = [u for u in self.uids[:count] if u is not None]
+        del self.uids[:count]
+        del self.entries[:count]
+        return uids
+
+    def all_uids(self) -> list[int]:
+        """ uids of all entries that have one """
+        return [u for u in self.uids if u is not None]
+
+
+class ChunkedList:
+    """ ChunkedList - list of message entries that supports cheap inserts
+        in the middle and eviction from the front.
+
+        Entries are kept in chunks of at most CHUNK_SIZE entries. Inserting
+        touches only one chunk (split in two when it grows too large) and
+        evicting from the front drops whole chunks. Entries that have uid
+        attribute can be looked up and replaced by uid in constant time:
+        every uid is mapped to its chunk and position there, and every chunk
+        knows where it starts, so an insert renumbers only the rest of its
+        own chunk and the start of the chunks after it.
+
+        Formatted text lines are cached in the chunks that were shown last
+        time, so that only new and changed entries need to be formatted.
+
+        chunk_type decides how the entries are stored, see ListChunk.
+    """
+    def __init__(self, chunk_size: int = CHUNK_SIZE, chunk_type=ListChunk):
+        self.__chunk_size = chunk_size
+        self.__chunk_type = chunk_type
+        self.__chunks: list = []
+        self.__where: dict = {}		# uid -> (chunk, position in chunk)
+        self.__len = 0
+        self.__starts: dict = {}	# chunk -> start position counting evicted
+        self.__evicted = 0		# entries evicted from front ever
+        self.__shown: list = []		# chunks that have cached lines
+
+    def __len__(self):
+        return self.__len
+
+    def __iter__(self):
+        return chain.from_iterable(self.__chunks)
+
+    def __contains__(self, uid: int):
+        return uid in self.__where
+
+    def get(self, uid: int):
+        """ Returns entry of uid or None """
+        found = self.__where.get(uid)
+        if found is None:
+            return None
+        chunk, i = found
+        return chunk.get(i)
+
+    def position(self, uid: int) -> int | None:
+        """ Returns position of uid in the list or None """
+        found = self.__where.get(uid)
+        if found is None:
+            return None
+        chunk, i = found
+        return self.__starts[chunk] - self.__evicted + i
+
+    def __index(self, chunk, start: int = 0):
+        """ indexes uids of chunk from position start onwards """
+        for i, uid in chunk.uid_positions(start):
+            self.__where[uid] = (chunk, i)
+
+    def append(self, entry):
+        """ Appends entry to the end """
+        if not self.__chunks or len(self.__chunks[-1]) >= self.__chunk_size:
+            self.__chunks.append(self.__chunk_type())
+            self.__starts[self.__chunks[-1]] = self.__evicted + self.__len
+        chunk = self.__chunks[-1]
+        self.__insert(chunk, len(chunk), [entry])
+
+    def insert_before(self, uid: int, entries: list):
+        """ Inserts entries in order right before the entry of uid """
+        chunk, i = self.__where[uid]
+        self.__insert(chunk, i, entries)
+        if len(chunk) > self.__chunk_size:
+            self.__split(chunk)
+
+    def __insert(self, chunk, i: int, entries: list):
+        chunk.insert(i, entries)
+        if chunk.lines is not None:
+            chunk.lines[i:i] = [None] * len(entries)
+        self.__index(chunk, i)
+        self.__len += len(entries)
+        for later in reversed(self.__chunks):
+            if later is chunk:
+                break
+            self.__starts[later] += len(entries)
+
+    def __split(self, chunk):
+        """ Splits too large chunk to pieces of chunk_size/2 entries """
+        half = max(1, self.__chunk_size // 2)
+        self.__drop_lines(chunk)
+        pieces = []
+        while len(chunk) > half:
+            pieces.append(chunk.split(len(chunk) - half))
+        start = self.__starts[chunk] + len(chunk)
+        for piece in reversed(pieces):
+            self.__starts[piece] = start
+            start += len(piece)
+            self.__index(piece)
+        i = self.__chunks.index(chunk)
+        self.__chunks[i + 1:i + 1] = reversed(pieces)
+
+    def remove(self, uid: int):
+        """ Removes the entry of uid """
+        chunk, i = self.__where.pop(uid)
+        chunk.remove(i)
+        if chunk.lines is not None:
+            del chunk.lines[i]
+        self.__index(chunk, i)
+        self.__len -= 1
+        for later in reversed(self.__chunks):
+            if later is chunk:
+                break
+            self.__starts[later] -= 1
+        if not len(chunk):
+            self.__drop_lines(chunk)
+            self.__chunks.remove(chunk)
+            del self.__starts[chunk]
+
+    def replace(self, entry):
+        """ Replaces the entry that has the same uid """
+        chunk, i = self.__where[entry.uid]
+        chunk.set(i, entry)
+        if chunk.lines is not None:
+            chunk.lines[i] = None
+
+    def bump_seen(self, uid: int):
+        """ Increments seen counter of full message entry of uid """
+        chunk, i = self.__where[uid]
+        chunk.bump_seen(i)
+
+    def __unindex(self, uids):
+        for uid in uids:
+            del self.__where[uid]
+
+    def evict_front(self, count: int):
+        """ Removes count oldest entries """
+        count = min(count, self.__len)
+        self.__len -= count
+        self.__evicted += count
+        drop = 0
+        while drop < len(self.__chunks) and len(self.__chunks[drop]) <= count:
+            count -= len(self.__chunks[drop])
+            self.__unindex(self.__chunks[drop].all_uids())
+            self.__drop_lines(self.__chunks[drop])
+            del self.__starts[self.__chunks[drop]]
+            drop += 1
+        del self.__chunks[:drop]
+        if count:
+            chunk = self.__chunks[0]
+            self.__unindex(chunk.drop_front(count))
+            self.__index(chunk)
+            self.__starts[chunk] = self.__evicted
+            if chunk.lines is not None:
+                del chunk.lines[:count]
+
+    def retain(self, keep):
+        """ Keeps only the entries for which keep(entry) is true """
+        kept = [e for e in self if keep(e)]
+        self.clear()
+        for entry in kept:
+            self.append(entry)
+
+    def clear(self):
+        """ Removes everything """
+        self.__chunks.clear()
+        self.__where.clear()
+        self.__shown.clear()
+        self.__starts.clear()
+        self.__len = 0
+        self.__evicted = 0
+
+    def __tail_chunks(self, count: int) -> list[tuple[object, int]]:
+        """ (chunk, start position) pairs that cover last count entries """
+        ret = []
+        for chunk in reversed(self.__chunks):
+            if count <= 0:
+                break
+            ret.append((chunk, max(0, len(chunk) - count)))
+            count -= len(chunk)
+        ret.reverse()
+        return ret
+
+    def tail(self, count: int) -> list:
+        """ Returns last count entries in order """
+        return [chunk.get(i)
+                for chunk, start in self.__tail_chunks(count)
+                for i in range(start, len(chunk))]
+
+    def __drop_lines(self, chunk):
+        if chunk.lines is not None:
+            chunk.lines = None
+            self.__shown.remove(chunk)
+
+    def tail_lines(self, count: int, formatter) -> list:
+        """ Returns formatted lines of last count entries in order.
+            formatter(entry) is called only for entries without cached line.
+            Lines are cached only for the chunks shown by the latest call.
+        """
+        parts = self.__tail_chunks(count)
+        shown = [chunk for chunk, _ in parts]
+        for chunk in self.__shown:
+            if chunk not in shown:
+                chunk.lines = None
+        self.__shown = shown
+        ret = []
+        for chunk, start in parts:
+            if chunk.lines is None:
+                chunk.lines = [None] * len(chunk)
+            lines = chunk.lines
+            for i in range(start, len(lines)):
+                if lines[i] is None:
+                    lines[i] = formatter(chunk.get(i))
+            ret += lines[start:]
+        return ret
@@ -0,0 +1,170 @@
+""" columnar - Memory compact storage backend for MessageList
+
+    Instead of keeping an entry object per message, every chunk stores its
+    entries in typed array columns. Nicks are interned so that every
+    message of the same sender shares one string, and texts are kept
+    utf-8 encoded in one bytearray per chunk. Entry objects are built only
+    when somebody asks for them.
+"""
+from array import array
+from datetime import datetime
+from sys import intern
+from .chunked import ChunkedList, CHUNK_SIZE
+from .entries import (
+    FullMessageEntry,
+    WaitingMessageEntry,
+    GivenUpMessageEntry,
+    SystemMessageEntry)
+
+# values of the state column
+FULL, WAITING, GIVEN_UP, SYSTEM = range(4)
+
+
+class ColumnChunk:
+    """ One run of consecutive entries stored in columns
+
+        uids - uid of entry (0 for system messages)
+        seen - seen counter of full messages
+        state - one of FULL, WAITING, GIVEN_UP, SYSTEM
+        fetch - fetch counter of waiting messages
+        stamp - posix time of last fetch try or of system message
+        nicks - interned nicks (None if entry has no nick)
+        text_off, text_len - where the text is in blob
+        blob - utf-8 encoded texts, may contain garbage of removed entries
+        live - bytes of blob that belong to entries, the rest is garbage
+    """
+    __slots__ = ("uids", "seen", "state", "fetch", "stamp", "nicks",
+                 "text_off", "text_len", "blob", "live", "lines")
+
+    def __init__(self):
+        self.uids = array("Q")
+        self.seen = array("I")
+        self.state = array("B")
+        self.fetch = array("B")
+        self.stamp = array("d")
+        self.nicks: list[str | None] = []
+        self.text_off = array("I")
+        self.text_len = array("I")
+        self.blob = bytearray()
+        self.live = 0
+        self.lines: list | None = None
+
+    def __len__(self):
+        return len(self.state)
+
+    def __iter__(self):
+        return (self.get(i) for i in range(len(self)))
+
+    def uid_positions(self, start: int = 0) -> list[tuple[int, int]]:
+        """ (position, uid) of entries from position start on that have uid """
+        return [(i, u) for i, (u, s) in
+                enumerate(zip(self.uids[start:], self.state[start:]), start)
+                if s != SYSTEM]
+
+    def __text(self, i: int) -> str:
+        start = self.text_off[i]
+        return self.blob[start:start + self.text_len[i]].decode()
+
+    def get(self, i: int):
+        """ entry in position i """
+        state = self.state[i]
+        if state == FULL:
+            return FullMessageEntry(uid=self.uids[i], seen=self.seen[i],
+                                    nick=self.nicks[i], message=self.__text(i))
+        if state == WAITING:
+            return WaitingMessageEntry(uid=self.uids[i], fetch_count=self.fetch[i],
+                                       last_tried=datetime.fromtimestamp(self.stamp[i]))
+        if state == GIVEN_UP:
+            return GivenUpMessageEntry(uid=self.uids[i])
+        return SystemMessageEntry(message=self.__text(i),
+                                  timestamp=datetime.fromtimestamp(self.stamp[i]))
+
+    def __row(self, entry) -> tuple:
+        """ column values for entry, text appended to blob """
+        text = b""
+        if isinstance(entry, FullMessageEntry):
+            row = (entry.uid, entry.seen, FULL, 0, 0.0, intern(entry.nick))
+            text = entry.message.encode()
+        elif isinstance(entry, WaitingMessageEntry):
+            row = (entry.uid, 0, WAITING, min(entry.fetch_count, 255),
+                   entry.last_tried.timestamp(), None)
+        elif isinstance(entry, GivenUpMessageEntry):
+            row = (entry.uid, 0, GIVEN_UP, 0, 0.0, None)
+        else:
+            row = (0, 0, SYSTEM, 0, entry.timestamp.timestamp(), None)
+            text = entry.message.encode()
+        offset = len(self.blob)
+        self.blob += text
+        self.live += len(text)
+        return row + (offset, len(text))
+
+    def __columns(self):
+        return (self.uids, self.seen, self.state, self.fetch, self.stamp,
+                self.nicks, self.text_off, self.text_len)
+
+    def set(self, i: int, entry):
+        """ replaces entry in position i """
+        self.live -= self.text_len[i]
+        for column, value in zip(self.__columns(), self.__row(entry)):
+            column[i] = value
+        self.__compact()
+
+    def bump_seen(self, i: int):
+        """ increments seen counter of entry in position i """
+        self.seen[i] += 1
+
+    def insert(self, i: int, entries: list):
+        """ inserts entries to position i """
+        rows = [self.__row(e) for e in entries]
+        for column, values in zip(self.__columns(), zip(*rows)):
+            if isinstance(column, array):
+                values = array(column.typecode, values)
+            column[i:i] = values
+
+    def remove(self, i: int):
+        """ removes entry in position i """
+        self.live -= self.text_len[i]
+        for column in self.__columns():
+            del column[i]
+        self.__compact()
+
+    def split(self, i: int):
+        """ moves entries from position i onwards to a new chunk """
+        new = ColumnChunk()
+        new.insert(0, [self.get(j) for j in range(i, len(self))])
+        self.live -= new.live
+        for column in self.__columns():
+            del column[i:]
+        self.__compact()
+        return new
+
+    def drop_front(self, count: int) -> list[int]:
+        """ removes count first entries, returns their uids """
+        uids = [u for u, s in zip(self.uids[:count], self.state[:count]) if s != SYSTEM]
+        self.live -= sum(self.text_len[:count])
+        for column in self.__columns():
+            del column[:count]
+        self.__compact()
+        return uids
+
+    def all_uids(self) -> list[int]:
+        """ uids of all entries that have one """
+        return [u for u, s in zip(self.uids, self.state) if s != SYSTEM]
+
+    def __compact(self):
+        """ rewrites blob when more than half of it is garbage """
+        if self.live * 2 >= len(self.blob):
+            return
+        blob = bytearray()
+        for i, (start, length) in enumerate(zip(self.text_off, self.text_len)):
+            self.text_off[i] = len(blob)
+            blob += self.blob[start:start + length]
+        self.blob = blob
+
+
+class ColumnarList(ChunkedList):
+    """ ColumnarList - ChunkedList that stores entries in ColumnChunks.
+        Entries returned by it are copies, change them with replace() and
+        bump_seen(). """
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        super().__init__(chunk_size, chunk_type=ColumnChunk)
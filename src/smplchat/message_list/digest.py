@@ -0,0 +1,84 @@
+""" digest - time bucketed summaries of history for anti-entropy
+
+    Uids start with their creation time in seconds, so history is cut in
+    buckets of ANTI_ENTROPY_BUCKET seconds by uid alone. A bucket is
+    summarized by its message count and the XOR of its mixed uids, which
+    doesn't depend on the order messages arrived in. Nodes compare
+    summaries and then exchange uids of the differing buckets only.
+
+    Buckets up to a floor are left out of digests and comparisons: those
+    older than what a node has, so that only gaps get filled and history
+    doesn't grow backwards, and those it may have evicted partly.
+"""
+from smplchat.settings import ANTI_ENTROPY_BUCKET
+from smplchat.utils import get_time_from_uid
+
+MAX_BUCKETS = 64	# newest buckets in one digest, 16 bytes each
+MAX_REPLY_IDS = 256	# max uids in one digest reply
+_MASK = (1 << 64) - 1
+
+
+def bucket_of(uid: int, width: int = ANTI_ENTROPY_BUCKET) -> int:
+    """ Number of the time bucket of uid """
+    return get_time_from_uid(uid) // width
+
+
+def _mix(uid: int) -> int:
+    """ splitmix64 finalizer, spreads neighbouring uids over all bits """
+    uid = (uid ^ uid >> 30) * 0xbf58476d1ce4e5b9 & _MASK
+    uid = (uid ^ uid >> 27) * 0x94d049bb133111eb & _MASK
+    return uid ^ uid >> 31
+
+
+def summarize(uids, width: int = ANTI_ENTROPY_BUCKET) -> dict[int, tuple[int, int]]:
+    """ Returns bucket -> (message count, hash) of uids """
+    counts: dict[int, int] = {}
+    hashes: dict[int, int] = {}
+    for uid in uids:
+        bucket = get_time_from_uid(uid) // width
+        counts[bucket] = counts.get(bucket, 0) + 1
+        hashes[bucket] = hashes.get(bucket, 0) ^ _mix(uid)
+    return {bucket: (count, hashes[bucket]) for bucket, count in counts.items()}
+
+
+def make_digest(summary: dict[int, tuple[int, int]], floor: int = 0,
+                limit: int = MAX_BUCKETS) -> tuple[int, list[tuple[int, int, int]]]:
+    """ Returns floor and (bucket, count, hash) of at most limit newest
+        buckets newer than it. Floor is raised from the given one to the
+        bucket before the oldest of summary, or to the newest bucket left
+        out if there are more than limit. """
+    buckets = sorted(b for b in summary if b > floor)
+    if not buckets:
+        return floor, []
+    floor = max(floor, buckets[0] - 1, *buckets[-limit - 1:-limit])
+    return floor, [(b, *summary[b]) for b in buckets if b > floor]
+
+
+def differing(summary: dict[int, tuple[int, int]], own_floor: int, floor: int,
+              remote: list[tuple[int, int, int]]) -> list[int]:
+    """ Buckets newer than both floors whose summary differs from remote
+        digest, including buckets only one side has """
+    floor = max(floor, own_floor)
+    theirs = {b: (count, digest) for b, count, digest in remote if b > floor}
+    ours = {b for b in summary if b > floor}
+    return sorted(b for b in ours | theirs.keys() if summary.get(b) != theirs.get(b))
+
+
+def uids_in(uids: list[int], buckets: list[int], limit: int = MAX_REPLY_IDS,
+            width: int = ANTI_ENTROPY_BUCKET) -> tuple[list[int], list[int]]:
+    """ Returns buckets that fit and their uids, newest bucket first until
+        limit uids. A bucket alone larger than limit gives its newest uids. """
+    by_bucket: dict[int, list[int]] = {b: [] for b in buckets}
+    for uid in uids:
+        found = by_bucket.get(get_time_from_uid(uid) // width)
+        if found is not None:
+            found.append(uid)
+    kept: list[int] = []
+    ret: list[int] = []
+    for bucket in sorted(by_bucket, reverse=True):
+        found = by_bucket[bucket]
+        if kept and len(ret) + len(found) > limit:
+            break
+        kept.append(bucket)
+        ret.extend(found[-limit:])
+    return sorted(kept), sorted(ret)
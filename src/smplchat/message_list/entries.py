@@ -0,0 +1,55 @@
+""" entries - Entry types stored in the message list """
+from datetime import datetime
+from dataclasses import dataclass
+from typing import TypeAlias
+
+
+@dataclass
+class FullMessageEntry:
+    """ Entry in the message list
+    
+        Details:
+        uid - unique ID of message
+        seen - counter how many times message is added
+        nick - the nick of sender
+        message - message content
+    """
+    uid: int
+    seen: int
+    nick: str
+    message: str
+
+
+@dataclass
+class WaitingMessageEntry:
+    """ Message needs to be requested
+        
+        fetch_count - how many times we have already tried
+        last_tried - last time that old message request was sent
+    """
+    uid: int
+    fetch_count: int
+    last_tried: datetime
+
+@dataclass
+class GivenUpMessageEntry:
+    """ Message that we no longer try to request
+    """
+    uid: int
+
+
+@dataclass
+class SystemMessageEntry:
+    """ System message that is only intented for user information
+    
+        timestamp - only for user information
+    """
+    message: str
+    timestamp: datetime
+
+
+MessageEntry: TypeAlias = (
+        FullMessageEntry
+        | WaitingMessageEntry
+        | GivenUpMessageEntry
+        | SystemMessageEntry )
@@ -9,4 +9,5 @@ def initial_messages(ml: MessageList):
     ml.sys_message("/nick <nick>       - select nick for yourself")
     ml.sys_message("/quit              - quit the application")
     ml.sys_message("/peers             - list peers")
+    ml.sys_message("/stats             - show sent and dropped datagrams")
     ml.sys_message("<message>          - say something to others")
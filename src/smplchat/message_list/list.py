@@ -1,7 +1,6 @@
 """ list - Provides message list and methods to manipulate it """
-from datetime import datetime, timedelta
-from dataclasses import dataclass
-from typing import TypeAlias, List
+from datetime import datetime
+from itertools import islice
 
 from smplchat.message import (
     Message,
@@ -11,118 +10,135 @@ from smplchat.message import (
     JoinReplyMessage,
     OldReplyMessage)
 from smplchat.utils import dprint, get_time_from_uid
-from smplchat.settings import MAX_MESSAGES
-
-
-@dataclass
-class FullMessageEntry:
-    """ Entry in the message list
-    
-        Details:
-        uid - unique ID of message
-        seen - counter how many times message is added
-        nick - the nick of sender
-        message - message content
-    """
-    uid: int
-    seen: int
-    nick: str
-    message: str
-
-
-@dataclass
-class WaitingMessageEntry:
-    """ Message needs to be requested
-        
-        fetch_count - how many times we have already tried
-        last_tried - last time that old message request was sent
-    """
-    uid: int
-    fetch_count: int
-    last_tried: datetime
+from smplchat.settings import MAX_MESSAGES, MESSAGE_BACKEND
+from .entries import (
+    FullMessageEntry,
+    WaitingMessageEntry,
+    GivenUpMessageEntry,
+    SystemMessageEntry,
+    MessageEntry)
+from .chunked import ChunkedList
+from .columnar import ColumnarList
+from .retry import RetryScheduler
+from .store import HistoryStore
+
+
+def format_entry(msg: MessageEntry) -> str | None:
+    """ Formats message entry to line of text shown to user """
+    if isinstance(msg, FullMessageEntry):
+        time_str = (datetime
+                    .fromtimestamp(get_time_from_uid(msg.uid))
+                    .strftime("%H:%M:%S"))
+        return f"[{time_str}] {msg.nick}: {msg.message}"
+    if isinstance(msg, WaitingMessageEntry):
+        return "Message pending"
+    if isinstance(msg, GivenUpMessageEntry):
+        return "Failed to fetch message"
+    if isinstance(msg, SystemMessageEntry):
+        time_str = msg.timestamp.strftime("%H:%M:%S")
+        return f"[{time_str}] [System] {msg.message}"
+    return None
 
-@dataclass
-class GivenUpMessageEntry:
-    """ Message that we no longer try to request
-    """
-    uid: int
 
+class MessageList:
+    """ MessageList - The class for the list.
+
+        If store is given, full messages are also written to it and the
+        list works as a bounded hot cache on top of it: the newest stored
+        messages are loaded at start and get_by_uid finds also messages
+        that have already been cleaned up from the list.
 
-@dataclass
-class SystemMessageEntry:
-    """ System message that is only intented for user information
-    
-        timestamp - only for user information
+        If wheel (TimingWheel) is given, the list trims itself every second
+        from it, so cleanup() evicts only a few entries at a time.
     """
-    message: str
-    timestamp: datetime
-
+    def __init__(self, store: HistoryStore | None = None, wheel=None):
+        if MESSAGE_BACKEND == "columnar":
+            self.__messages = ColumnarList()
+        else:
+            self.__messages = ChunkedList()
+        self.__retry = RetryScheduler()	# when to request waiting messages
+        self.__store = store
+        self.__wheel = wheel
+        self.updated = False
+        self.horizon = 0	# newest uid evicted so far, history before it is partial
+        if wheel is not None:
+            wheel.schedule((self, "trim"), 1, self.__trim)
+        if store is not None:
+            for uid, nick, message in store.tail(MAX_MESSAGES):
+                self.__messages.append(FullMessageEntry(
+                    uid=uid, seen=1, nick=nick, message=message))
+            if len(store) > MAX_MESSAGES:
+                self.horizon = next((e.uid for e in self.__messages), 0)
+            self.updated = True
 
-MessageEntry: TypeAlias = (
-        FullMessageEntry
-        | WaitingMessageEntry
-        | GivenUpMessageEntry
-        | SystemMessageEntry )
+    def __known(self, uid: int) -> bool:
+        """ is uid in the list or in the store """
+        return uid in self.__messages or (
+                self.__store is not None and uid in self.__store)
 
+    def __stored(self, uid: int) -> FullMessageEntry | None:
+        """ entry of uid loaded from the store, None if it isn't stored """
+        if self.__store is None:
+            return None
+        found = self.__store.get(uid)
+        if found is None:
+            return None
+        return FullMessageEntry(uid=uid, seen=1, nick=found[0], message=found[1])
 
-class MessageList:
-    """ MessageList - The class for the list. """
-    def __init__(self):
-        self.__messages: List[MessageEntry] = []
-        self.updated = False
+    def __new_full(self, uid, nick, message) -> FullMessageEntry:
+        """ creates entry for message we got first time and stores it """
+        if self.__store is not None:
+            self.__store.put(uid, nick, message)
+        return FullMessageEntry(uid=uid, seen=1, nick=nick, message=message)
 
     def cleanup(self):
         """ cleanup - command that for example cuts a list that's too long"""
         if len(self.__messages) > MAX_MESSAGES:
-            self.__messages = self.__messages[-MAX_MESSAGES:]
+            count = len(self.__messages) - MAX_MESSAGES
+            self.horizon = max(self.horizon, *(getattr(e, "uid", 0)
+                    for e in islice(self.__messages, count)))
+            self.__messages.evict_front(count)
             self.updated = True
 
+    def __trim(self, key):
+        self.cleanup()
+        self.__wheel.schedule(key, 1, self.__trim)
+
     def clear_user_messages(self):
         """ Remove chat history but keep system messages (for joining a chat) """
-        self.__messages = [
-            m for m in self.__messages
-            if isinstance(m, SystemMessageEntry)
-        ]
+        self.__messages.retain(lambda m: isinstance(m, SystemMessageEntry))
+        self.__retry.clear()
         self.updated = True
 
     def __add_unseen_history(self, uid: int, history: list[int]):
         """ __add_unseen_history - adds unseen messages to
             the message list in corrent order and place. """
-        pos = self.find(uid)
-        new_entries = False
         # If this is not the first time we got the actual message
-        if self.__messages[pos].seen != 1:
+        if self.__messages.get(uid).seen != 1:
             return False
+        new_entries = {}
         for rcv_uid in history:
-            if self.find(rcv_uid) is None:
-                self.__messages.insert(
-                        pos,
-                        WaitingMessageEntry(rcv_uid, 0, datetime.now()))
-                pos += 1
-                new_entries = True
-        return new_entries
+            if not self.__known(rcv_uid) and rcv_uid not in new_entries:
+                new_entries[rcv_uid] = WaitingMessageEntry(rcv_uid, 0, datetime.now())
+        if not new_entries:
+            return False
+        self.__messages.insert_before(uid, list(new_entries.values()))
+        for rcv_uid in new_entries:
+            self.__retry.add(rcv_uid)
+        return True
 
     def __update_message(self, uid, nick, message):
         """ helper that tries to update entry """
-        pos = self.find(uid)
-        if pos is not None:
-            entry = self.__messages[pos]
+        entry = self.__messages.get(uid)
+        if entry is not None:
 
             if isinstance(entry, (WaitingMessageEntry, GivenUpMessageEntry)):
-                self.__messages[pos] = FullMessageEntry(
-                    uid=uid,
-                    seen=1,
-                    nick=nick,
-                    message=message)
+                self.__retry.discard(uid)
+                self.__messages.replace(self.__new_full(uid, nick, message))
                 self.updated = True
                 return True
             if isinstance(entry, FullMessageEntry):
-                seen = entry.seen
-                self.__messages[pos] = FullMessageEntry(
-                    uid=entry.uid,
-                    seen=seen + 1,
-                    nick=entry.nick,
-                    message=entry.message)
+                self.__messages.bump_seen(uid)
                 return True
         return False
 
@@ -153,24 +169,25 @@ class MessageList:
                 dprint("Got reply without asking")
                 return False
 
-            self.__messages.append(FullMessageEntry(
-                uid=uid,
-                seen=1,
-                nick=nick,
-                message=message))
+            self.__messages.append(self.__new_full(uid, nick, message))
             if hasattr(msg, "old_message_ids"):
                 self.__add_unseen_history(uid, msg.old_message_ids)
             self.updated = True
             return True
 
         if isinstance(msg, JoinReplyMessage):
-            waiting_for = map(
-                    lambda x: WaitingMessageEntry(
-                            uid=x,
-                            last_tried=datetime.now(),
-                            fetch_count=0),
-                    msg.old_message_ids)
-            self.__messages += waiting_for
+            for uid in msg.old_message_ids:
+                if uid in self.__messages:
+                    continue
+                stored = self.__stored(uid)	# back on screen after a clear
+                if stored is not None:
+                    self.__messages.append(stored)
+                    continue
+                self.__messages.append(WaitingMessageEntry(
+                        uid=uid,
+                        last_tried=datetime.now(),
+                        fetch_count=0))
+                self.__retry.add(uid)
             self.sys_message("*** Join request successful")
             self.updated = True
             return True
@@ -179,6 +196,79 @@ class MessageList:
         dprint(msg)
         return False
 
+    def add_missing(self, uids: list[int]) -> list[int]:
+        """ Adds uids that are not known as waiting messages to the end of
+            the list in the given order and gives given up ones another try.
+            Stored messages missing from the list are put back as they are.
+            Returns uids that are missing, new and already waiting ones. """
+        missing = []
+        for uid in dict.fromkeys(uids):
+            entry = self.__messages.get(uid)
+            if isinstance(entry, WaitingMessageEntry):
+                missing.append(uid)
+                continue
+            if isinstance(entry, GivenUpMessageEntry):
+                self.__messages.replace(WaitingMessageEntry(
+                        uid=uid, fetch_count=0, last_tried=datetime.now()))
+            elif entry is not None:
+                continue
+            elif (stored := self.__stored(uid)) is not None:
+                self.__messages.append(stored)
+                self.updated = True
+                continue
+            else:
+                self.__messages.append(WaitingMessageEntry(
+                        uid=uid, fetch_count=0, last_tried=datetime.now()))
+            self.__retry.add(uid)
+            missing.append(uid)
+            self.updated = True
+        return missing
+
+    def add_snapshot(self, messages: list[tuple[int, str, str]]) -> list[tuple[int, str, str]]:
+        """ Adds (uid, nick, text) history of another node in its order.
+            Waiting messages are filled in place and unknown ones go before
+            the next snapshot message that is in the list, or to the end.
+            Messages only in the store are put back the same way. A waiting
+            message that is before an earlier snapshot message in the list
+            is moved, so the snapshot keeps the order of its sender even
+            where uids of the same second don't.
+            Returns the messages that were new to us. """
+        new = []
+        before = []	# unknown entries waiting for their place
+        added = set()
+        last = -1	# position of the latest snapshot message in the list
+        for uid, nick, text in messages:
+            if uid in added:
+                continue
+            entry = self.__messages.get(uid)
+            placeholder = isinstance(entry, (WaitingMessageEntry, GivenUpMessageEntry))
+            if placeholder and self.__messages.position(uid) < last:
+                self.__messages.remove(uid)
+                self.__retry.discard(uid)
+                entry = None
+            if entry is None:
+                stored = self.__stored(uid)
+                if stored is None:
+                    stored = self.__new_full(uid, nick, text)
+                    new.append((uid, nick, text))
+                before.append(stored)
+                added.add(uid)
+                continue
+            if self.__messages.position(uid) < last:
+                continue	# shown already out of order, leave it be
+            if before:
+                self.__messages.insert_before(uid, before)
+                before = []
+            if placeholder:
+                self.__update_message(uid, nick, text)
+                new.append((uid, nick, text))
+            last = self.__messages.position(uid)
+        for entry in before:
+            self.__messages.append(entry)
+        if new or added:
+            self.updated = True
+        return new
+
     def sys_message(self, text):
         """ Appends system message to the end of message list"""
         self.__messages.append(
@@ -189,21 +279,15 @@ class MessageList:
         """ find - finds if there is already message of uid
             returns position in the list or None
         """
-        for i, entry in enumerate(self.__messages):
-            if hasattr(entry, "uid") and entry.uid == uid:
-                return i
-        return None
+        return self.__messages.position(uid)
 
     def seen_count(self, uid: int):
         """ seen_count - Returns how many times uid has seen """
-        for m in self.__messages:
-            if hasattr(m, "uid") and m.uid == uid:
-                return getattr(m, "seen", 0)
-        return 0
+        return getattr(self.__messages.get(uid), "seen", 0)
 
     def get(self):
         """ get - Gets current list """
-        return self.__messages
+        return list(self.__messages)
 
     def latest_ids(self, limit=None):
         """Returns latest IDs and has a limit function."""
@@ -214,51 +298,54 @@ class MessageList:
             return uid_list
         return uid_list[-limit:]
 
+    def latest_messages(self, limit: int) -> list[tuple[int, str, str]]:
+        """ Returns (uid, nick, text) of at most limit latest full messages
+            in list order """
+        if limit <= 0:
+            return []
+        ret = [(x.uid, x.nick, x.message)
+               for x in self.__messages
+               if isinstance(x, FullMessageEntry)]
+        return ret[-limit:]
+
     def get_waiting_message(self) -> int | None:
-        def __can_be_requested(item: tuple[int, MessageEntry]):
-            msg = item[1]
-            if not isinstance(msg, WaitingMessageEntry):
-                return False
-            return msg.last_tried < (datetime.now() - timedelta(seconds=1))
+        """ Returns uid of a missing message that should be requested now
+            or None if nothing is due. Gives up messages that have been
+            requested too many times. """
+        while (due := self.__retry.pop_due()) is not None:
+            uid, fetch_count = due
+            entry = self.__messages.get(uid)
+            if not isinstance(entry, WaitingMessageEntry):
+                # evicted or arrived meanwhile
+                self.__retry.discard(uid)
+                continue
+            if uid not in self.__retry:
+                # scheduler ran out of attempts
+                self.__messages.replace(GivenUpMessageEntry(uid))
+                self.updated = True
+                continue
+            self.__messages.replace(WaitingMessageEntry(
+                    uid=uid,
+                    fetch_count=fetch_count + 1,
+                    last_tried=datetime.now() ))
+            return uid
+        return None
 
-        e = enumerate(self.__messages)
-        waiting_messages: list[tuple[int, WaitingMessageEntry]] = (
-                list(filter(__can_be_requested, e)))
-        if not waiting_messages:
-            return None
-        last = waiting_messages[-1]
-        last_index = last[0]
-        last_msg = last[1]
-        if last_msg.fetch_count >= 4:
-            self.__messages[last_index] = GivenUpMessageEntry(last_msg.uid)
-        else:
-            self.__messages[last_index] = WaitingMessageEntry(
-                    uid=last_msg.uid,
-                    fetch_count=last_msg.fetch_count + 1,
-                    last_tried=datetime.now() )
-        self.updated = True
-        return last_msg.uid
-
-    def get_textual_contents(self) -> list[str]:
-        def __message_to_string(msg: MessageEntry) -> str:
-            if isinstance(msg, FullMessageEntry):
-                time_str = (datetime
-                            .fromtimestamp(get_time_from_uid(msg.uid))
-                            .strftime("%H:%M:%S"))
-                return f"[{time_str}] {msg.nick}: {msg.message}"
-            if isinstance(msg, WaitingMessageEntry):
-                return "Message pending"
-            if isinstance(msg, GivenUpMessageEntry):
-                return "Failed to fetch message"
-            if isinstance(msg, SystemMessageEntry):
-                time_str = msg.timestamp.strftime("%H:%M:%S")
-                return f"[{time_str}] [System] {msg.message}"
-            return None
+    def next_fetch(self) -> float | None:
+        """ Returns monotonic time when get_waiting_message has something
+            to return next, or None if no message is waiting """
+        return self.__retry.next_due()
 
-        return [ x for x in map(__message_to_string, self.__messages) if x ]
+    def get_textual_contents(self, limit: int | None = None) -> list[str]:
+        """ Returns messages as text lines, only last limit of them if given.
+            Lines are formatted once and cached until the entry changes. """
+        if limit is None:
+            limit = len(self.__messages)
+        return [x for x in self.__messages.tail_lines(limit, format_entry) if x]
 
     def get_by_uid(self, uid: int) -> FullMessageEntry | None:
-        for entry in self.__messages:
-            if isinstance(entry, FullMessageEntry) and entry.uid == uid:
-                return entry
-        return None
+        """ Returns full message entry of uid from the list or the store, or None """
+        entry = self.__messages.get(uid)
+        if isinstance(entry, FullMessageEntry):
+            return entry
+        return self.__stored(uid)
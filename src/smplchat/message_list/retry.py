@@ -0,0 +1,79 @@
+""" retry - Scheduler that decides when missing messages are requested """
+from heapq import heappush, heappop
+from random import uniform
+from time import monotonic
+from smplchat.settings import (
+    FETCH_BACKOFF_BASE,
+    FETCH_BACKOFF_FACTOR,
+    FETCH_BACKOFF_MAX,
+    FETCH_JITTER,
+    FETCH_GIVE_UP)
+
+
+class RetryScheduler:
+    """ RetryScheduler - min-heap of uids keyed on the time they can be
+        requested next. Delay grows exponentially with every attempt and
+        is randomized with jitter so that nodes don't retry in lockstep.
+
+        Removed uids are left in the heap and skipped when they surface.
+    """
+    def __init__(self, clock=None):
+        self.__clock = clock or monotonic
+        self.__heap: list[tuple[float, int]] = []
+        # uid -> (due time, requests sent so far). Heap items whose due time
+        # doesn't match this are stale and get skipped.
+        self.__pending: dict[int, tuple[float, int]] = {}
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def __contains__(self, uid: int):
+        return uid in self.__pending
+
+    @staticmethod
+    def delay(attempt: int) -> float:
+        """ Seconds to wait after attempt:th request """
+        base = min(FETCH_BACKOFF_MAX,
+                   FETCH_BACKOFF_BASE * FETCH_BACKOFF_FACTOR ** attempt)
+        return base * uniform(1 - FETCH_JITTER, 1 + FETCH_JITTER)
+
+    def __schedule(self, uid: int, attempts: int):
+        due = self.__clock() + self.delay(attempts)
+        self.__pending[uid] = (due, attempts)
+        heappush(self.__heap, (due, uid))
+
+    def add(self, uid: int):
+        """ Starts tracking uid, first request is due after initial delay """
+        if uid not in self.__pending:
+            self.__schedule(uid, 0)
+
+    def discard(self, uid: int):
+        """ Stops tracking uid (message arrived or was dropped) """
+        self.__pending.pop(uid, None)
+
+    def clear(self):
+        """ Forgets everything """
+        self.__heap.clear()
+        self.__pending.clear()
+
+    def next_due(self) -> float | None:
+        """ Returns clock time when next uid is due or None """
+        heap = self.__heap
+        while heap and self.__pending.get(heap[0][1], (None,))[0] != heap[0][0]:
+            heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_due(self) -> tuple[int, int] | None:
+        """ Returns (uid, requests sent so far) of an uid that is due now or
+            None. The uid is rescheduled, or forgotten if it has already used
+            all of its FETCH_GIVE_UP requests. """
+        due = self.next_due()
+        if due is None or due > self.__clock():
+            return None
+        _, uid = heappop(self.__heap)
+        attempts = self.__pending[uid][1]
+        if attempts >= FETCH_GIVE_UP:
+            del self.__pending[uid]
+        else:
+            self.__schedule(uid, attempts + 1)
+        return uid, attempts
@@ -0,0 +1,232 @@
+""" store - Persistent append-only history store for full messages
+
+    Messages are appended to segment files in a directory. Each record is
+
+        crc32   I  - 4 bytes, checksum of everything after it
+        uid     Q  - 8 bytes
+        nick    H  - 2 bytes, length of nick
+        text    L  - 4 bytes, length of text
+        ?s, ?s     - nick and text utf-8 encoded
+
+    The newest segment is written to, older ones are sealed and only read.
+    Reads go through mmap. An in-memory index maps uid to the segment and
+    offset of its latest record. A background thread compacts sealed
+    segments that are mostly superseded records and drops the oldest
+    segments when more than keep messages are stored.
+"""
+import os
+import threading
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from zlib import crc32
+from smplchat.utils import dprint
+
+_HEADER = Struct("!IQHL")
+_SUFFIX = ".seg"
+
+
+class HistoryStore:
+    """ HistoryStore - uid indexed on-disk storage of messages """
+    def __init__(self, path: str, segment_size: int = 4 * 1024 * 1024,
+                 keep: int = 1000000, compact_interval: float | None = 60):
+        self.__path = path
+        self.__segment_size = segment_size
+        self.__keep = keep
+        self.__lock = threading.Lock()
+        self.__index: dict[int, tuple[int, int]] = {}	# uid -> (segment, offset)
+        self.__records: dict[int, int] = {}	# segment -> records written
+        self.__live: dict[int, int] = {}	# segment -> records still indexed
+        self.__maps: dict[int, mmap] = {}
+        os.makedirs(path, exist_ok=True)
+        for seg in self.__segment_ids():
+            self.__load_segment(seg)
+        if not self.__records:
+            self.__records[0] = self.__live[0] = 0
+        self.__active = max(self.__records)
+        self.__file = open(self.__segment_path(self.__active), "ab")	# pylint: disable=consider-using-with
+
+        self.__stop = threading.Event()
+        self.__thread = None
+        if compact_interval:
+            self.__thread = threading.Thread(target=self.__compact_loop,
+                    args=(compact_interval,), name="history-compact", daemon=True)
+            self.__thread.start()
+
+    def __segment_ids(self) -> list[int]:
+        return sorted(int(name[:-len(_SUFFIX)]) for name in os.listdir(self.__path)
+                      if name.endswith(_SUFFIX) and name[:-len(_SUFFIX)].isdigit())
+
+    def __segment_path(self, seg: int) -> str:
+        return os.path.join(self.__path, f"{seg:08d}{_SUFFIX}")
+
+    @staticmethod
+    def __scan(data):
+        """ yields (offset, uid) of valid records, stops at first broken one """
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            crc, uid, nick_len, text_len = _HEADER.unpack_from(data, offset)
+            end = offset + _HEADER.size + nick_len + text_len
+            if end > len(data) or crc != crc32(data[offset + 4:end]):
+                return
+            yield offset, uid
+            offset = end
+
+    def __load_segment(self, seg: int):
+        """ indexes records of a segment found on disk """
+        path = self.__segment_path(seg)
+        with open(path, "rb") as f:
+            data = f.read()
+        end = 0
+        self.__records[seg] = self.__live[seg] = 0
+        for offset, uid in self.__scan(data):
+            self.__put_index(uid, seg, offset)
+            self.__records[seg] += 1
+            end = offset + _HEADER.size + sum(_HEADER.unpack_from(data, offset)[2:])
+        if end != len(data):
+            dprint(f"HistoryStore: dropping broken tail of {path}")
+            os.truncate(path, end)
+
+    def __put_index(self, uid: int, seg: int, offset: int):
+        old = self.__index.get(uid)
+        if old is not None:
+            self.__live[old[0]] -= 1
+        self.__index[uid] = (seg, offset)
+        self.__live[seg] += 1
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, uid: int):
+        return uid in self.__index
+
+    def put(self, uid: int, nick: str, text: str):
+        """ Appends message to the store """
+        nick_b = nick.encode()[:0xffff]
+        text_b = text.encode()
+        body = _HEADER.pack(0, uid, len(nick_b), len(text_b))[4:] + nick_b + text_b
+        with self.__lock:
+            if self.__file.tell() >= self.__segment_size:
+                self.__roll()
+            offset = self.__file.tell()
+            self.__file.write(crc32(body).to_bytes(4, "big") + body)
+            self.__file.flush()
+            self.__records[self.__active] += 1
+            self.__put_index(uid, self.__active, offset)
+
+    def __roll(self):
+        """ seals active segment and starts a new one """
+        self.__file.close()
+        self.__active += 1
+        self.__records[self.__active] = self.__live[self.__active] = 0
+        self.__file = open(self.__segment_path(self.__active), "ab")	# pylint: disable=consider-using-with
+
+    def __map(self, seg: int, end: int) -> mmap:
+        """ returns mmap of segment that covers at least end bytes """
+        m = self.__maps.get(seg)
+        if m is None or len(m) < end:
+            if m is not None:
+                m.close()
+            with open(self.__segment_path(seg), "rb") as f:
+                m = self.__maps[seg] = mmap(f.fileno(), 0, access=ACCESS_READ)
+        return m
+
+    def __read(self, seg: int, offset: int) -> tuple[int, str, str]:
+        m = self.__map(seg, offset + _HEADER.size)
+        _, uid, nick_len, text_len = _HEADER.unpack_from(m, offset)
+        start = offset + _HEADER.size
+        m = self.__map(seg, start + nick_len + text_len)
+        return (uid, m[start:start + nick_len].decode(),
+                m[start + nick_len:start + nick_len + text_len].decode())
+
+    def get(self, uid: int) -> tuple[str, str] | None:
+        """ Returns (nick, text) of uid or None """
+        with self.__lock:
+            where = self.__index.get(uid)
+            if where is None:
+                return None
+            return self.__read(*where)[1:]
+
+    def tail(self, count: int) -> list[tuple[int, str, str]]:
+        """ Returns up to count newest messages as (uid, nick, text) in the
+            order they were stored """
+        ret = []
+        with self.__lock:
+            for seg in sorted(self.__records, reverse=True):
+                if len(ret) >= count:
+                    break
+                if not self.__live[seg]:
+                    continue
+                m = self.__map(seg, self.__file.tell() if seg == self.__active else 0)
+                live = [(off, uid) for off, uid in self.__scan(m)
+                        if self.__index.get(uid) == (seg, off)]
+                ret.extend(self.__read(seg, off) for off, _ in reversed(live))
+        return list(reversed(ret[:count]))
+
+    def compact(self):
+        """ Drops oldest segments over the keep limit and rewrites sealed
+            segments that are mostly superseded records """
+        with self.__lock:
+            sealed = sorted(s for s in self.__records if s != self.__active)
+        excess = len(self) - self.__keep
+        for seg in sealed:
+            if excess > 0:
+                with self.__lock:
+                    excess -= self.__live[seg]
+                    self.__drop_segment(seg)
+            elif self.__live[seg] * 2 < self.__records[seg]:
+                self.__rewrite_segment(seg)
+
+    def __drop_segment(self, seg: int):
+        if self.__live[seg]:
+            for off, uid in list(self.__scan(self.__map(seg, 0))):
+                if self.__index.get(uid) == (seg, off):
+                    del self.__index[uid]
+        self.__close_map(seg)
+        del self.__records[seg], self.__live[seg]
+        os.unlink(self.__segment_path(seg))
+
+    def __close_map(self, seg: int):
+        m = self.__maps.pop(seg, None)
+        if m is not None:
+            m.close()
+
+    def __rewrite_segment(self, seg: int):
+        """ copies live records of sealed segment to a new file and swaps it
+            in place. Runs mostly without the lock, only the swap holds it. """
+        path = self.__segment_path(seg)
+        moved = []
+        with open(path, "rb") as f, open(path + ".tmp", "wb") as out:
+            data = f.read()
+            for off, uid in self.__scan(data):
+                if self.__index.get(uid) == (seg, off):
+                    end = off + _HEADER.size + sum(_HEADER.unpack_from(data, off)[2:])
+                    moved.append((uid, off, out.tell()))
+                    out.write(data[off:end])
+            out.flush()
+            os.fsync(out.fileno())
+        with self.__lock:
+            self.__close_map(seg)
+            os.replace(path + ".tmp", path)
+            self.__records[seg] = self.__live[seg] = 0
+            for uid, old, new in moved:
+                self.__records[seg] += 1
+                if self.__index.get(uid) == (seg, old):
+                    self.__index[uid] = (seg, new)
+                    self.__live[seg] += 1
+
+    def __compact_loop(self, interval: float):
+        while not self.__stop.wait(interval):
+            try:
+                self.compact()
+            except OSError as e:
+                dprint(f"HistoryStore: compaction failed: {e}")
+
+    def close(self):
+        """ Stops compaction and closes files """
+        self.__stop.set()
+        if self.__thread:
+            self.__thread.join()
+        with self.__lock:
+            self.__file.close()
+            for seg in list(self.__maps):
+                self.__close_map(seg)
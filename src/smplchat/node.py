@@ -0,0 +1,391 @@
+""" node.py - the chat node without any I/O loop of its own """
+from ipaddress import IPv4Address
+from random import choice
+from time import monotonic
+from smplchat.message_list import MessageList
+from smplchat.message_list.digest import (
+        summarize,
+        make_digest,
+        differing,
+        uids_in,
+        bucket_of)
+from smplchat.udp_comms import (
+        Dispatcher,
+        unpacker,
+        peek_header,
+        old_batch_replies,
+        DIGEST_VERSION,
+        OLD_BATCH_VERSION,
+        SNAPSHOT_VERSION)
+from smplchat.message import (
+        Message,
+        MessageType,
+        ChatRelayMessage,
+        KeepaliveRelayMessage,
+        JoinRequestMessage,
+        JoinReplyMessage,
+        OldRequestMessage,
+        OldReplyMessage,
+        OldBatchRequestMessage,
+        OldBatchReplyMessage,
+        SnapshotMessage,
+        SnapshotNackMessage,
+        HelloMessage,
+        DigestMessage,
+        DigestReplyMessage,
+        is_relay_message,
+        new_message)
+from smplchat.client_list import ClientList, KeepaliveList, RelayDedup, TimingWheel
+from smplchat.snapshot import SnapshotSender, SnapshotReceiver
+from smplchat.settings import (
+        GOSSIP_FANOUT,
+        RELAY_SEEN_LIMIT,
+        KEEPALIVE_INTERVAL,
+        ANTI_ENTROPY_INTERVAL,
+        FETCH_BATCH,
+        BATCH_MTU,
+        SNAPSHOT_SIZE)
+
+# chat/join/leave relays, deduplicated with relay_dedup
+RELAY_TYPES = (MessageType.CHAT_RELAY, MessageType.JOIN_RELAY, MessageType.LEAVE_RELAY)
+# an old batch reply shares a BATCH datagram, which adds type and length
+OLD_BATCH_MTU = BATCH_MTU - 3
+
+
+class NodeCore:
+    """ NodeCore - state and protocol logic of one chat node.
+
+        Does no I/O of its own: received messages are given to receive(),
+        everything is sent through dispatcher, and the owner calls tick()
+        when next_deadline() has passed. The same core is driven by the
+        selector loop of main and by the asyncio AsyncNode.
+
+        Callbacks given to subscribe() are called with every chat message
+        (ChatRelayMessage or OldReplyMessage) delivered from other nodes.
+
+        Missing messages are fetched FETCH_BATCH at a time with one
+        OLD_BATCH_REQUEST from peers of OLD_BATCH_VERSION, which answer
+        with as few MTU sized OLD_BATCH_REPLYs as fit. Older peers are
+        asked one OLD_REQUEST per message.
+
+        A join request from a peer of SNAPSHOT_VERSION is answered also
+        with a snapshot stream of our SNAPSHOT_SIZE latest messages, so
+        the joining node gets its backlog complete and in order at once
+        instead of fetching it (see snapshot).
+
+        Every ANTI_ENTROPY_INTERVAL a digest of our history is sent to a
+        random peer that speaks DIGEST_VERSION. It answers with the ids it
+        has in buckets that differ, we request the ones we lack from it
+        and tell it the ids it lacks, so both end up with the union
+        however many messages were missed (see message_list.digest).
+    """
+    def __init__(self, self_ip: IPv4Address, nick: str, dispatcher: Dispatcher,
+                 store=None, clock=None):
+        self.__clock = clock or monotonic
+        self.self_ip = self_ip
+        self.nick = nick
+        self.dispatcher = dispatcher
+        self.wheel = TimingWheel(clock=clock) # expires peers, keepalives and old messages
+        self.client_list = ClientList(self_ip, self.wheel)
+        self.msg_list = MessageList(store, self.wheel)
+        self.keepalive_list = KeepaliveList(clock=clock, wheel=self.wheel)
+        self.relay_dedup = RelayDedup(clock=clock) # seen counts of chat/join/leave relays
+        self.__last_keepalive = self.__clock()
+        self.__subscribers = []
+        self.__snapshots_out = SnapshotSender(clock=clock)
+        self.__snapshots_in = SnapshotReceiver(clock=clock)
+        if ANTI_ENTROPY_INTERVAL > 0:
+            self.wheel.schedule((self, "anti-entropy"), ANTI_ENTROPY_INTERVAL,
+                                self.__anti_entropy)
+
+    def subscribe(self, callback):
+        """ Calls callback(msg) for every chat message delivered """
+        self.__subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """ Stops calling callback """
+        self.__subscribers.remove(callback)
+
+    def __deliver(self, msg: Message):
+        for callback in list(self.__subscribers):
+            callback(msg)
+
+    def receive(self, rx_msg: bytes | memoryview, remote_ip: IPv4Address,
+                forward: bool = True):
+        """ Handles one received message. Relays are forwarded to peers
+            only if forward, receive workers have done it already.
+            rx_msg is not kept, it may be a view to a reused buffer. """
+        # drop relays already seen enough times before decoding them
+        msg_type, uid = peek_header(rx_msg)
+        if msg_type == MessageType.KEEPALIVE_RELAY:
+            if self.keepalive_list.seen_count(uid) >= RELAY_SEEN_LIMIT:
+                return
+        elif msg_type in RELAY_TYPES:
+            if self.relay_dedup.seen_count(uid) >= RELAY_SEEN_LIMIT:
+                self.client_list.add(remote_ip) # relayer is alive
+                return
+
+        msg = unpacker(rx_msg)
+        if isinstance(msg, KeepaliveRelayMessage):
+            self.__keepalive(msg, remote_ip, forward)
+        elif is_relay_message(msg):
+            self.__relay(msg, remote_ip, forward)
+        else:
+            handler = self.__handlers.get(type(msg))
+            if handler is not None:
+                handler(self, msg, remote_ip)
+
+    def __keepalive(self, msg: KeepaliveRelayMessage, remote_ip: IPv4Address, forward: bool):
+        """ keepalive relay """
+        self.client_list.add(msg.sender_ip) # keepalive sender is alive
+        if self.keepalive_list.add(msg.uniq_msg_id) < RELAY_SEEN_LIMIT and forward:
+            self.dispatcher.send(msg.raw, self.client_list.get(GOSSIP_FANOUT, exclude=remote_ip))
+
+    def __relay(self, msg: Message, remote_ip: IPv4Address, forward: bool):
+        """ chat/join/leave relay """
+        self.client_list.add(remote_ip) # relayer is alive
+        # resend first 2 times
+        seen = self.relay_dedup.add(msg.uniq_msg_id)
+        if seen < RELAY_SEEN_LIMIT:
+            # original sender is alive so add to the list
+            self.client_list.add(msg.sender_ip)
+            # relay messages to other peers as they came in
+            if forward:
+                self.dispatcher.send(
+                        msg.raw, self.client_list.get(GOSSIP_FANOUT, exclude=remote_ip))
+            self.msg_list.add(msg) # add or update seen counter
+            if seen == 0 and isinstance(msg, ChatRelayMessage):
+                self.__deliver(msg)
+
+    def __join_request(self, msg: JoinRequestMessage, remote_ip: IPv4Address):
+        msg_list = self.msg_list
+        dispatcher = self.dispatcher
+        msg_list.sys_message(
+                f"*** Join request from <{msg.sender_nick}>, "
+                f"IP: {str(remote_ip)}")
+        self.client_list.add(remote_ip)
+        # Send join reply
+        out_msg = new_message(msg_type=MessageType.JOIN_REPLY,
+                ip=self.self_ip, msg_list=msg_list,
+                client_list=self.client_list)
+        dispatcher.send(out_msg, [remote_ip])
+        # Stream history to the new node
+        if SNAPSHOT_SIZE > 0 and dispatcher.version(remote_ip) >= SNAPSHOT_VERSION:
+            for chunk in self.__snapshots_out.start(
+                    remote_ip, msg_list.latest_messages(SNAPSHOT_SIZE), OLD_BATCH_MTU):
+                dispatcher.send(chunk, [remote_ip])
+        # Send join relay message
+        out_msg = new_message(msg_type=MessageType.JOIN_RELAY,
+                nick=msg.sender_nick, ip=remote_ip,
+                msg_list=msg_list )
+        msg_list.add(out_msg)
+        self.relay_dedup.add(out_msg.uniq_msg_id)
+        dispatcher.send(out_msg, self.client_list.get(GOSSIP_FANOUT))
+
+    def __join_reply(self, msg: JoinReplyMessage, remote_ip: IPv4Address):
+        """ join reply to our join request, fetch its history right away
+            unless a snapshot is on its way (retries fetch what it misses) """
+        self.msg_list.sys_message(
+                f"*** Join accepted {str(remote_ip)} ")
+        self.client_list.add(remote_ip)
+        self.client_list.add_list(msg.ip_addresses)
+        missing = self.msg_list.add_missing(msg.old_message_ids)
+        if self.dispatcher.version(remote_ip) < SNAPSHOT_VERSION:
+            self.fetch(missing, remote_ip)
+
+    def __snapshot(self, msg: SnapshotMessage, remote_ip: IPv4Address):
+        """ history snapshot stream to our join request """
+        messages = self.__snapshots_in.add(remote_ip, msg)
+        if messages is not None:
+            self.__install_snapshot(messages)
+
+    def __snapshot_nack(self, msg: SnapshotNackMessage, remote_ip: IPv4Address):
+        for chunk in self.__snapshots_out.resend(remote_ip, msg):
+            self.dispatcher.send(chunk, [remote_ip])
+
+    def __hello(self, msg: HelloMessage, remote_ip: IPv4Address):
+        """ protocol version of peer """
+        self.dispatcher.hello_from(remote_ip, msg.version)
+
+    def __old_reply(self, msg: OldReplyMessage, _remote_ip: IPv4Address | None = None):
+        new = self.msg_list.get_by_uid(msg.uniq_msg_id) is None
+        self.msg_list.add(msg)
+        if new and self.msg_list.get_by_uid(msg.uniq_msg_id) is not None:
+            self.__deliver(msg)
+
+    def __old_batch_reply(self, msg: OldBatchReplyMessage, remote_ip: IPv4Address):
+        for uid, nick, text in msg.messages:
+            self.__old_reply(OldReplyMessage(uid, nick, text), remote_ip)
+
+    def __old_request(self, msg: OldRequestMessage, remote_ip: IPv4Address):
+        found = self.msg_list.get_by_uid(msg.uniq_msg_id)
+        if found is not None:
+            reply = new_message(MessageType.OLD_REPLY,
+                    old_type=MessageType.CHAT_RELAY,
+                    uid=msg.uniq_msg_id,
+                    nick=found.nick, text=found.message)
+            self.dispatcher.send(reply, [remote_ip])
+
+    def __old_batch_request(self, msg: OldBatchRequestMessage, remote_ip: IPv4Address):
+        found = [(entry.uid, entry.nick, entry.message)
+                 for entry in map(self.msg_list.get_by_uid, msg.uids) if entry is not None]
+        for reply in old_batch_replies(found, OLD_BATCH_MTU):
+            self.dispatcher.send(reply, [remote_ip])
+
+    def __digest(self, msg: DigestMessage, remote_ip: IPv4Address):
+        """ anti-entropy, answer digest with our ids in differing buckets """
+        uids = self.msg_list.latest_ids()
+        summary = summarize(uids)
+        floor, _ = make_digest(summary, bucket_of(self.msg_list.horizon))
+        buckets = differing(summary, floor, msg.floor, msg.buckets)
+        if buckets:
+            buckets, uids = uids_in(uids, buckets)
+            self.dispatcher.send(DigestReplyMessage(buckets, uids), [remote_ip])
+
+    def __digest_reply(self, msg: DigestReplyMessage, remote_ip: IPv4Address):
+        """ request ids we lack and tell the ones peer lacks """
+        self.fetch(self.msg_list.add_missing(msg.uids), remote_ip)
+        if msg.buckets:
+            theirs = set(msg.uids)
+            _, uids = uids_in(self.msg_list.latest_ids(), msg.buckets)
+            uids = [uid for uid in uids if uid not in theirs]
+            if uids:
+                self.dispatcher.send(DigestReplyMessage([], uids), [remote_ip])
+
+    # message class -> handler of other than relay messages
+    __handlers = {
+        JoinRequestMessage: __join_request,
+        JoinReplyMessage: __join_reply,
+        SnapshotMessage: __snapshot,
+        SnapshotNackMessage: __snapshot_nack,
+        HelloMessage: __hello,
+        OldReplyMessage: __old_reply,
+        OldBatchReplyMessage: __old_batch_reply,
+        OldRequestMessage: __old_request,
+        OldBatchRequestMessage: __old_batch_request,
+        DigestMessage: __digest,
+        DigestReplyMessage: __digest_reply,
+    }
+
+    def __install_snapshot(self, messages: list[tuple[int, str, str]]):
+        for uid, nick, text in self.msg_list.add_snapshot(messages):
+            self.__deliver(OldReplyMessage(uid, nick, text))
+
+    def fetch(self, uids: list[int], remote_ip: IPv4Address):
+        """ Requests messages uids from remote_ip, in batches if it
+            understands them """
+        if self.dispatcher.version(remote_ip) >= OLD_BATCH_VERSION:
+            for i in range(0, len(uids), FETCH_BATCH):
+                self.dispatcher.send(
+                        OldBatchRequestMessage(uids[i:i + FETCH_BATCH]), [remote_ip])
+            return
+        for uid in uids:
+            msg = new_message(MessageType.OLD_REQUEST, uid=uid)
+            self.dispatcher.send(msg, [remote_ip])
+
+    def post(self, text: str) -> ChatRelayMessage:
+        """ Sends a chat message of our own """
+        msg = new_message(msg_type=MessageType.CHAT_RELAY, nick=self.nick,
+                text=text, ip=self.self_ip, msg_list=self.msg_list)
+        self.msg_list.add(msg)
+        self.relay_dedup.add(msg.uniq_msg_id)
+        self.dispatcher.send(msg, self.client_list.get(GOSSIP_FANOUT))
+        return msg
+
+    def rename(self, new_nick: str):
+        """ Changes nick and tells others with a system chat relay """
+        msg = new_message(
+                msg_type=MessageType.CHAT_RELAY, nick="system",
+                text=f"*** <{self.nick}> is now known as <{new_nick}>",
+                ip=self.self_ip, msg_list=self.msg_list )
+        self.nick = new_nick
+        self.msg_list.add(msg)
+        self.relay_dedup.add(msg.uniq_msg_id)
+        self.dispatcher.send(msg, self.client_list.get(GOSSIP_FANOUT))
+
+    def join(self, remote_ip: IPv4Address):
+        """ Sends join request to remote_ip """
+        msg = new_message(msg_type=MessageType.JOIN_REQUEST, nick=self.nick)
+        self.__snapshots_in.expect(remote_ip)
+        self.dispatcher.send(msg, [remote_ip])
+
+    def leave(self):
+        """ Sends leave relay and everything still queued """
+        msg = new_message(msg_type=MessageType.LEAVE_RELAY, nick=self.nick,
+                ip=self.self_ip, msg_list=self.msg_list)
+        self.dispatcher.send(msg, self.client_list.get(GOSSIP_FANOUT))
+        self.dispatcher.flush()
+
+    def send_keepalive(self):
+        """ Sends keepalive relay to some peers """
+        peers = self.client_list.get(GOSSIP_FANOUT)
+        if peers:
+            ka_msg = new_message(
+                msg_type=MessageType.KEEPALIVE_RELAY,
+                ip=self.self_ip,
+            )
+            self.dispatcher.send(ka_msg, peers)
+        self.__last_keepalive = self.__clock()
+
+    def send_digest(self) -> IPv4Address | None:
+        """ Sends digest of our history to a random peer that understands
+            it, returns the peer or None if there is none """
+        peers = [ip for ip in self.client_list.get_all()
+                 if self.dispatcher.version(ip) >= DIGEST_VERSION]
+        if not peers:
+            return None
+        peer = choice(peers)
+        floor, buckets = make_digest(summarize(self.msg_list.latest_ids()),
+                                     bucket_of(self.msg_list.horizon))
+        self.dispatcher.send(DigestMessage(floor, buckets), [peer])
+        return peer
+
+    def __anti_entropy(self, key):
+        self.send_digest()
+        self.wheel.schedule(key, ANTI_ENTROPY_INTERVAL, self.__anti_entropy)
+
+    def maintain(self):
+        """ Requests missing messages and expires what is due """
+        # Fetch missing messages that are due from a random peer
+        due = []
+        while (waiting_message := self.msg_list.get_waiting_message()) is not None:
+            due.append(waiting_message)
+        peers = self.client_list.get(1)
+        if due and peers:
+            self.fetch(due, peers[0])
+
+        # ask missing snapshot chunks again or take what arrived
+        nacks, given_up = self.__snapshots_in.poll()
+        for peer, nack in nacks:
+            self.dispatcher.send(nack, [peer])
+        for messages in given_up:
+            self.__install_snapshot(messages)
+
+        # expire peers, keepalives and old messages that are due
+        self.wheel.advance()
+
+    def tick(self):
+        """ Runs keepalive and maintenance if due and sends messages
+            queued for batching """
+        if self.__clock() - self.__last_keepalive >= KEEPALIVE_INTERVAL:
+            self.send_keepalive()
+        self.maintain()
+        self.dispatcher.flush()
+
+    def next_keepalive(self) -> float:
+        """ Returns clock time when next keepalive is due """
+        return self.__last_keepalive + KEEPALIVE_INTERVAL
+
+    def next_maintenance(self) -> float | None:
+        """ Returns clock time of next fetch retry, snapshot chunk
+            request or timer, or None """
+        deadlines = [d for d in (self.wheel.next_deadline(), self.msg_list.next_fetch(),
+                                 self.__snapshots_in.next_deadline())
+                     if d is not None]
+        return min(deadlines, default=None)
+
+    def next_deadline(self) -> float:
+        """ Returns clock time when tick() should be called next """
+        due = self.next_maintenance()
+        keepalive = self.next_keepalive()
+        return keepalive if due is None else min(due, keepalive)
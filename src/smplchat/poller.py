@@ -0,0 +1,67 @@
+""" poller.py - waiting for input, timers and signals without busy polling """
+import selectors
+import signal
+import socket
+from time import monotonic
+
+
+class Poller:
+    """ Poller - blocks the main loop until a watched file is readable,
+        a signal arrives or a deadline passes.
+
+        Files are anything with fileno(): sockets, sys.stdin. Signals with
+        a Python handler (like SIGINT of the tui) wake wait() through a
+        socketpair given to signal.set_wakeup_fd, so their effect is seen
+        right away and not only on the next timeout. Other threads can
+        wake it with wake().
+    """
+    def __init__(self, *files, clock=None):
+        self.__clock = clock or monotonic
+        self.__selector = selectors.DefaultSelector()
+        for f in files:
+            self.__selector.register(f, selectors.EVENT_READ)
+        self.__wake_r, self.__wake_w = socket.socketpair()
+        self.__wake_r.setblocking(False)
+        self.__wake_w.setblocking(False)
+        self.__selector.register(self.__wake_r, selectors.EVENT_READ)
+        self.__old_wakeup = None
+        try:
+            self.__old_wakeup = signal.set_wakeup_fd(self.__wake_w.fileno())
+        except ValueError:
+            pass	# not in main thread, signals are seen on next wake up
+
+    def wake(self):
+        """ Makes a waiting or the next wait() return at once """
+        try:
+            self.__wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass	# already woken
+
+    def wait(self, deadline: float | None = None) -> list:
+        """ Waits until a file is readable, wake() or a signal, or until
+            deadline (clock time, None waits forever). Returns readable
+            files. """
+        timeout = None if deadline is None else max(0.0, deadline - self.__clock())
+        ready = []
+        for key, _ in self.__selector.select(timeout):
+            if key.fileobj is self.__wake_r:
+                self.__drain()
+            else:
+                ready.append(key.fileobj)
+        return ready
+
+    def __drain(self):
+        try:
+            while self.__wake_r.recv(512):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        """ Restores signal wakeup and closes everything of our own """
+        if self.__old_wakeup is not None:
+            signal.set_wakeup_fd(self.__old_wakeup)
+            self.__old_wakeup = None
+        self.__selector.close()
+        self.__wake_r.close()
+        self.__wake_w.close()
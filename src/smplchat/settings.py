@@ -9,19 +9,54 @@ settings = {
 
 # network settings
 "PORT": (int, 62733),		# adjust listener port
+"EVENT_LOOP": (str, "selector"),	# main loop: "selector" or "asyncio"
+"BATCH_MTU": (int, 1400),	# max bytes of UDP payload when messages are batched
+"SEND_BUFFER": (int, 0),	# SO_SNDBUF of sending socket in bytes, 0 keeps system default
+"SEND_QUEUE_LIMIT": (int, 10000),	# max datagrams waiting to be sent
+"SEND_RATE": (int, 0),	# max datagrams sent per second, 0 means no limit
+"PEER_SEND_RATE": (int, 0),	# max datagrams sent per second to one peer, 0 means no limit
+"RECEIVE_QUEUE": (int, 10000),	# max received messages waiting to be handled
+"RECEIVE_DROP_POLICY": (str, "keepalives"),	# when full drop "oldest" or "keepalives" first
+"RECEIVE_BUFFER": (int, 0),	# SO_RCVBUF of listening socket in bytes, 0 keeps system default
+"RECEIVE_SLOTS": (int, 8),	# 256 KiB receive buffers preallocated by Listener
+"RECEIVE_WORKERS": (int, 0),	# over 1 receives and relays with this many SO_REUSEPORT processes
 
 # gossip protocol parameters
 "GOSSIP_FANOUT": (int, 2),	# how many random peers gossipped to
 "RELAY_SEEN_LIMIT": (int, 2),	# seen limit for a chat/join/leave/keepalive relay
+"DEDUP_CAPACITY": (int, 100000),	# max chat/join/leave relay uids remembered for seen limit
+"DEDUP_GENERATIONS": (int, 4),	# remembered uids are dropped one generation at a time
+"DEDUP_ROTATE_INTERVAL": (int, 120),	# seconds before new generation is started
 
 # timeout settings (seconds)
 "NODE_TIMEOUT": (int, 300),	# After 300s we can assume connection is lost
 "KEEPALIVE_INTERVAL": (int, 2),	# keepalive's interval
 "CLEANUP_INTERVAL": (int, 60),	# how often list cleanup (msg, keepalive, client) occurs
+"KEEPALIVE_BUCKETS": (int, 10),	# keepalive uids expire in this many steps over NODE_TIMEOUT
+"KEEPALIVE_CAPACITY": (int, 200000),	# max keepalive uids remembered
 
 # message history settings
 "LATEST_LIMIT": (int, 50),	# latest msgs spread with relays, also affects JOIN_REPLY
 "MAX_MESSAGES": (int, 2000),	# max number of messages in history, can be >2000 before cleanup
+"MESSAGE_BACKEND": (str, "chunked"),	# "chunked" (entry objects) or "columnar" (compact arrays)
+"ANTI_ENTROPY_INTERVAL": (int, 10),	# seconds between history digests to a random peer, 0 disables
+"ANTI_ENTROPY_BUCKET": (int, 60),	# seconds of history summarized by one digest bucket
+"SNAPSHOT_SIZE": (int, 500),	# latest messages streamed to a joining node, 0 disables
+"SNAPSHOT_NACK_DELAY": (float, 0.05),	# seconds without chunks before missing ones are asked
+"SNAPSHOT_RETRIES": (int, 5),	# times missing chunks are asked before giving up
+
+# persistent history (messages are kept only in memory if HISTORY_DIR is not set)
+"HISTORY_DIR": (str, None),	# directory for on-disk history segments
+"HISTORY_SEGMENT_SIZE": (int, 4194304),	# bytes written to a segment before starting new one
+"HISTORY_KEEP": (int, 1000000),	# max number of messages kept on disk
+
+# missing message fetch settings (delay = BASE * FACTOR^attempt, max MAX, +-JITTER)
+"FETCH_BACKOFF_BASE": (float, 1.0),	# seconds before first request of missing message
+"FETCH_BACKOFF_FACTOR": (float, 2.0),	# delay multiplier for every further request
+"FETCH_BACKOFF_MAX": (float, 30.0),	# upper limit for delay between requests
+"FETCH_JITTER": (float, 0.2),	# random +-20% to delays
+"FETCH_GIVE_UP": (int, 4),	# requests sent before message is given up
+"FETCH_BATCH": (int, 128),	# max ids asked in one OLD_BATCH_REQUEST
 
 # optional overrides mainy for testing (leave as is to use default behaviour)
 "DEBUG": (str, None),		# set to something to print out DEBUG information to stderr
@@ -51,13 +86,44 @@ def env_or_default(var):
 
 GOSSIP_FANOUT = env_or_default("GOSSIP_FANOUT")
 RELAY_SEEN_LIMIT = env_or_default("RELAY_SEEN_LIMIT")
+DEDUP_CAPACITY = env_or_default("DEDUP_CAPACITY")
+DEDUP_GENERATIONS = env_or_default("DEDUP_GENERATIONS")
+DEDUP_ROTATE_INTERVAL = env_or_default("DEDUP_ROTATE_INTERVAL")
 NODE_TIMEOUT = env_or_default("NODE_TIMEOUT")
 KEEPALIVE_INTERVAL = env_or_default("KEEPALIVE_INTERVAL")
 CLEANUP_INTERVAL = env_or_default("CLEANUP_INTERVAL")
+KEEPALIVE_BUCKETS = env_or_default("KEEPALIVE_BUCKETS")
+KEEPALIVE_CAPACITY = env_or_default("KEEPALIVE_CAPACITY")
 LATEST_LIMIT = env_or_default("LATEST_LIMIT")
 MAX_MESSAGES = env_or_default("MAX_MESSAGES")
+MESSAGE_BACKEND = env_or_default("MESSAGE_BACKEND")
+ANTI_ENTROPY_INTERVAL = env_or_default("ANTI_ENTROPY_INTERVAL")
+ANTI_ENTROPY_BUCKET = env_or_default("ANTI_ENTROPY_BUCKET")
+SNAPSHOT_SIZE = env_or_default("SNAPSHOT_SIZE")
+SNAPSHOT_NACK_DELAY = env_or_default("SNAPSHOT_NACK_DELAY")
+SNAPSHOT_RETRIES = env_or_default("SNAPSHOT_RETRIES")
+HISTORY_DIR = env_or_default("HISTORY_DIR")
+HISTORY_SEGMENT_SIZE = env_or_default("HISTORY_SEGMENT_SIZE")
+HISTORY_KEEP = env_or_default("HISTORY_KEEP")
+FETCH_BACKOFF_BASE = env_or_default("FETCH_BACKOFF_BASE")
+FETCH_BACKOFF_FACTOR = env_or_default("FETCH_BACKOFF_FACTOR")
+FETCH_BACKOFF_MAX = env_or_default("FETCH_BACKOFF_MAX")
+FETCH_JITTER = env_or_default("FETCH_JITTER")
+FETCH_GIVE_UP = env_or_default("FETCH_GIVE_UP")
+FETCH_BATCH = env_or_default("FETCH_BATCH")
 DEBUG = env_or_default("DEBUG")
 PORT = env_or_default("PORT")
+BATCH_MTU = env_or_default("BATCH_MTU")
+SEND_BUFFER = env_or_default("SEND_BUFFER")
+EVENT_LOOP = env_or_default("EVENT_LOOP")
+SEND_QUEUE_LIMIT = env_or_default("SEND_QUEUE_LIMIT")
+SEND_RATE = env_or_default("SEND_RATE")
+PEER_SEND_RATE = env_or_default("PEER_SEND_RATE")
+RECEIVE_QUEUE = env_or_default("RECEIVE_QUEUE")
+RECEIVE_DROP_POLICY = env_or_default("RECEIVE_DROP_POLICY")
+RECEIVE_BUFFER = env_or_default("RECEIVE_BUFFER")
+RECEIVE_SLOTS = env_or_default("RECEIVE_SLOTS")
+RECEIVE_WORKERS = env_or_default("RECEIVE_WORKERS")
 DROP_PERCENT = env_or_default("DROP_PERCENT")
 NICK = env_or_default("NICK")
 JOIN = env_or_default("JOIN")
@@ -0,0 +1,134 @@
+""" snapshot.py - history snapshot stream to a joining node
+
+    The node accepting a join sends its recent history with full nick and
+    text as numbered SNAPSHOT chunks right after JOIN_REPLY. The joining
+    node collects chunks and, once it has heard nothing new for
+    SNAPSHOT_NACK_DELAY, asks the missing ones again with a SNAPSHOT_NACK,
+    at most SNAPSHOT_RETRIES times. A complete snapshot (or what arrived
+    of it when retries run out) is added to history in the order sent.
+"""
+from ipaddress import IPv4Address
+from random import getrandbits
+from time import monotonic
+
+from smplchat.message import SnapshotMessage, SnapshotNackMessage
+from smplchat.settings import SNAPSHOT_NACK_DELAY, SNAPSHOT_RETRIES
+from smplchat.udp_comms import snapshot_chunks
+
+SNAPSHOT_KEEP = 30	# seconds sent chunks are kept for retransmission
+SNAPSHOT_WAIT = 10	# seconds a join waits for the first chunk
+MAX_SNAPSHOTS = 16	# snapshots kept for retransmission at once
+MAX_NACK = 512		# chunk numbers asked in one SNAPSHOT_NACK
+
+
+class SnapshotSender:
+    """ SnapshotSender - keeps chunks of sent snapshots for a while so
+        that missing ones can be sent again """
+    def __init__(self, clock=None):
+        self.__clock = clock or monotonic
+        # (peer, snapshot id) -> (expiry time, chunks)
+        self.__sent: dict[tuple[IPv4Address, int], tuple[float, list[SnapshotMessage]]] = {}
+
+    def __len__(self):
+        return len(self.__sent)
+
+    def start(self, peer: IPv4Address, messages: list[tuple[int, str, str]],
+              mtu: int) -> list[SnapshotMessage]:
+        """ Makes a new snapshot of (uid, nick, text) messages for peer and
+            returns its chunks of at most mtu bytes to be sent """
+        now = self.__clock()
+        for key, (expires, _) in list(self.__sent.items()):
+            if expires <= now:
+                del self.__sent[key]
+        while len(self.__sent) >= MAX_SNAPSHOTS:
+            del self.__sent[next(iter(self.__sent))]
+        snapshot_id = getrandbits(32)
+        chunks = snapshot_chunks(snapshot_id, messages, mtu)
+        self.__sent[(peer, snapshot_id)] = (now + SNAPSHOT_KEEP, chunks)
+        return chunks
+
+    def resend(self, peer: IPv4Address, nack: SnapshotNackMessage) -> list[SnapshotMessage]:
+        """ Returns chunks asked again by nack, none if the snapshot is gone """
+        found = self.__sent.get((peer, nack.snapshot_id))
+        if found is None or found[0] <= self.__clock():
+            return []
+        chunks = found[1]
+        return [chunks[seq] for seq in dict.fromkeys(nack.seqs) if seq < len(chunks)]
+
+
+class _Incoming:
+    """ chunks of one snapshot being received """
+    __slots__ = ("total", "chunks", "due", "nacks")
+
+    def __init__(self, total: int, due: float):
+        self.total = total
+        self.chunks: dict[int, list[tuple[int, str, str]]] = {}
+        self.due = due	# when missing chunks are asked next
+        self.nacks = 0
+
+    def missing(self) -> list[int]:
+        """ numbers of chunks not received yet """
+        return [seq for seq in range(self.total) if seq not in self.chunks]
+
+    def messages(self) -> list[tuple[int, str, str]]:
+        """ messages of received chunks in the order sent """
+        return [m for seq in sorted(self.chunks) for m in self.chunks[seq]]
+
+
+class SnapshotReceiver:
+    """ SnapshotReceiver - collects snapshot chunks from peers we have
+        sent a join request to """
+    def __init__(self, clock=None):
+        self.__clock = clock or monotonic
+        self.__expected: dict[IPv4Address, float] = {}	# peer -> wait deadline
+        self.__incoming: dict[tuple[IPv4Address, int], _Incoming] = {}
+
+    def expect(self, peer: IPv4Address):
+        """ Accepts a snapshot from peer for a while """
+        self.__expected[peer] = self.__clock() + SNAPSHOT_WAIT
+
+    def add(self, peer: IPv4Address, chunk: SnapshotMessage
+            ) -> list[tuple[int, str, str]] | None:
+        """ Adds a received chunk, returns all messages of the snapshot in
+            order once it is complete """
+        now = self.__clock()
+        key = (peer, chunk.snapshot_id)
+        incoming = self.__incoming.get(key)
+        if incoming is None:
+            if self.__expected.pop(peer, 0) < now or not chunk.total:
+                return None	# not asked for
+            incoming = self.__incoming[key] = _Incoming(chunk.total, 0.0)
+        if chunk.seq >= incoming.total:
+            return None
+        incoming.chunks[chunk.seq] = chunk.messages
+        if len(incoming.chunks) == incoming.total:
+            del self.__incoming[key]
+            return incoming.messages()
+        incoming.due = now + SNAPSHOT_NACK_DELAY
+        return None
+
+    def poll(self) -> tuple[list[tuple[IPv4Address, SnapshotNackMessage]],
+                            list[list[tuple[int, str, str]]]]:
+        """ Returns (peer, nack) to send for snapshots that have waited
+            long enough, and messages of snapshots given up on """
+        now = self.__clock()
+        nacks = []
+        given_up = []
+        for key, incoming in list(self.__incoming.items()):
+            if incoming.due > now:
+                continue
+            if incoming.nacks >= SNAPSHOT_RETRIES:
+                del self.__incoming[key]
+                given_up.append(incoming.messages())
+                continue
+            incoming.nacks += 1
+            incoming.due = now + SNAPSHOT_NACK_DELAY * 2 ** incoming.nacks
+            nacks.append((key[0], SnapshotNackMessage(key[1], incoming.missing()[:MAX_NACK])))
+        for peer, deadline in list(self.__expected.items()):
+            if deadline < now:
+                del self.__expected[peer]
+        return nacks, given_up
+
+    def next_deadline(self) -> float | None:
+        """ Returns clock time when poll has something to do next, or None """
+        return min((i.due for i in self.__incoming.values()), default=None)
@@ -174,8 +174,8 @@ class UserInterface:
             return
         self.messages.updated = False
         self._windows.msg_win.erase()
-        lines = self.messages.get_textual_contents()
         msg_h, msg_w = self._windows.msg_win.getmaxyx()
+        lines = self.messages.get_textual_contents(msg_h)
         start = max(0, len(lines) - msg_h)
         shown = lines[start: start + msg_h]
         for i, line in enumerate(shown):
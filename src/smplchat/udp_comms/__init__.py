@@ -3,6 +3,20 @@
 """
 from .dispatcher import Dispatcher
 from .listener import Listener
+from .sender import Sender
+from .send_queue import SendQueue
+from .workers import WorkerPool
 from .packer import (
     packer,
-    unpacker)
+    unpacker,
+    peek_header,
+    is_compact,
+    to_legacy,
+    pack_batches,
+    split_batch,
+    old_batch_replies,
+    snapshot_chunks,
+    PROTOCOL_VERSION,
+    DIGEST_VERSION,
+    OLD_BATCH_VERSION,
+    SNAPSHOT_VERSION)
@@ -2,34 +2,112 @@
 from random import random
 from ipaddress import IPv4Address
 from socket import socket, AF_INET, SOCK_DGRAM
-from smplchat.settings import PORT, DROP_PERCENT
-from smplchat.message import Message
-from .packer import packer
+from smplchat.settings import DROP_PERCENT, BATCH_MTU
+from smplchat.message import Message, HelloMessage
+from .packer import (
+    packer,
+    pack_hello_message,
+    pack_batches,
+    is_compact,
+    to_legacy,
+    PROTOCOL_VERSION,
+    COMPACT_VERSION,
+    BATCH_VERSION)
+from .sender import Sender
+from .send_queue import traffic_class
 
 class Dispatcher:
-    """ Class for sending UPD packets """
-    def __init__(self):
-        # possible permanent socket for very large scale use or due to firewall issues
-        #self._sock = socket(AF_INET, SOCK_DGRAM)
-        pass
+    """ Class for sending UPD packets
 
-    def send(self, msg: Message, ips: list[IPv4Address]):
-        """ Method for sending a UPD packet """
+        Every peer is sent a HELLO with our PROTOCOL_VERSION before the
+        first message. Peers that answer with version 2 or newer get id
+        lists in compact form, others (and peers not heard from yet) get
+        the original format.
+
+        Messages to peers of version 3 or newer are queued and sent by
+        flush(), packed together in BATCH datagrams of at most BATCH_MTU
+        bytes, most important traffic class first. Call flush() once per
+        main loop round.
+
+        Everything goes out through sender, by default one socket of our
+        own that is kept open until close().
+    """
+    def __init__(self, sender: Sender | None = None):
+        self.__own_sock = None
+        if sender is None:
+            self.__own_sock = socket(AF_INET, SOCK_DGRAM)
+            self.__own_sock.setblocking(False)
+            sender = Sender(self.__own_sock)
+        self.sender = sender
+        self.__versions: dict[IPv4Address, int] = {}	# ip -> version from HELLO
+        self.__greeted: set[IPv4Address] = set()	# ips we have sent HELLO
+        self.__queued: dict[IPv4Address, list[bytes]] = {}	# ip -> messages to batch
+        self.__hello = pack_hello_message(HelloMessage(PROTOCOL_VERSION))
+
+    def hello_from(self, ip: IPv4Address, version: int, answer: bool = True):
+        """ Records protocol version of peer and answers with our HELLO if
+            we haven't greeted it yet. answer=False records only, when
+            the HELLO is answered by somebody else. """
+        self.__versions[ip] = version
+        if ip not in self.__greeted:
+            self.__greeted.add(ip)
+            if answer:
+                self.sender.sendto(self.__hello, ip)
+
+    def version(self, ip: IPv4Address) -> int:
+        """ Protocol version of peer, 1 until it has sent HELLO """
+        return self.__versions.get(ip, 1)
+
+    def send(self, msg: Message | bytes, ips: list[IPv4Address]):
+        """ Method for sending a UPD packet. msg is packed only once and
+            the bytes are kept in msg.raw, received messages are sent as
+            they came in. Compact messages are repacked for old peers. """
 
         #FOR TESTING: Drop packets intentionally to simulate unreliable network
         if DROP_PERCENT and random()*100 < DROP_PERCENT:
             return
 
-        with socket(AF_INET, SOCK_DGRAM) as sock:	# new UDP socket
-            for ip in ips:
-                sock.sendto( packer(msg), (str(ip), PORT) )
-
-    # Uncomment this and comment out above send to use permanent socket:
-    #def send(self, msg: Message, ips: list[IPv4Address]):
-    #    """ Method for sending a UPD packet (permanent socket version) """
-    #    for ip in ips:
-    #        self._sock.sendto(packer(msg), (str(ip), PORT))
-    #
-    #def close(self):
-    #    """ Socket cleanup, insert this at the main.py cleanup """
-    #    self._sock.close()
+        if not ips:
+            return
+        versions = [self.version(ip) for ip in ips]
+        compact = [v >= COMPACT_VERSION for v in versions]
+        legacy = None
+        if isinstance(msg, bytes):
+            data = msg
+        elif msg.raw is not None:
+            data = msg.raw
+        elif any(compact):
+            data = msg.raw = packer(msg, compact=True)
+        else:
+            data = legacy = msg.raw = packer(msg)
+        if legacy is None:
+            legacy = data
+            if not all(compact) and is_compact(data):
+                legacy = to_legacy(data) if isinstance(msg, bytes) else packer(msg)
+
+        now = []
+        for ip, version in zip(ips, versions):
+            out = data if version >= COMPACT_VERSION else legacy
+            if version >= BATCH_VERSION:
+                self.__queued.setdefault(ip, []).append(out)
+                continue
+            if ip not in self.__greeted:
+                self.__greeted.add(ip)
+                now.append((self.__hello, ip))
+            now.append((out, ip))
+        self.sender.send_batch(now)
+
+    def flush(self):
+        """ Sends queued messages, batched per peer """
+        if not self.__queued:
+            return
+        queued, self.__queued = self.__queued, {}
+        self.sender.send_batch((packet, ip)
+                               for ip, messages in queued.items()
+                               for packet in pack_batches(
+                                   sorted(messages, key=traffic_class), BATCH_MTU))
+
+    def close(self):
+        """ Closes the socket if it is our own """
+        if self.__own_sock is not None:
+            self.__own_sock.close()
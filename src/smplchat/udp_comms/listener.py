@@ -1,56 +1,250 @@
 """ listener.py - smplchat.listener """
+import os
 import socket
-import threading
+from collections import deque
 from ipaddress import IPv4Address
-from threading import Lock
 
-from smplchat.settings import PORT
+from smplchat.settings import (
+    PORT,
+    RECEIVE_QUEUE,
+    RECEIVE_DROP_POLICY,
+    RECEIVE_BUFFER,
+    RECEIVE_SLOTS)
+from smplchat.message import MessageType
 from smplchat.utils import dprint
+from .packer import split_batch
+
+MAX_RECEIVE = 512	# messages returned by one get_messages call
+MAX_DATAGRAM = 10000	# longer datagrams are truncated
+SLOT_SIZE = 256 * 1024	# bytes of one receive buffer slot
+MAX_ADDRESSES = 65536	# cached sender addresses
+DROP_POLICIES = ("oldest", "keepalives")
+
+
+def kernel_drops(sock: socket.socket) -> int | None:
+    """ Datagrams the kernel has dropped for sock because its receive
+        buffer was full, from /proc/net/udp. None if not known. """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        with open("/proc/net/udp", encoding="ascii") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 12 and fields[9] == inode:
+                    return int(fields[12])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class _Slot:
+    """ preallocated receive buffer, datagrams are received back to back """
+    __slots__ = ("view", "used", "live")
+
+    def __init__(self):
+        self.view = memoryview(bytearray(SLOT_SIZE))
+        self.used = 0	# bytes filled
+        self.live = 0	# queued messages that point here
 
 class Listener:
-    """ Listener - a class for receiving UDP packets """
-    def __init__(self, self_ip: IPv4Address = IPv4Address("0.0.0.0")):
-        self.__msg_queue: list[tuple[bytes, IPv4Address]] = []
-        self.__msg_lock: Lock = threading.Lock()
+    """ Listener - a class for receiving UDP packets
+
+        The socket is non-blocking and nothing runs in the background:
+        wait for it to become readable (it has fileno(), so a selector can
+        watch it) and then read what has arrived with get_messages().
+
+        Received messages wait in a queue of at most capacity messages, so
+        that a stalled main loop can't make memory grow and what gets
+        dropped is chosen by drop_policy instead of the kernel:
+        "oldest" drops the oldest message, "keepalives" drops the oldest
+        keepalive relay first, which matter least once they are late.
+        Keepalives are returned after other messages. Each call reads the
+        socket empty (or enough to refill the queue), so newer messages
+        push out older ones and not the other way round.
+
+        Datagrams are received with recvfrom_into straight into a ring of
+        preallocated buffer slots and messages are memoryviews to them, so
+        receiving allocates next to nothing. A slot is reused once all of
+        its messages have been handed out, which means that messages from
+        get_messages are valid only until the next call; copy what must
+        be kept. When all slots hold queued messages, the ones left in the
+        oldest slot are copied out so that it can be reused: the slots
+        bound memory of the common case, the queue capacity bounds intake.
+        No more slots are kept than capacity datagrams can fill. Sender
+        addresses are cached.
+    """
+    relays = False	# messages are not forwarded before get_messages
 
+    def __init__(self, self_ip: IPv4Address = IPv4Address("0.0.0.0"),
+                 capacity: int = RECEIVE_QUEUE, drop_policy: str = RECEIVE_DROP_POLICY,
+                 rcvbuf: int = RECEIVE_BUFFER, slots: int = RECEIVE_SLOTS):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {drop_policy}")
         self.__port = PORT
         self._sock = socket.socket(type=socket.SOCK_DGRAM)
+        if rcvbuf:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
         address = (str(self_ip), self.__port)
         self._sock.bind(address)
-        self._sock.settimeout(0.1)
+        self._sock.setblocking(False)
 
-        self.__stop = False
-        self.__thread = threading.Thread(target=self.__listener_loop, name="listener")
-        self.__thread.start()
+        self.__capacity = max(1, capacity)
+        self.__keepalives_first = drop_policy == "keepalives"
+        # (arrival number, message, ip, slot), keepalives in a queue of their own
+        self.__messages: deque[tuple[int, memoryview, IPv4Address, _Slot]] = deque()
+        self.__keepalives: deque[tuple[int, memoryview, IPv4Address, _Slot]] = deque()
+        # copied out of reused slots (slot None), older than the ones above
+        self.__spilled_messages: deque[tuple[int, memoryview, IPv4Address, None]] = deque()
+        self.__spilled_keepalives: deque[tuple[int, memoryview, IPv4Address, None]] = deque()
+        self.__arrived = 0
+        slots = min(slots, -(-self.__capacity * MAX_DATAGRAM // SLOT_SIZE))
+        self.__free = [_Slot() for _ in range(max(2, slots))]
+        self.__slot = self.__free.pop()	# being filled
+        self.__handed: list[_Slot] = []	# full slots with queued messages
+        self.__addresses: dict[str, IPv4Address] = {}
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.max_depth = 0
 
-    def __listener_loop(self):
-        while not self.__stop:
+    @property
+    def sock(self) -> socket.socket:
+        """ The bound socket, can be shared with Sender """
+        return self._sock
+
+    def fileno(self) -> int:
+        """ File descriptor of the socket, for selectors """
+        return self._sock.fileno()
+
+    def __len__(self):
+        return (len(self.__messages) + len(self.__keepalives)
+                + len(self.__spilled_messages) + len(self.__spilled_keepalives))
+
+    def __address(self, ip: str) -> IPv4Address:
+        addr = self.__addresses.get(ip)
+        if addr is None:
+            if len(self.__addresses) >= MAX_ADDRESSES:
+                self.__addresses.clear()
+            addr = self.__addresses[ip] = IPv4Address(ip)
+        return addr
+
+    def __room(self):
+        """ makes room for a datagram, spills the oldest slot if all
+            slots hold queued messages """
+        slot = self.__slot
+        if SLOT_SIZE - slot.used >= MAX_DATAGRAM:
+            return
+        if not slot.live:
+            slot.used = 0
+            return
+        if not self.__free:
+            self.__recycle()
+        if not self.__free:
+            self.__spill(self.__handed.pop(0))
+        self.__handed.append(slot)
+        self.__slot = self.__free.pop()
+
+    def __spill(self, slot: _Slot):
+        """ copies queued messages out of slot and frees it. Slots are
+            filled in arrival order, so its messages are first in queues. """
+        for queue, spilled in ((self.__messages, self.__spilled_messages),
+                               (self.__keepalives, self.__spilled_keepalives)):
+            while queue and queue[0][3] is slot:
+                arrival, msg, ip_addr, _ = queue.popleft()
+                spilled.append((arrival, memoryview(bytes(msg)), ip_addr, None))
+                self.spilled += 1
+        slot.live = 0
+        slot.used = 0
+        self.__free.append(slot)
+
+    def __recycle(self):
+        """ frees slots whose messages have all been handed out before """
+        handed = []
+        for slot in self.__handed:
+            if slot.live:
+                handed.append(slot)
+            else:
+                slot.used = 0
+                self.__free.append(slot)
+        self.__handed = handed
+        if not self.__slot.live:
+            self.__slot.used = 0
+
+    def __receive(self):
+        """ reads the socket empty into the queue, but stops after
+            enough datagrams to refill a full queue """
+        recvfrom_into = self._sock.recvfrom_into
+        for _ in range(max(self.__capacity, MAX_RECEIVE)):
+            self.__room()
+            slot = self.__slot
             try:
-                data, addr = self._sock.recvfrom(10000)
-                self.__append_msg(data, IPv4Address(addr[0]))
-            except socket.timeout:
-                continue # no data for 0.1 s
+                size, addr = recvfrom_into(slot.view[slot.used:slot.used + MAX_DATAGRAM])
+            except (BlockingIOError, InterruptedError):
+                break # nothing more right now
             except OSError as e:
-                if not self.__stop:
-                    dprint(f"Listener socket error: {e}")
+                dprint(f"Listener socket error: {e}")
                 break
+            data = slot.view[slot.used:slot.used + size]
+            slot.used += size
+            ip_addr = self.__address(addr[0])
+            for msg in split_batch(data):
+                self.__append(msg, ip_addr, slot)
 
-    def __append_msg(self, data: bytes, ip_addr: IPv4Address):
-        with self.__msg_lock:
-            self.__msg_queue.append((data, ip_addr))
+    def __append(self, msg: memoryview, ip_addr: IPv4Address, slot: _Slot):
+        if len(self) >= self.__capacity:
+            self.__drop()
+        self.__arrived += 1
+        slot.live += 1
+        item = (self.__arrived, msg, ip_addr, slot)
+        if msg and msg[0] == MessageType.KEEPALIVE_RELAY:
+            self.__keepalives.append(item)
+        else:
+            self.__messages.append(item)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self))
 
-    def get_messages(self) -> list[tuple[bytes, IPv4Address]]:
-        """ Method for retrieving messages from msg_queue """
+    def __drop(self):
+        """ drops one queued message by drop policy """
+        keepalives = self.__spilled_keepalives or self.__keepalives
+        messages = self.__spilled_messages or self.__messages
+        if self.__keepalives_first:
+            victim = keepalives or messages
+        elif keepalives and messages:
+            victim = keepalives if keepalives[0][0] < messages[0][0] else messages
+        else:
+            victim = keepalives or messages
+        slot = victim.popleft()[3]
+        if slot is not None:
+            slot.live -= 1
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            dprint(f"Listener: {self.dropped} messages dropped, queue full")
+
+    def get_messages(self, limit: int = MAX_RECEIVE) -> list[tuple[memoryview, IPv4Address]]:
+        """ Reads what has arrived and returns at most limit queued
+            messages with sender ip, other messages before keepalives.
+            Batches are split. Messages are valid until the next call. """
+        self.__recycle()
+        self.__receive()
         ret = []
-        with self.__msg_lock:
-            ret = self.__msg_queue
-            self.__msg_queue = []
+        for queue in (self.__spilled_messages, self.__messages,
+                      self.__spilled_keepalives, self.__keepalives):
+            while queue and len(ret) < limit:
+                _, msg, ip_addr, slot = queue.popleft()
+                if slot is not None:
+                    slot.live -= 1
+                ret.append((msg, ip_addr))
         return ret
 
+    def stats(self) -> str:
+        """ Counters as text """
+        kernel = kernel_drops(self._sock)
+        return (f"{self.enqueued} messages received, {self.dropped} dropped, "
+                f"{self.spilled} copied out of full slots, "
+                f"queued {len(self)}, max {self.max_depth}, kernel dropped "
+                f"{'unknown' if kernel is None else kernel}")
+
     def stop(self):
-        """ Method for stopping the thread and closing the socket """
-        self.__stop = True
-        self.__thread.join()
+        """ Method for closing the socket """
         try:
             self._sock.close()
         except OSError:
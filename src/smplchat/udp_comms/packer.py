@@ -1,6 +1,31 @@
-""" smplchat.packet_mangler.packer - functions to form data from message classes """
+""" smplchat.packet_mangler.packer - functions to form data from message classes
+
+    Every message starts with a fixed size header that is packed with a
+    precompiled Struct. Variable length parts follow in this order: old
+    message ids (8 bytes each), ip addresses (4 bytes each), nick and text
+    utf-8 encoded. Their lengths are in the header. Unpacking reads the
+    variable parts through a memoryview so nothing is copied twice.
+
+    Message id lists can also be sent in compact form, marked with the
+    COMPACT_IDS bit in the type byte. Each id is then the zigzag encoded
+    difference to the previous id (the first to 0) as a LEB128 varint.
+    Uids start with their creation time, so neighbouring ids differ by
+    about 5 bytes worth instead of 8. Only peers that have told with a
+    HELLO that they speak PROTOCOL_VERSION 2 or newer are sent compact
+    messages, see Dispatcher.
+
+    Peers of PROTOCOL_VERSION 3 also accept BATCH datagrams that carry
+    several messages, each prefixed with its 2 byte length.
+
+    DIGEST and DIGEST_REPLY of anti-entropy are sent only to peers of
+    PROTOCOL_VERSION 4, so their id lists are always compact. The same
+    goes for OLD_BATCH_REQUEST and OLD_BATCH_REPLY of version 5, which
+    fetch many messages at a time, and SNAPSHOT chunks and SNAPSHOT_NACK
+    of version 6, which stream history to a joining node.
+"""
+from functools import lru_cache
 from ipaddress import IPv4Address
-from struct import pack, unpack, unpack_from
+from struct import Struct, error as StructError
 from smplchat.utils import dprint
 from smplchat.message import (
     MessageType,
@@ -12,128 +37,359 @@ from smplchat.message import (
     JoinRequestMessage,
     JoinReplyMessage,
     OldRequestMessage,
-    OldReplyMessage)
-
-
-def packer(m: Message):
-    """ packer - packs message to binary data for sending """
-
-    if isinstance(m, ChatRelayMessage):
-        sender_nick = m.sender_nick.encode()
-        msg_text = m.msg_text.encode()
-        return pack(
-            "!BQ4sLLL"
-                f"{len(m.old_message_ids)}Q"
-                f"{len(sender_nick)}s"
-                f"{len(msg_text)}s",
-            MessageType.CHAT_RELAY,			# B - 1 byte
-            m.uniq_msg_id,				# Q - 8 bytes
-            m.sender_ip.packed,				# 4s- 4 bytes
-            len(m.old_message_ids),			# L - 4 bytes
-            len(sender_nick),				# L - 4 bytes
-            len(msg_text),				# L - 4 bytes
-
-            *m.old_message_ids,				# ?Q - ? x 8 bytes
-            sender_nick,				# ?s - ? chars (bytes)
-            msg_text)					# ?s - ? * chars
-
-    if isinstance(m, (JoinRelayMessage, LeaveRelayMessage)):
-        sender_nick = m.sender_nick.encode()
-        return pack(
-            "!BQ4sLL"
-                f"{len(m.old_message_ids)}Q"
-                f"{len(sender_nick)}s",
-            (MessageType.JOIN_RELAY if isinstance(m, JoinRelayMessage)
-                    else MessageType.LEAVE_RELAY),	# B - 1 byte
-            m.uniq_msg_id,				# Q - 8 bytes
-            m.sender_ip.packed,				# 4s - 4 bytes
-            len(m.old_message_ids),			# L - 4 bytes
-            len(sender_nick),				# L - 4 bytes
-
-            *m.old_message_ids,				# ?Q - ?x 8 bytes
-            sender_nick)				# ?s - ? chars (bytes)
-
-    if isinstance(m, KeepaliveRelayMessage):
-        return pack(
-            "!BQ4s",
-            MessageType.KEEPALIVE_RELAY,		# B - 1 byte
-            m.uniq_msg_id,				# Q - 8 bytes
-            m.sender_ip.packed)				# L - 4 bytes
-
-    if isinstance(m, JoinRequestMessage):
-        sender_nick = m.sender_nick.encode()
-        return pack(
-            "!BQL"
-                f"{len(sender_nick)}s",
-            MessageType.JOIN_REQUEST,			# B - 1 byte
-            m.uniq_msg_id,				# Q - 8 bytes
-            len(sender_nick),				# L - 4 bytes
-
-            sender_nick)				# ?s - ? chars (bytes)
-
-    if isinstance(m, JoinReplyMessage):
-        ips = bytearray()
-        for ip in m.ip_addresses:
-            ips += ip.packed
-        return pack(
-            "!BLL"
-                f"{len(m.old_message_ids)}Q"
-                f"{len(m.ip_addresses*4)}s",
-            MessageType.JOIN_REPLY,			# B - 1 byte
-            len(m.old_message_ids),			# L - 4 bytes
-            len(m.ip_addresses),			# L - 4 bytes
-
-            *m.old_message_ids,				# ?Q - ? x 8 bytes
-            ips)					# ?s - ? x 4 bytes
-
-    if isinstance(m, OldRequestMessage):
-        return pack(
-            "!BQ",
-            MessageType.OLD_REQUEST,			# B - 1 byte
-            m.uniq_msg_id)				# Q - 8 bytes
-
-    if isinstance(m, OldReplyMessage):
-        sender_nick = m.sender_nick.encode()
-        msg_text = m.msg_text.encode()
-        return pack(
-            "!BQLL"
-                f"{len(sender_nick)}s"
-                f"{len(msg_text)}s",
-            MessageType.OLD_REPLY,			# B - 1 byte
-            m.uniq_msg_id,				# Q - 8 bytes
-            len(sender_nick),				# L - 4 bytes
-            len(msg_text),				# L - 4 bytes
-
-            sender_nick,				# ?s - ? chars (bytes)
-            msg_text)					# ?s - ? * chars
-
-    dprint("ERROR: message type not implemented")
-    return None
-
-
+    OldReplyMessage,
+    OldBatchRequestMessage,
+    OldBatchReplyMessage,
+    SnapshotMessage,
+    SnapshotNackMessage,
+    HelloMessage,
+    DigestMessage,
+    DigestReplyMessage)
+
+PROTOCOL_VERSION = 6	# 1 - original, 2 - HELLO and compact id lists, 3 - BATCH,
+			# 4 - DIGEST, 5 - OLD_BATCH_REQUEST/REPLY, 6 - SNAPSHOT
+COMPACT_VERSION = 2	# first version that understands compact id lists
+BATCH_VERSION = 3	# first version that understands BATCH
+DIGEST_VERSION = 4	# first version that understands DIGEST and DIGEST_REPLY
+OLD_BATCH_VERSION = 5	# first version that understands OLD_BATCH_REQUEST/REPLY
+SNAPSHOT_VERSION = 6	# first version that understands SNAPSHOT and SNAPSHOT_NACK
+COMPACT_IDS = 0x40	# type byte flag of compact id list
+
+# headers, ip addresses are packed as 4 byte integers
+_CHAT_RELAY = Struct("!BQLLLL")		# type, uid, ip, id count, nick len, text len
+_JOINLEAVE_RELAY = Struct("!BQLLL")	# type, uid, ip, id count, nick len
+_KEEPALIVE_RELAY = Struct("!BQL")	# type, uid, ip
+_JOIN_REQUEST = Struct("!BQL")		# type, uid, nick len
+_JOIN_REPLY = Struct("!BLL")		# type, id count, ip count
+_OLD_REQUEST = Struct("!BQ")		# type, uid
+_OLD_REPLY = Struct("!BQLL")		# type, uid, nick len, text len
+_OLD_BATCH = Struct("!BH")		# type, id or message count
+_SNAPSHOT = Struct("!BLHHH")		# type, snapshot id, seq, total chunks, message count
+_SNAPSHOT_NACK = Struct("!BLH")		# type, snapshot id, seq count
+_HELLO = Struct("!BB")			# type, version
+_DIGEST = Struct("!BLH")		# type, floor bucket, bucket count
+_DIGEST_REPLY = Struct("!BHH")		# type, bucket count, id count
+_BATCH_ITEM = Struct("!H")		# length of message in batch
+_PEEK = Struct("!BQ")			# type, uid of types that have one
+
+
+@lru_cache(maxsize=128)
+def _ids(count: int) -> Struct:
+    """ Struct for count message ids """
+    return Struct(f"!{count}Q")
+
+
+@lru_cache(maxsize=128)
+def _with_ids(header: Struct, count: int) -> Struct:
+    """ Struct for header followed by count message ids """
+    return Struct(f"{header.format}{count}Q")
+
+
+@lru_cache(maxsize=128)
+def _ips(count: int) -> Struct:
+    """ Struct for count ip addresses """
+    return Struct(f"!{count}L")
+
+
+@lru_cache(maxsize=128)
+def _buckets(count: int) -> Struct:
+    """ Struct for count (bucket, message count, hash) digest entries """
+    return Struct("!" + "LLQ" * count)
+
+
+@lru_cache(maxsize=128)
+def _bucket_ids(count: int) -> Struct:
+    """ Struct for count bucket numbers """
+    return Struct(f"!{count}L")
+
+
+@lru_cache(maxsize=128)
+def _lengths(count: int) -> Struct:
+    """ Struct for count (nick len, text len) pairs """
+    return Struct("!" + "HL" * count)
+
+
+@lru_cache(maxsize=128)
+def _seqs(count: int) -> Struct:
+    """ Struct for count snapshot chunk numbers """
+    return Struct(f"!{count}H")
+
+
+def encode_ids(ids: list[int]) -> bytes:
+    """ ids as zigzag delta varints """
+    out = bytearray()
+    prev = 0
+    for uid in ids:
+        delta = uid - prev
+        prev = uid
+        z = delta << 1 if delta >= 0 else (-delta << 1) - 1
+        while z > 0x7f:
+            out.append(z & 0x7f | 0x80)
+            z >>= 7
+        out.append(z)
+    return bytes(out)
+
+
+def decode_ids(data: bytes, offset: int, count: int) -> tuple[list[int], int]:
+    """ decodes count ids written by encode_ids, returns them and the
+        offset after them """
+    ids = []
+    prev = 0
+    try:
+        for _ in range(count):
+            z = shift = 0
+            while True:
+                byte = data[offset]
+                offset += 1
+                z |= (byte & 0x7f) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            prev += (z >> 1) ^ -(z & 1)
+            if not 0 <= prev < 1 << 64:
+                raise StructError(f"message id {prev} out of range")
+            ids.append(prev)
+    except IndexError as e:
+        raise StructError("message truncated in id list") from e
+    return ids, offset
+
+
+def _pack_with_ids(header: Struct, fields: tuple, ids: list[int], compact: bool) -> bytes:
+    """ header fields (type first) followed by ids """
+    if compact:
+        return header.pack(fields[0] | COMPACT_IDS, *fields[1:]) + encode_ids(ids)
+    return _with_ids(header, len(ids)).pack(*fields, *ids)
+
+
+def _unpack_ids(data: bytes, offset: int, count: int) -> tuple[list[int], int]:
+    """ ids in either form, returns them and the offset after them """
+    if data[0] & COMPACT_IDS:
+        return decode_ids(data, offset, count)
+    ids = _ids(count)
+    return list(ids.unpack_from(data, offset)), offset + ids.size
+
+
+def _text(view: memoryview, start: int, length: int) -> str:
+    """ decodes utf-8 string from view, fails if view is too short """
+    if start + length > len(view):
+        raise StructError(f"message truncated at {len(view)} of {start + length} bytes")
+    return str(view[start:start + length], "utf-8")
+
+
+def pack_chat_relay_message(m: ChatRelayMessage, compact: bool = False) -> bytes:
+    """ packer for chat relay messages """
+    sender_nick = m.sender_nick.encode()
+    msg_text = m.msg_text.encode()
+    ids = m.old_message_ids
+    return b"".join((
+        _pack_with_ids(_CHAT_RELAY,
+            (MessageType.CHAT_RELAY, m.uniq_msg_id, int(m.sender_ip),
+             len(ids), len(sender_nick), len(msg_text)), ids, compact),
+        sender_nick,
+        msg_text))
+
+
+def pack_joinleave_relay_message(m: JoinRelayMessage | LeaveRelayMessage,
+                                 compact: bool = False) -> bytes:
+    """ packer for join/leave relay messages """
+    sender_nick = m.sender_nick.encode()
+    ids = m.old_message_ids
+    return _pack_with_ids(_JOINLEAVE_RELAY,
+        ((MessageType.JOIN_RELAY if isinstance(m, JoinRelayMessage)
+            else MessageType.LEAVE_RELAY),
+         m.uniq_msg_id, int(m.sender_ip), len(ids), len(sender_nick)),
+        ids, compact) + sender_nick
+
+
+def pack_keepalive_relay_message(m: KeepaliveRelayMessage) -> bytes:
+    """ packer for keepalive relay messages """
+    return _KEEPALIVE_RELAY.pack(MessageType.KEEPALIVE_RELAY,
+                                 m.uniq_msg_id, int(m.sender_ip))
+
+
+def pack_join_request_message(m: JoinRequestMessage) -> bytes:
+    """ packer for join request messages """
+    sender_nick = m.sender_nick.encode()
+    return _JOIN_REQUEST.pack(MessageType.JOIN_REQUEST,
+                              m.uniq_msg_id, len(sender_nick)) + sender_nick
+
+
+def pack_join_reply_message(m: JoinReplyMessage, compact: bool = False) -> bytes:
+    """ packer for join reply messages """
+    ids = m.old_message_ids
+    ips = m.ip_addresses
+    return (_pack_with_ids(_JOIN_REPLY,
+                (MessageType.JOIN_REPLY, len(ids), len(ips)), ids, compact)
+            + _ips(len(ips)).pack(*map(int, ips)))
+
+
+def pack_old_request_message(m: OldRequestMessage) -> bytes:
+    """ packer for old request messages """
+    return _OLD_REQUEST.pack(MessageType.OLD_REQUEST, m.uniq_msg_id)
+
+
+def pack_old_reply_message(m: OldReplyMessage) -> bytes:
+    """ packer for old reply messages """
+    sender_nick = m.sender_nick.encode()
+    msg_text = m.msg_text.encode()
+    return b"".join((
+        _OLD_REPLY.pack(MessageType.OLD_REPLY, m.uniq_msg_id,
+                        len(sender_nick), len(msg_text)),
+        sender_nick,
+        msg_text))
+
+
+def pack_old_batch_request_message(m: OldBatchRequestMessage) -> bytes:
+    """ packer for old batch request messages, ids are always compact """
+    return _OLD_BATCH.pack(MessageType.OLD_BATCH_REQUEST, len(m.uids)) + encode_ids(m.uids)
+
+
+def _pack_texts(messages: list[tuple[int, str, str]]) -> bytes:
+    """ (uid, nick, text) messages: compact ids, then nick and text lengths
+        of every message, then nicks and texts """
+    texts = [(nick.encode(), text.encode()) for _, nick, text in messages]
+    return b"".join((
+        encode_ids([uid for uid, _, _ in messages]),
+        _lengths(len(texts)).pack(*(len(b) for pair in texts for b in pair)),
+        *(b for pair in texts for b in pair)))
+
+
+def _unpack_texts(data: bytes, offset: int, count: int) -> list[tuple[int, str, str]]:
+    """ count messages written by _pack_texts """
+    uids, offset = decode_ids(data, offset, count)
+    lengths = _lengths(count)
+    sizes = lengths.unpack_from(data, offset)
+    offset += lengths.size
+
+    view = memoryview(data)
+    messages = []
+    for i, uid in enumerate(uids):
+        nick_length, text_length = sizes[2 * i], sizes[2 * i + 1]
+        nick = _text(view, offset, nick_length)
+        offset += nick_length
+        messages.append((uid, nick, _text(view, offset, text_length)))
+        offset += text_length
+    return messages
+
+
+def _fit_texts(messages: list[tuple[int, str, str]], room: int
+               ) -> list[list[tuple[int, str, str]]]:
+    """ Splits messages in order to parts that _pack_texts to at most
+        room bytes. A message too large to share a part goes alone. """
+    ret = []
+    part: list[tuple[int, str, str]] = []
+    size = 0
+    for message in messages:
+        # id varint is at most 10 bytes, lengths 6
+        more = 16 + len(message[1].encode()) + len(message[2].encode())
+        if part and size + more > room:
+            ret.append(part)
+            part = []
+            size = 0
+        part.append(message)
+        size += more
+    if part:
+        ret.append(part)
+    return ret
+
+
+def pack_old_batch_reply_message(m: OldBatchReplyMessage) -> bytes:
+    """ packer for old batch reply messages """
+    return (_OLD_BATCH.pack(MessageType.OLD_BATCH_REPLY, len(m.messages))
+            + _pack_texts(m.messages))
+
+
+def old_batch_replies(messages: list[tuple[int, str, str]], mtu: int
+                      ) -> list[OldBatchReplyMessage]:
+    """ Splits (uid, nick, text) messages in order to replies that pack to
+        at most mtu bytes. A message too large to share a reply goes alone. """
+    return [OldBatchReplyMessage(part)
+            for part in _fit_texts(messages, mtu - _OLD_BATCH.size)]
+
+
+def pack_snapshot_message(m: SnapshotMessage) -> bytes:
+    """ packer for snapshot messages """
+    return (_SNAPSHOT.pack(MessageType.SNAPSHOT, m.snapshot_id, m.seq, m.total,
+                           len(m.messages))
+            + _pack_texts(m.messages))
+
+
+def snapshot_chunks(snapshot_id: int, messages: list[tuple[int, str, str]],
+                    mtu: int) -> list[SnapshotMessage]:
+    """ Splits (uid, nick, text) messages in order to numbered snapshot
+        chunks that pack to at most mtu bytes """
+    parts = _fit_texts(messages, mtu - _SNAPSHOT.size)
+    return [SnapshotMessage(snapshot_id, seq, len(parts), part)
+            for seq, part in enumerate(parts)]
+
+
+def pack_snapshot_nack_message(m: SnapshotNackMessage) -> bytes:
+    """ packer for snapshot nack messages """
+    return (_SNAPSHOT_NACK.pack(MessageType.SNAPSHOT_NACK, m.snapshot_id, len(m.seqs))
+            + _seqs(len(m.seqs)).pack(*m.seqs))
+
+
+def pack_hello_message(m: HelloMessage) -> bytes:
+    """ packer for hello messages """
+    return _HELLO.pack(MessageType.HELLO, m.version)
+
+
+def pack_digest_message(m: DigestMessage) -> bytes:
+    """ packer for digest messages """
+    buckets = m.buckets
+    return (_DIGEST.pack(MessageType.DIGEST, m.floor, len(buckets))
+            + _buckets(len(buckets)).pack(*(f for b in buckets for f in b)))
+
+
+def pack_digest_reply_message(m: DigestReplyMessage) -> bytes:
+    """ packer for digest reply messages, ids are always compact """
+    return b"".join((
+        _DIGEST_REPLY.pack(MessageType.DIGEST_REPLY, len(m.buckets), len(m.uids)),
+        _bucket_ids(len(m.buckets)).pack(*m.buckets),
+        encode_ids(m.uids)))
+
+
+_PACKERS = {
+    ChatRelayMessage: pack_chat_relay_message,
+    JoinRelayMessage: pack_joinleave_relay_message,
+    LeaveRelayMessage: pack_joinleave_relay_message,
+    KeepaliveRelayMessage: pack_keepalive_relay_message,
+    JoinRequestMessage: pack_join_request_message,
+    JoinReplyMessage: pack_join_reply_message,
+    OldRequestMessage: pack_old_request_message,
+    OldReplyMessage: pack_old_reply_message,
+    OldBatchRequestMessage: pack_old_batch_request_message,
+    OldBatchReplyMessage: pack_old_batch_reply_message,
+    SnapshotMessage: pack_snapshot_message,
+    SnapshotNackMessage: pack_snapshot_nack_message,
+    HelloMessage: pack_hello_message,
+    DigestMessage: pack_digest_message,
+    DigestReplyMessage: pack_digest_reply_message,
+}
+_ID_PACKERS = (pack_chat_relay_message, pack_joinleave_relay_message, pack_join_reply_message)
+
+
+def packer(m: Message, compact: bool = False):
+    """ packer - packs message to binary data for sending, with compact
+        id list if compact is true and the message has one """
+    pack = _PACKERS.get(type(m))
+    if pack is None:
+        dprint("ERROR: message type not implemented")
+        return None
+    if compact and pack in _ID_PACKERS:
+        return pack(m, True)
+    return pack(m)
 
 
 def unpack_chat_relay_message(data: bytes):
     """ unpacker for chat relay messages """
-    (_,				# B - 1 byte
-        uniq_msg_id,		# Q - 8 bytes
-        sender_ip,		# L - 4 bytes
-        old_msgs_length,	# L - 4 bytes
-        nick_length,		# L - 4 bytes
-        msg_length) = (		# L - 4 bytes
-            unpack_from("!BQ4sLLL", data) )
-    offset = 25
-
-    old_message_ids = list( unpack_from(
-            f"!{old_msgs_length}Q", data, offset=offset) )
-    offset += 8 * old_msgs_length
-
-    sender_nick = unpack_from(
-            f"!{nick_length}s", data, offset=offset)[0].decode()
-    offset += nick_length
-
-    msg_text = unpack_from(
-            f"!{msg_length}s", data, offset=offset)[0].decode()
+    (_, uniq_msg_id, sender_ip, old_msgs_length, nick_length, msg_length) = (
+            _CHAT_RELAY.unpack_from(data))
+    old_message_ids, offset = _unpack_ids(data, _CHAT_RELAY.size, old_msgs_length)
+
+    view = memoryview(data)
+    sender_nick = _text(view, offset, nick_length)
+    msg_text = _text(view, offset + nick_length, msg_length)
 
     return ChatRelayMessage(
         uniq_msg_id = uniq_msg_id,
@@ -143,126 +399,237 @@ def unpack_chat_relay_message(data: bytes):
         msg_text = msg_text)
 
 
-
 def unpack_joinleave_relay_message(data: bytes):
     """ unpacker for join/leave relay messages """
-    (msg_type,			# B - 1 byte
-        uniq_msg_id,		# Q - 8 bytes
-        sender_ip,		# L - 4 bytes
-        old_msgs_length,	# L - 4 bytes
-        nick_length) = (	# L - 4 bytes
-            unpack_from("!BQLLL", data) )
-    offset = 21
-
-    old_message_ids = list( unpack_from(
-            f"!{old_msgs_length}Q", data, offset=offset) )
-    offset += 8 * old_msgs_length
-
-    sender_nick = unpack_from(
-            f"!{nick_length}s", data, offset=offset)[0].decode()
-
-    if msg_type == MessageType.JOIN_RELAY:
-        ret_type = JoinRelayMessage
-    else:
-        ret_type = LeaveRelayMessage
+    (msg_type, uniq_msg_id, sender_ip, old_msgs_length, nick_length) = (
+            _JOINLEAVE_RELAY.unpack_from(data))
+    old_message_ids, offset = _unpack_ids(data, _JOINLEAVE_RELAY.size, old_msgs_length)
 
+    ret_type = (JoinRelayMessage if msg_type & ~COMPACT_IDS == MessageType.JOIN_RELAY
+                else LeaveRelayMessage)
     return ret_type(
         uniq_msg_id = uniq_msg_id,
         sender_ip = IPv4Address(sender_ip),
         old_message_ids = old_message_ids,
-        sender_nick = sender_nick)
+        sender_nick = _text(memoryview(data), offset, nick_length))
 
 
-def unpack_join_request_message(data: bytes):
-    """ unpacker for join request messages """
-    (_,				# B - 1 byte
-        uniq_msg_id,		# Q - 8 bytes
-        nick_length) = (	# L - 4 bytes
-            unpack_from("!BQL", data) )
-    offset = 13
+def unpack_keepalive_relay_message(data: bytes):
+    """ unpacker for keepalive relay messages, size must match exactly """
+    _, uniq_msg_id, sender_ip = _KEEPALIVE_RELAY.unpack(data)
+    return KeepaliveRelayMessage(
+        uniq_msg_id = uniq_msg_id,
+        sender_ip = IPv4Address(sender_ip))
 
-    sender_nick = unpack_from(
-            f"!{nick_length}s", data, offset=offset)[0].decode()
 
+def unpack_join_request_message(data: bytes):
+    """ unpacker for join request messages """
+    _, uniq_msg_id, nick_length = _JOIN_REQUEST.unpack_from(data)
     return JoinRequestMessage(
         uniq_msg_id = uniq_msg_id,
-        sender_nick = sender_nick)
+        sender_nick = _text(memoryview(data), _JOIN_REQUEST.size, nick_length))
 
 
 def unpack_join_reply_message(data: bytes):
-    """ unpacker for chat relay messages """
-    (_,				# B - 1 byte
-        old_msgs_length,	# L - 4 bytes
-        ip_addrs_length ) = (	# L - 4 bytes
-            unpack_from("!BLL", data) )
-    offset = 9
-
-    old_message_ids = list( unpack_from(
-            f"!{old_msgs_length}Q", data, offset=offset) )
-    offset += 8 * old_msgs_length
+    """ unpacker for join reply messages """
+    _, old_msgs_length, ip_addrs_length = _JOIN_REPLY.unpack_from(data)
+    old_message_ids, offset = _unpack_ids(data, _JOIN_REPLY.size, old_msgs_length)
 
-    ip_addresses = list( map(IPv4Address, unpack_from(
-            f"!{ip_addrs_length}L", data, offset=offset)) )
+    ip_addresses = list(map(IPv4Address,
+            _ips(ip_addrs_length).unpack_from(data, offset)))
 
     return JoinReplyMessage(
         old_message_ids = old_message_ids,
         ip_addresses = ip_addresses)
 
 
-def unpack_old_reply_message(data: bytes):
-    """ unpacker for chat relay messages """
-    (_,				# B - 1 byte
-        uniq_msg_id,		# Q - 8 bytes
-        nick_length,		# L - 4 bytes
-        msg_length) = (		# L - 4 bytes
-            unpack_from("!BQLL", data) )
-    offset = 17
+def unpack_old_request_message(data: bytes):
+    """ unpacker for old request messages, size must match exactly """
+    _, uniq_msg_id = _OLD_REQUEST.unpack(data)
+    return OldRequestMessage(uniq_msg_id = uniq_msg_id)
 
-    sender_nick = unpack_from(
-            f"!{nick_length}s", data, offset=offset)[0].decode()
-    offset += nick_length
 
-    msg_text = unpack_from(
-            f"!{msg_length}s", data, offset=offset)[0].decode()
+def unpack_old_reply_message(data: bytes):
+    """ unpacker for old reply messages """
+    _, uniq_msg_id, nick_length, msg_length = _OLD_REPLY.unpack_from(data)
+    offset = _OLD_REPLY.size
 
+    view = memoryview(data)
     return OldReplyMessage(
         uniq_msg_id = uniq_msg_id,
-        sender_nick = sender_nick,
-        msg_text = msg_text )
+        sender_nick = _text(view, offset, nick_length),
+        msg_text = _text(view, offset + nick_length, msg_length))
+
+
+def unpack_old_batch_request_message(data: bytes):
+    """ unpacker for old batch request messages """
+    _, count = _OLD_BATCH.unpack_from(data)
+    uids, _ = decode_ids(data, _OLD_BATCH.size, count)
+    return OldBatchRequestMessage(uids = uids)
+
+
+def unpack_old_batch_reply_message(data: bytes):
+    """ unpacker for old batch reply messages """
+    _, count = _OLD_BATCH.unpack_from(data)
+    return OldBatchReplyMessage(messages = _unpack_texts(data, _OLD_BATCH.size, count))
+
+
+def unpack_snapshot_message(data: bytes):
+    """ unpacker for snapshot messages """
+    _, snapshot_id, seq, total, count = _SNAPSHOT.unpack_from(data)
+    return SnapshotMessage(
+        snapshot_id = snapshot_id,
+        seq = seq,
+        total = total,
+        messages = _unpack_texts(data, _SNAPSHOT.size, count))
+
+
+def unpack_snapshot_nack_message(data: bytes):
+    """ unpacker for snapshot nack messages """
+    _, snapshot_id, count = _SNAPSHOT_NACK.unpack_from(data)
+    return SnapshotNackMessage(
+        snapshot_id = snapshot_id,
+        seqs = list(_seqs(count).unpack_from(data, _SNAPSHOT_NACK.size)))
+
+
+def unpack_hello_message(data: bytes):
+    """ unpacker for hello messages, later versions may add fields """
+    _, version = _HELLO.unpack_from(data)
+    return HelloMessage(version = version)
+
+
+def unpack_digest_message(data: bytes):
+    """ unpacker for digest messages """
+    _, floor, count = _DIGEST.unpack_from(data)
+    fields = _buckets(count).unpack_from(data, _DIGEST.size)
+    return DigestMessage(
+        floor = floor,
+        buckets = [fields[i:i + 3] for i in range(0, len(fields), 3)])
+
+
+def unpack_digest_reply_message(data: bytes):
+    """ unpacker for digest reply messages """
+    _, bucket_count, id_count = _DIGEST_REPLY.unpack_from(data)
+    bucket_ids = _bucket_ids(bucket_count)
+    buckets = list(bucket_ids.unpack_from(data, _DIGEST_REPLY.size))
+    uids, _ = decode_ids(data, _DIGEST_REPLY.size + bucket_ids.size, id_count)
+    return DigestReplyMessage(buckets = buckets, uids = uids)
+
+
+_UNPACKERS = {
+    MessageType.CHAT_RELAY: unpack_chat_relay_message,
+    MessageType.JOIN_RELAY: unpack_joinleave_relay_message,
+    MessageType.LEAVE_RELAY: unpack_joinleave_relay_message,
+    MessageType.KEEPALIVE_RELAY: unpack_keepalive_relay_message,
+    MessageType.JOIN_REQUEST: unpack_join_request_message,
+    MessageType.JOIN_REPLY: unpack_join_reply_message,
+    MessageType.OLD_REQUEST: unpack_old_request_message,
+    MessageType.OLD_REPLY: unpack_old_reply_message,
+    MessageType.OLD_BATCH_REQUEST: unpack_old_batch_request_message,
+    MessageType.OLD_BATCH_REPLY: unpack_old_batch_reply_message,
+    MessageType.SNAPSHOT: unpack_snapshot_message,
+    MessageType.SNAPSHOT_NACK: unpack_snapshot_nack_message,
+    MessageType.HELLO: unpack_hello_message,
+    MessageType.DIGEST: unpack_digest_message,
+    MessageType.DIGEST_REPLY: unpack_digest_reply_message,
+}
+_COMPACT_TYPES = frozenset(t | COMPACT_IDS for t in (
+    MessageType.CHAT_RELAY, MessageType.JOIN_RELAY,
+    MessageType.LEAVE_RELAY, MessageType.JOIN_REPLY))
+_UNPACKERS.update({t: _UNPACKERS[t & ~COMPACT_IDS] for t in _COMPACT_TYPES})
+_RELAY_TYPES = frozenset(t | c for c in (0, COMPACT_IDS) for t in (
+    MessageType.CHAT_RELAY, MessageType.JOIN_RELAY,
+    MessageType.LEAVE_RELAY, MessageType.KEEPALIVE_RELAY))
 
 
 def unpacker(data: bytes):
-    """ unpacker - unpacks messages from raw data """
-
-    match unpack_from("!B", data)[0]:	# Unpacks message type
-
-        case MessageType.CHAT_RELAY:
-            return unpack_chat_relay_message(data)
-
-        case MessageType.JOIN_RELAY | MessageType.LEAVE_RELAY:
-            return unpack_joinleave_relay_message(data)
-
-        case MessageType.KEEPALIVE_RELAY:
-            (_,				# B - 1 byte
-                uniq_msg_id,		# Q - 8 bytes
-                sender_ip ) = (		# 4s - 4 bytes
-                    unpack("!BQL", data) )
-            return KeepaliveRelayMessage(
-                uniq_msg_id = uniq_msg_id,
-                sender_ip = IPv4Address(sender_ip))
-
-        case MessageType.JOIN_REQUEST:
-            return unpack_join_request_message(data)
-
-        case MessageType.JOIN_REPLY:
-            return unpack_join_reply_message(data)
-
-        case MessageType.OLD_REQUEST:
-            (_,				# B - 1 byte
-                uniq_msg_id ) =	(	# Q - 8 bytes
-                    unpack("!BQ", data) )
-            return OldRequestMessage(
-                uniq_msg_id = uniq_msg_id)
-
-        case MessageType.OLD_REPLY:
-            return unpack_old_reply_message(data)
+    """ unpacker - unpacks messages from raw data. Relays keep a copy of
+        the data in raw attribute so that they can be forwarded as is,
+        other messages are not forwarded and aren't worth the copy. """
+    msg = unpack_message(data)
+    if msg is not None and data[0] in _RELAY_TYPES:
+        msg.raw = bytes(data)
+    return msg
+
+
+def unpack_message(data: bytes):
+    """ unpacks message without setting raw, None if type is unknown """
+    if not data:
+        raise StructError("empty message")
+    unpack = _UNPACKERS.get(data[0])
+    return None if unpack is None else unpack(data)
+
+
+_HAS_UID = frozenset(_UNPACKERS) - {MessageType.JOIN_REPLY,
+    MessageType.JOIN_REPLY | COMPACT_IDS, MessageType.HELLO,
+    MessageType.DIGEST, MessageType.DIGEST_REPLY,
+    MessageType.OLD_BATCH_REQUEST, MessageType.OLD_BATCH_REPLY,
+    MessageType.SNAPSHOT, MessageType.SNAPSHOT_NACK}
+
+
+def is_compact(data: bytes) -> bool:
+    """ Tells if packed message has compact id list """
+    return bool(data) and data[0] in _COMPACT_TYPES
+
+
+def to_legacy(data: bytes) -> bytes:
+    """ Repacks message with compact id list for PROTOCOL_VERSION 1 peers """
+    return packer(unpack_message(data))
+
+
+def peek_header(data: bytes) -> tuple[int | None, int | None]:
+    """ Returns (type, uid) of packed message without unpacking the rest.
+        The COMPACT_IDS flag is cleared from type. uid is None for messages
+        that don't have it or are too short and type is None for empty data. """
+    if not data:
+        return None, None
+    msg_type = data[0] & ~COMPACT_IDS if data[0] in _COMPACT_TYPES else data[0]
+    if data[0] not in _HAS_UID or len(data) < _PEEK.size:
+        return msg_type, None
+    return msg_type, _PEEK.unpack_from(data)[1]
+
+
+def _batch(messages: list[bytes]) -> bytes:
+    """ one message as is, more in a BATCH container """
+    if len(messages) == 1:
+        return messages[0]
+    return bytes((MessageType.BATCH,)) + b"".join(
+            _BATCH_ITEM.pack(len(m)) + m for m in messages)
+
+
+def pack_batches(messages: list[bytes], mtu: int) -> list[bytes]:
+    """ Packs messages in order to as few datagrams of at most mtu bytes
+        as possible. Messages too large to share a datagram go alone. """
+    ret = []
+    batch: list[bytes] = []
+    size = 1
+    for data in messages:
+        if batch and size + _BATCH_ITEM.size + len(data) > mtu:
+            ret.append(_batch(batch))
+            batch = []
+            size = 1
+        batch.append(data)
+        size += _BATCH_ITEM.size + len(data)
+    if batch:
+        ret.append(_batch(batch))
+    return ret
+
+
+def split_batch(data: bytes) -> list[bytes]:
+    """ Returns messages of BATCH datagram or [data] if it isn't one.
+        Broken tail of a batch is dropped. """
+    if not data or data[0] != MessageType.BATCH:
+        return [data]
+    ret = []
+    offset = 1
+    while offset + _BATCH_ITEM.size <= len(data):
+        (length,) = _BATCH_ITEM.unpack_from(data, offset)
+        offset += _BATCH_ITEM.size
+        if offset + length > len(data):
+            dprint("WARNING: truncated batch")
+            break
+        item = data[offset:offset + length]
+        offset += length
+        if item and item[0] != MessageType.BATCH:
+            ret.append(item)
+    return ret
@@ -0,0 +1,228 @@
+""" send_queue.py - background sending with priorities and pacing """
+import threading
+from collections import deque
+from heapq import heappush, heappop
+from ipaddress import IPv4Address
+from time import monotonic
+
+from smplchat.message import MessageType
+from smplchat.settings import SEND_QUEUE_LIMIT, SEND_RATE, PEER_SEND_RATE
+from .packer import COMPACT_IDS
+from .sender import Sender
+
+# traffic classes, lower is sent first
+CONTROL, CHAT, BACKGROUND = range(3)
+CLASS_NAMES = ("control", "chat", "background")
+_PUMP_BATCH = 64	# max datagrams handed to sender at once
+
+_CLASS_OF_TYPE = {
+    MessageType.HELLO: CONTROL,
+    MessageType.JOIN_REQUEST: CONTROL,
+    MessageType.JOIN_REPLY: CONTROL,
+    MessageType.SNAPSHOT_NACK: CONTROL,
+    MessageType.CHAT_RELAY: CHAT,
+    MessageType.JOIN_RELAY: CHAT,
+    MessageType.LEAVE_RELAY: CHAT,
+    MessageType.OLD_REPLY: CHAT,
+    MessageType.OLD_BATCH_REPLY: CHAT,
+    MessageType.SNAPSHOT: CHAT,
+    MessageType.KEEPALIVE_RELAY: BACKGROUND,
+    MessageType.OLD_REQUEST: BACKGROUND,
+    MessageType.OLD_BATCH_REQUEST: BACKGROUND,
+    MessageType.DIGEST: BACKGROUND,
+    MessageType.DIGEST_REPLY: BACKGROUND,
+}
+
+
+def traffic_class(data: bytes) -> int:
+    """ Class of packed message, batches go by their first message """
+    if len(data) > 3 and data[0] == MessageType.BATCH:
+        data = data[3:]
+    if not data:
+        return BACKGROUND
+    msg_type = data[0]
+    if msg_type & COMPACT_IDS and msg_type & ~COMPACT_IDS in _CLASS_OF_TYPE:
+        msg_type &= ~COMPACT_IDS
+    return _CLASS_OF_TYPE.get(msg_type, BACKGROUND)
+
+
+class TokenBucket:
+    """ TokenBucket - allows rate events per second on average and bursts
+        of up to burst events """
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now: float) -> float:
+        """ Takes a token and returns 0, or returns seconds until there is one """
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        """ True if bucket would be full at now """
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+class SendQueue:
+    """ SendQueue - sends datagrams from a background thread.
+
+        Datagrams wait in one queue per traffic class and the most
+        important class is always sent first: CONTROL (HELLO, joins),
+        CHAT (relays and OLD_REPLY), BACKGROUND (keepalives, OLD_REQUEST).
+        Sending is paced with token buckets, SEND_RATE datagrams per
+        second in total and PEER_SEND_RATE per peer, both allowing one
+        second worth of burst (0 means no limit). A datagram whose peer is
+        out of tokens waits aside without holding up others.
+
+        At most limit datagrams wait. When full, the oldest datagram of
+        the least important class makes room if it is less important
+        than the new one, otherwise the new one is shed.
+
+        Has the same sendto/send_batch/stats interface as Sender so that
+        Dispatcher can use either.
+    """
+    def __init__(self, sender: Sender, limit: int = SEND_QUEUE_LIMIT,
+                 rate: float = SEND_RATE, peer_rate: float = PEER_SEND_RATE,
+                 clock=None, start: bool = True):
+        self.sender = sender
+        self.__clock = clock or monotonic
+        self.__limit = limit
+        self.__queues = [deque() for _ in CLASS_NAMES]
+        self.__deferred: list = []	# heap of (ready time, seq, class, data, ip)
+        self.__seq = 0
+        self.__len = 0
+        self.__rate = TokenBucket(rate, rate, self.__clock()) if rate else None
+        self.__peer_rate = peer_rate
+        self.__peers: dict[IPv4Address, TokenBucket] = {}
+        self.shed = [0] * len(CLASS_NAMES)
+        self.__cond = threading.Condition()
+        self.__new = False	# datagrams queued since last pump
+        self.__stop = False
+        self.__thread = None
+        if start:
+            self.__thread = threading.Thread(target=self.__loop, name="sender", daemon=True)
+            self.__thread.start()
+
+    def __len__(self):
+        return self.__len
+
+    def sendto(self, data: bytes, ip: IPv4Address):
+        """ Queues one datagram to ip """
+        self.send_batch(((data, ip),))
+
+    def send_batch(self, datagrams) -> int:
+        """ Queues (data, ip) pairs, returns how many were accepted """
+        accepted = 0
+        with self.__cond:
+            for data, ip in datagrams:
+                cls = traffic_class(data)
+                if self.__len >= self.__limit and not self.__shed(cls):
+                    self.shed[cls] += 1
+                    continue
+                self.__queues[cls].append((data, ip))
+                self.__len += 1
+                accepted += 1
+            if accepted:
+                self.__new = True
+                self.__cond.notify()
+        return accepted
+
+    def __shed(self, cls: int) -> bool:
+        """ drops oldest datagram of a less important class than cls """
+        for lower in range(len(self.__queues) - 1, cls, -1):
+            if self.__queues[lower]:
+                self.__queues[lower].popleft()
+                self.__len -= 1
+                self.shed[lower] += 1
+                return True
+        return False
+
+    def __peer_wait(self, ip: IPv4Address, now: float) -> float:
+        if not self.__peer_rate:
+            return 0.0
+        bucket = self.__peers.get(ip)
+        if bucket is None:
+            if len(self.__peers) > 4 * self.__limit:
+                self.__peers = {k: b for k, b in self.__peers.items() if not b.full(now)}
+            bucket = self.__peers[ip] = TokenBucket(
+                    self.__peer_rate, self.__peer_rate, now)
+        return bucket.take(now)
+
+    def pump(self) -> float | None:
+        """ Sends everything that may be sent now. Returns seconds until
+            something more can be sent, 0 if there is more right away or
+            None if nothing is waiting. """
+        now = self.__clock()
+        out = []
+        with self.__cond:
+            self.__new = False
+            ready = []
+            while self.__deferred and self.__deferred[0][0] <= now:
+                ready.append(heappop(self.__deferred))
+            for _, _, cls, data, ip in reversed(ready):
+                self.__queues[cls].appendleft((data, ip))
+            wait = self.__select(now, out)
+        if out:
+            self.sender.send_batch(out)
+        return wait
+
+    def __select(self, now: float, out: list) -> float | None:
+        """ moves datagrams that may be sent now to out, returns like pump """
+        for cls, queue in enumerate(self.__queues):
+            while queue:
+                if len(out) >= _PUMP_BATCH:
+                    return 0.0
+                if self.__rate is not None:
+                    wait = self.__rate.take(now)
+                    if wait:
+                        return wait
+                data, ip = queue.popleft()
+                peer_wait = self.__peer_wait(ip, now)
+                if peer_wait:
+                    if self.__rate is not None:
+                        self.__rate.tokens += 1	# nothing was sent after all
+                    self.__seq += 1
+                    heappush(self.__deferred, (now + peer_wait, self.__seq, cls, data, ip))
+                    continue
+                self.__len -= 1
+                out.append((data, ip))
+        if self.__deferred:
+            return self.__deferred[0][0] - now
+        return None
+
+    def __loop(self):
+        while True:
+            wait = self.pump()
+            with self.__cond:
+                if self.__stop:
+                    return
+                if wait != 0.0 and not self.__new:
+                    self.__cond.wait(wait)
+
+    def stop(self, timeout: float = 1.0):
+        """ Sends what can be sent within timeout and stops the thread """
+        end = self.__clock() + timeout
+        while self.__len and self.__clock() < end:
+            if self.__thread is None:
+                self.pump()
+            else:
+                threading.Event().wait(0.01)
+        with self.__cond:
+            self.__stop = True
+            self.__cond.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def stats(self) -> str:
+        """ Counters as text """
+        shed = ", ".join(f"{n} {name}" for name, n in zip(CLASS_NAMES, self.shed) if n)
+        return (f"{self.sender.stats()}; queued {self.__len}, "
+                f"shed: {shed or 'none'}")
@@ -0,0 +1,59 @@
+""" sender.py - long-lived UDP socket for all outgoing datagrams """
+import errno
+import socket
+from ipaddress import IPv4Address
+
+from smplchat.settings import PORT, SEND_BUFFER
+from smplchat.utils import dprint
+
+_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+class Sender:
+    """ Sender - sends datagrams through one socket.
+
+        The socket can be the listener's so that peers see replies coming
+        from our listening port. Sends never block for long or raise:
+        datagrams the kernel refuses (EAGAIN, ENOBUFS and other errors)
+        are dropped and counted per errno name in drops. Peers are
+        assumed to listen on port.
+    """
+    def __init__(self, sock: socket.socket, sndbuf: int = SEND_BUFFER, port: int = PORT):
+        self.__sock = sock
+        self.__port = port
+        if sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        self.sent = 0
+        self.drops: dict[str, int] = {}
+
+    def sendto(self, data: bytes, ip: IPv4Address):
+        """ Sends one datagram to ip """
+        self.send_batch(((data, ip),))
+
+    def send_batch(self, datagrams) -> int:
+        """ Sends (data, ip) pairs in order, returns how many were sent """
+        sendto = self.__sock.sendto
+        port = self.__port
+        sent = 0
+        for data, ip in datagrams:
+            try:
+                sendto(data, _DONTWAIT, (str(ip), port))
+                sent += 1
+            except OSError as e:
+                self.__drop(e)
+        self.sent += sent
+        return sent
+
+    def __drop(self, e: OSError):
+        if isinstance(e, (BlockingIOError, TimeoutError)):
+            name = "EAGAIN"
+        else:
+            name = errno.errorcode.get(e.errno, str(e.errno))
+        count = self.drops[name] = self.drops.get(name, 0) + 1
+        if count == 1 or count % 1000 == 0:
+            dprint(f"Sender: {count} datagrams dropped with {name}")
+
+    def stats(self) -> str:
+        """ Counters as text """
+        drops = ", ".join(f"{n} {k}" for k, n in sorted(self.drops.items()))
+        return f"{self.sent} datagrams sent, dropped: {drops or 'none'}"
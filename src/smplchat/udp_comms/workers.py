@@ -0,0 +1,255 @@
+""" workers.py - receiving with several SO_REUSEPORT worker processes """
+import multiprocessing
+import selectors
+import socket
+from ipaddress import IPv4Address
+from struct import Struct
+from time import monotonic
+
+from smplchat.settings import PORT, GOSSIP_FANOUT, RELAY_SEEN_LIMIT
+from smplchat.message import MessageType, JoinReplyMessage, HelloMessage
+from smplchat.client_list import ClientList, KeepaliveList, RelayDedup, TimingWheel
+from smplchat.utils import dprint
+from .dispatcher import Dispatcher
+from .packer import unpacker, peek_header, split_batch
+from .sender import Sender
+
+RELAY_TYPES = (MessageType.CHAT_RELAY, MessageType.JOIN_RELAY, MessageType.LEAVE_RELAY)
+FUNNEL_BUFFER = 4 * 1024 * 1024	# SO_SNDBUF/SO_RCVBUF of funnel socketpair
+MAX_FUNNEL = 512	# messages returned by one get_messages call
+NEWS = IPv4Address("0.0.0.0")	# funnel sender of peer news, never a real peer
+_PEER = Struct("!IB")	# ip, HELLO version or 0 if only heard of
+
+
+def pack_news(news: dict[IPv4Address, int]) -> bytes:
+    """ Packs ip -> version (0 if unknown) of peers heard of """
+    return b"".join(_PEER.pack(int(ip), version) for ip, version in news.items())
+
+
+def unpack_news(data: bytes) -> dict[IPv4Address, int]:
+    """ Unpacks peer news packed by pack_news """
+    return {IPv4Address(ip): version for ip, version in _PEER.iter_unpack(data)}
+
+
+class RelayWorker:
+    """ RelayWorker - the part of a node that runs in a receive worker.
+
+        Keepalives and chat/join/leave relays are deduplicated and
+        forwarded right here. Only what the UI process needs goes on to
+        funnel(msg, ip): the first copy of every relay and keepalive, and
+        all other messages (joins, HELLO, OLD_REQUEST/REPLY).
+
+        HELLO is answered by the UI process, here only the version of the
+        peer is recorded. Peers heard of and their versions are collected
+        for take_news(), so that the pool can share them with the other
+        workers, which apply them with learn().
+    """
+    def __init__(self, self_ip: IPv4Address, dispatcher: Dispatcher, funnel, clock=None):
+        self.__funnel = funnel
+        self.__news: dict[IPv4Address, int] = {}	# ip -> HELLO version or 0
+        self.dispatcher = dispatcher
+        self.wheel = TimingWheel(clock=clock)
+        self.client_list = ClientList(self_ip, self.wheel)
+        self.keepalive_list = KeepaliveList(clock=clock, wheel=self.wheel)
+        self.relay_dedup = RelayDedup(clock=clock)
+
+    def __heard(self, ip: IPv4Address):
+        self.client_list.add(ip)
+        self.__news.setdefault(ip, 0)
+
+    def take_news(self) -> dict[IPv4Address, int]:
+        """ Returns and forgets peers heard of since the last call """
+        news, self.__news = self.__news, {}
+        return news
+
+    def learn(self, news: dict[IPv4Address, int]):
+        """ Applies peer news of other workers """
+        for ip, version in news.items():
+            self.client_list.add(ip)
+            if version:
+                self.dispatcher.hello_from(ip, version, answer=False)
+
+    def receive(self, rx_msg: bytes, remote_ip: IPv4Address):
+        """ Handles one received message """
+        msg_type, uid = peek_header(rx_msg)
+        if msg_type == MessageType.KEEPALIVE_RELAY:
+            dedup = self.keepalive_list
+        elif msg_type in RELAY_TYPES:
+            dedup = self.relay_dedup
+            self.__heard(remote_ip) # relayer is alive
+        else:
+            msg = unpacker(rx_msg)
+            if isinstance(msg, JoinReplyMessage):
+                self.__heard(remote_ip)
+                for ip in msg.ip_addresses:
+                    self.__heard(ip)
+            elif isinstance(msg, HelloMessage):
+                self.dispatcher.hello_from(remote_ip, msg.version, answer=False)
+                self.__news[remote_ip] = msg.version
+            else:
+                self.__heard(remote_ip)
+            self.__funnel(rx_msg, remote_ip)
+            return
+
+        if dedup.seen_count(uid) >= RELAY_SEEN_LIMIT:
+            return
+        seen = dedup.add(uid)
+        self.__heard(unpacker(rx_msg).sender_ip) # original sender is alive
+        self.dispatcher.send(rx_msg, self.client_list.get(GOSSIP_FANOUT, exclude=remote_ip))
+        if seen == 0:
+            self.__funnel(rx_msg, remote_ip)
+
+
+def reuseport_socket(bind_ip: IPv4Address, port: int) -> socket.socket:
+    """ UDP socket bound with SO_REUSEPORT, so that the kernel spreads
+        datagrams over all sockets bound to the same address """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((str(bind_ip), port))
+    return sock
+
+
+def _worker_main(self_ip: IPv4Address, sock: socket.socket,
+                 funnel: socket.socket, control: socket.socket):
+    """ receive loop of one worker process """
+    sock.setblocking(False)
+    funnel.setblocking(False)
+    control.setblocking(False)
+    drops = 0
+
+    def to_funnel(msg: bytes, ip: IPv4Address):
+        nonlocal drops
+        try:
+            funnel.send(ip.packed + msg)
+        except BlockingIOError:
+            drops += 1	# UI process is behind, it gets the rest
+            if drops == 1 or drops % 1000 == 0:
+                dprint(f"Receive worker: {drops} messages not funneled")
+
+    worker = RelayWorker(self_ip, Dispatcher(Sender(sock, port=sock.getsockname()[1])), to_funnel)
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(control, selectors.EVENT_READ)
+    while True:
+        deadline = worker.wheel.next_deadline()
+        selector.select(None if deadline is None else max(0.0, deadline - monotonic()))
+        while True:	# peer news of all workers from the pool
+            try:
+                worker.learn(unpack_news(control.recv(65536)))
+            except (BlockingIOError, InterruptedError):
+                break
+        for _ in range(MAX_FUNNEL):
+            try:
+                data, addr = sock.recvfrom(10000)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                dprint(f"Receive worker socket error: {e}")
+                break
+            ip = IPv4Address(addr[0])
+            for msg in split_batch(data):
+                try:
+                    worker.receive(msg, ip)
+                except Exception as e:	# pylint: disable=broad-exception-caught
+                    dprint(f"Receive worker dropped message from {ip}: {e}")
+        news = worker.take_news()
+        if news:
+            to_funnel(pack_news(news), NEWS)
+        worker.wheel.advance()
+        worker.dispatcher.flush()
+
+
+class WorkerPool:
+    """ WorkerPool - receives with count processes on one port.
+
+        Every worker binds its own SO_REUSEPORT socket to bind_ip:port and
+        the kernel spreads datagrams over them by sender address. Workers
+        dedup and forward relays themselves (see RelayWorker) and funnel
+        the rest to this process through a socketpair, so a pool can be
+        used in place of Listener: it has fileno() and get_messages().
+        Relays from it have been forwarded already, which relays tells.
+
+        Workers dedup independently, so a relay arriving from different
+        peers can be forwarded and funneled once by each worker. Peers
+        and versions they hear of are funneled as news, which the pool
+        passes on to every worker, so all of them fan out to every peer
+        and know its version.
+
+        sock is the SO_REUSEPORT socket of the first worker. This process
+        only sends with it, so replies come from our port.
+    """
+    relays = True
+
+    def __init__(self, count: int, self_ip: IPv4Address,
+                 bind_ip: IPv4Address = IPv4Address("0.0.0.0"), port: int = PORT):
+        self.__funnel, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        for end in (self.__funnel, worker_end):
+            end.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, FUNNEL_BUFFER)
+            end.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, FUNNEL_BUFFER)
+        self.__funnel.setblocking(False)
+        socks = [reuseport_socket(bind_ip, port) for _ in range(count)]
+        self.sock = socks[0]
+        self.sock.setblocking(False)
+        self.received = 0
+        self.__controls = []	# our ends of the news socketpair of each worker
+        self.__workers = []
+        for i, sock in enumerate(socks):
+            control, control_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            control.setblocking(False)
+            self.__controls.append(control)
+            worker = multiprocessing.Process(
+                    target=_worker_main, name=f"receive-{i}", daemon=True,
+                    args=(self_ip, sock, worker_end, control_end))
+            worker.start()
+            self.__workers.append(worker)
+            control_end.close()
+            if sock is not self.sock:
+                sock.close()
+        worker_end.close()
+
+    def fileno(self) -> int:
+        """ File descriptor of the funnel, for selectors """
+        return self.__funnel.fileno()
+
+    def __len__(self):
+        return 0	# nothing is queued in this process
+
+    def get_messages(self, limit: int = MAX_FUNNEL) -> list[tuple[bytes, IPv4Address]]:
+        """ Returns at most limit funneled messages with sender ip.
+            Peer news among them are passed on to the workers instead. """
+        ret = []
+        for _ in range(limit):
+            try:
+                data = self.__funnel.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            ip = IPv4Address(data[:4])
+            if ip == NEWS:
+                self.__share(data[4:])
+            else:
+                ret.append((data[4:], ip))
+        self.received += len(ret)
+        return ret
+
+    def __share(self, news: bytes):
+        for control in self.__controls:
+            try:
+                control.send(news)
+            except BlockingIOError:
+                pass	# worker is behind, it hears of the peers later
+
+    def stats(self) -> str:
+        """ Counters as text """
+        alive = sum(w.is_alive() for w in self.__workers)
+        return f"{alive} receive workers, {self.received} messages funneled"
+
+    def stop(self):
+        """ Stops the workers and closes sockets """
+        for worker in self.__workers:
+            worker.terminate()
+        for worker in self.__workers:
+            worker.join()
+        for control in self.__controls:
+            control.close()
+        self.__funnel.close()
+        self.sock.close()
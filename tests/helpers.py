@@ -0,0 +1,36 @@
+""" helpers - test doubles shared by the test modules """
+from smplchat.message import MessageType
+
+
+class FakeClock:
+    """ Clock that stands still until now is changed """
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSender:
+    """ Sender that keeps (data, ip) of every datagram instead of sending """
+    def __init__(self):
+        self.sent = []
+
+    def send_batch(self, datagrams):
+        datagrams = list(datagrams)
+        self.sent.extend(datagrams)
+        return len(datagrams)
+
+    def sendto(self, data, ip):
+        self.sent.append((data, ip))
+
+    def stats(self):
+        return f"sent {len(self.sent)}"
+
+    def payloads(self):
+        """ sent datagrams, HELLOs left out """
+        return [data for data, _ in self.sent if data[0] != MessageType.HELLO]
+
+    def types(self):
+        """ types of sent messages, HELLOs left out """
+        return [data[0] for data in self.payloads()]
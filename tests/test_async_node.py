@@ -0,0 +1,65 @@
+import asyncio
+import socket
+import unittest
+from ipaddress import IPv4Address
+
+from smplchat.async_node import AsyncNode
+
+A = IPv4Address("127.0.0.1")
+B = IPv4Address("127.0.0.2")
+
+def free_port():
+    with socket.socket(type=socket.SOCK_DGRAM) as sock:
+        sock.bind((str(A), 0))
+        return sock.getsockname()[1]
+
+class TestAsyncNode(unittest.IsolatedAsyncioTestCase):
+    workers = 0
+
+    async def asyncSetUp(self):
+        port = free_port()
+        self.a = AsyncNode(A, "alice", bind_ip=A, port=port, workers=self.workers)
+        self.b = AsyncNode(B, "bob", bind_ip=B, port=port, workers=0)
+        try:
+            await self.a.start()
+            await self.b.start()
+        except OSError as e:
+            await self.a.close(leave=False)
+            self.skipTest(f"cannot bind loopback addresses: {e}")
+
+    async def asyncTearDown(self):
+        await self.a.close(leave=False)
+        await self.b.close(leave=False)
+
+    async def test_join_and_chat(self):
+        await self.b.join(A)
+        for _ in range(100):
+            if A in self.b.core.client_list.get_all():
+                break
+            await asyncio.sleep(0.01)
+        self.assertIn(B, self.a.core.client_list.get_all())
+
+        messages = self.a.messages()
+        first = asyncio.ensure_future(anext(messages))
+        await asyncio.sleep(0)	# let the iterator subscribe
+        await self.b.post("hello alice")
+        msg = await asyncio.wait_for(first, 2)
+        self.assertEqual((msg.sender_nick, msg.msg_text), ("bob", "hello alice"))
+
+        await self.a.close(leave=False)
+        with self.assertRaises(StopAsyncIteration):
+            await asyncio.wait_for(anext(messages), 2)
+
+    async def test_stats(self):
+        self.assertIn("received", self.a.stats())
+
+class TestAsyncNodeWorkers(TestAsyncNode):
+    """ alice receives with a WorkerPool """
+    workers = 2
+
+    async def test_stats(self):
+        self.assertIn("2 receive workers", self.a.stats())
+        self.assertEqual(self.a.address, (str(A), self.b.address[1]))
+
+if __name__ == "__main__":
+    unittest.main()
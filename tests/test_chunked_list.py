@@ -0,0 +1,163 @@
+import unittest
+from datetime import datetime
+from random import Random
+
+from smplchat.message_list.chunked import ChunkedList
+from smplchat.message_list.columnar import ColumnarList, ColumnChunk
+from smplchat.message_list.list import (
+    FullMessageEntry,
+    WaitingMessageEntry,
+    GivenUpMessageEntry,
+    SystemMessageEntry)
+
+def entry(uid):
+    return FullMessageEntry(uid=uid, seen=1, nick="n", message=str(uid))
+
+class TestChunkedList(unittest.TestCase):
+    list_type = ChunkedList
+
+    def test_append(self):
+        cl = self.list_type(chunk_size=4)
+        for i in range(10):
+            cl.append(entry(i))
+        self.assertEqual(len(cl), 10)
+        self.assertEqual([e.uid for e in cl], list(range(10)))
+        self.assertEqual(cl.position(7), 7)
+        self.assertEqual(cl.get(3).uid, 3)
+        self.assertIn(3, cl)
+        self.assertNotIn(33, cl)
+
+    def test_insert_before_splits(self):
+        cl = self.list_type(chunk_size=4)
+        cl.append(entry(100))
+        cl.insert_before(100, [entry(i) for i in range(9)])
+        self.assertEqual([e.uid for e in cl], list(range(9)) + [100])
+        for i in range(9):
+            self.assertEqual(cl.position(i), i)
+        self.assertEqual(cl.position(100), 9)
+
+    def test_evict_front(self):
+        cl = self.list_type(chunk_size=4)
+        for i in range(10):
+            cl.append(entry(i))
+        cl.evict_front(5)
+        self.assertEqual([e.uid for e in cl], list(range(5, 10)))
+        self.assertIsNone(cl.get(4))
+        self.assertEqual(cl.position(5), 0)
+        cl.evict_front(100)
+        self.assertEqual(len(cl), 0)
+        self.assertEqual(list(cl), [])
+
+    def test_replace(self):
+        cl = self.list_type(chunk_size=4)
+        for i in range(6):
+            cl.append(entry(i))
+        cl.replace(FullMessageEntry(uid=4, seen=2, nick="x", message="y"))
+        self.assertEqual(cl.get(4).nick, "x")
+        self.assertEqual(list(cl)[4].nick, "x")
+
+    def test_retain_and_tail(self):
+        cl = self.list_type(chunk_size=3)
+        for i in range(7):
+            cl.append(entry(i))
+            cl.append(SystemMessageEntry(message="s", timestamp=datetime.now()))
+        cl.retain(lambda e: isinstance(e, FullMessageEntry))
+        self.assertEqual([e.uid for e in cl], list(range(7)))
+        self.assertEqual([e.uid for e in cl.tail(4)], [3, 4, 5, 6])
+        self.assertEqual(len(cl.tail(100)), 7)
+        self.assertEqual(cl.tail(0), [])
+
+    def test_against_list(self):
+        rnd = Random(5)
+        cl = self.list_type(chunk_size=8)
+        model = []
+        next_uid = 0
+        for _ in range(2000):
+            op = rnd.random()
+            if op < 0.4 or not model:
+                cl.append(entry(next_uid))
+                model.append(next_uid)
+                next_uid += 1
+            elif op < 0.8:
+                before = rnd.choice(model)
+                new = list(range(next_uid, next_uid + rnd.randrange(1, 20)))
+                next_uid = new[-1] + 1
+                cl.insert_before(before, [entry(u) for u in new])
+                pos = model.index(before)
+                model[pos:pos] = new
+            elif op < 0.9:
+                uid = rnd.choice(model)
+                cl.remove(uid)
+                model.remove(uid)
+            else:
+                count = rnd.randrange(0, 30)
+                cl.evict_front(count)
+                del model[:count]
+            self.assertEqual(len(cl), len(model))
+            if model:
+                pos = rnd.randrange(len(model))
+                self.assertEqual(cl.position(model[pos]), pos)
+                self.assertEqual(cl.get(model[pos]).uid, model[pos])
+        self.assertEqual([e.uid for e in cl], model)
+        for i, uid in enumerate(model):
+            self.assertEqual(cl.position(uid), i)
+
+    def test_tail_lines_cached(self):
+        cl = self.list_type(chunk_size=4)
+        for i in range(10):
+            cl.append(entry(i))
+        calls = []
+        def fmt(e):
+            calls.append(e.uid)
+            return f"line {e.uid}"
+        self.assertEqual(cl.tail_lines(3, fmt), ["line 7", "line 8", "line 9"])
+        self.assertEqual(sorted(calls), [7, 8, 9])
+        calls.clear()
+        cl.tail_lines(3, fmt)
+        self.assertEqual(calls, [])
+        cl.replace(entry(8))
+        cl.insert_before(9, [entry(100)])
+        self.assertEqual(cl.tail_lines(3, fmt), ["line 8", "line 100", "line 9"])
+        self.assertEqual(sorted(calls), [8, 100])
+
+    def test_bump_seen(self):
+        cl = self.list_type(chunk_size=4)
+        cl.append(entry(1))
+        cl.bump_seen(1)
+        cl.bump_seen(1)
+        self.assertEqual(cl.get(1).seen, 3)
+
+class TestColumnarList(TestChunkedList):
+    list_type = ColumnarList
+
+    def test_entry_types_roundtrip(self):
+        now = datetime.now()
+        entries = [
+            FullMessageEntry(uid=1, seen=4, nick="äö", message="ünicode ✓"),
+            WaitingMessageEntry(uid=2, fetch_count=3, last_tried=now),
+            GivenUpMessageEntry(uid=3),
+            SystemMessageEntry(message="system", timestamp=now)]
+        cl = ColumnarList(chunk_size=2)
+        for e in entries:
+            cl.append(e)
+        self.assertEqual(list(cl), entries)
+        cl.replace(FullMessageEntry(uid=2, seen=1, nick="n", message="arrived"))
+        self.assertEqual(cl.get(2).message, "arrived")
+        self.assertEqual(cl.tail(2)[-1].message, "system")
+
+    def test_live_text_counted(self):
+        chunk = ColumnChunk()
+        now = datetime.now()
+        chunk.insert(0, [WaitingMessageEntry(uid=i, fetch_count=0, last_tried=now)
+                         for i in range(100)])
+        for i in range(100):
+            chunk.set(i, FullMessageEntry(uid=i, seen=1, nick="n", message="x" * i))
+            chunk.set(i, FullMessageEntry(uid=i, seen=1, nick="n", message="y" * i))
+        self.assertEqual(chunk.live, sum(chunk.text_len))
+        self.assertLessEqual(len(chunk.blob), 2 * chunk.live)
+        tail = chunk.split(50)
+        chunk.drop_front(10)
+        chunk.remove(0)
+        for part in (chunk, tail):
+            self.assertEqual(part.live, sum(part.text_len))
+        self.assertEqual(chunk.get(0).message, "y" * 11)
@@ -38,3 +38,24 @@ class TestClientList(unittest.TestCase):
         cl._ClientList__iplist[1] = int(time()) - NODE_TIMEOUT - 1
         cl.cleanup()
         self.assertEqual(cl.get(10), [2])
+
+    def test_get_exclude(self):
+        cl = ClientList(0)
+        cl.add_list(range(1, 101))
+        for _ in range(50):
+            peers = cl.get(5, exclude=7)
+            self.assertEqual(len(peers), 5)
+            self.assertEqual(len(set(peers)), 5)
+            self.assertNotIn(7, peers)
+        self.assertEqual(cl.get(99, exclude=7), [p for p in range(1, 101) if p != 7])
+
+    def test_swap_remove(self):
+        cl = ClientList(0)
+        cl.add_list(range(1, 21))
+        for ip in range(1, 21, 2):
+            cl._ClientList__iplist[ip] = int(time()) - NODE_TIMEOUT - 1
+        cl.cleanup()
+        self.assertEqual(cl.get_all(), list(range(2, 21, 2)))
+        self.assertEqual(sorted(cl.get(9, exclude=4)), [p for p in range(2, 21, 2) if p != 4])
+        for _ in range(20):
+            self.assertTrue(set(cl.get(3, exclude=20)) <= set(range(2, 19, 2)))
@@ -0,0 +1,56 @@
+import unittest
+from random import shuffle
+
+from smplchat.message_list.digest import (
+    bucket_of,
+    summarize,
+    make_digest,
+    differing,
+    uids_in)
+
+def uid(second, n=0):
+    return second << 32 | n
+
+class TestDigest(unittest.TestCase):
+
+    def test_summary_is_order_free(self):
+        uids = [uid(s, n) for s in range(0, 600, 7) for n in range(3)]
+        summary = summarize(uids)
+        shuffle(uids)
+        self.assertEqual(summarize(uids), summary)
+        self.assertEqual(summary[0][0], 27)	# 9 seconds x 3 in first minute
+        self.assertNotEqual(summarize(uids[1:]), summary)
+
+    def test_bucket_of(self):
+        self.assertEqual(bucket_of(uid(119, 5)), 1)
+        self.assertEqual(bucket_of(uid(120)), 2)
+
+    def test_make_digest_floor(self):
+        summary = summarize([uid(s) for s in range(600, 900, 30)])
+        floor, buckets = make_digest(summary)
+        self.assertEqual(floor, 9)
+        self.assertEqual([b for b, _, _ in buckets], [10, 11, 12, 13, 14])
+        floor, buckets = make_digest(summary, 12)
+        self.assertEqual((floor, len(buckets)), (12, 2))
+        floor, buckets = make_digest(summary, limit=3)
+        self.assertEqual((floor, [b for b, _, _ in buckets]), (11, [12, 13, 14]))
+        self.assertEqual(make_digest({}, 4), (4, []))
+
+    def test_differing(self):
+        ours = [uid(s) for s in range(600, 900, 30)]
+        theirs = ours[:3] + ours[4:] + [uid(700, 1), uid(1000)]
+        remote_floor, remote = make_digest(summarize(theirs))
+        summary = summarize(ours)
+        own_floor, _ = make_digest(summary)
+        self.assertEqual(differing(summary, own_floor, remote_floor, remote), [11, 16])
+        # remote floor hides older buckets
+        self.assertEqual(differing(summary, own_floor, 11, remote), [16])
+
+    def test_uids_in(self):
+        uids = [uid(s, n) for s in range(0, 300, 60) for n in range(4)]
+        self.assertEqual(uids_in(uids, [1, 3]), ([1, 3], uids[4:8] + uids[12:16]))
+        self.assertEqual(uids_in(uids, [1, 3], limit=6), ([3], uids[12:16]))
+        self.assertEqual(uids_in(uids, [2], limit=3), ([2], uids[9:12]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,19 @@
+import errno
 import unittest
 from ipaddress import IPv4Address
-from unittest.mock import patch, MagicMock, call
+from unittest.mock import patch, MagicMock
 
-from smplchat.udp_comms import Dispatcher
-from smplchat.message import ChatRelayMessage, MessageType
-from smplchat.settings import PORT
+from smplchat.udp_comms import Dispatcher, packer, unpacker, is_compact, split_batch, PROTOCOL_VERSION
+from smplchat.udp_comms.packer import pack_hello_message, COMPACT_VERSION
+from smplchat.udp_comms.sender import Sender
+from smplchat.message import ChatRelayMessage, KeepaliveRelayMessage, HelloMessage, MessageType
+from smplchat.settings import PORT, BATCH_MTU
+
+HELLO = pack_hello_message(HelloMessage(PROTOCOL_VERSION))
+
+def sent_datagrams(sock):
+    """ (data, address) of every sendto call, flags left out """
+    return [(c.args[0], c.args[-1]) for c in sock.sendto.call_args_list]
 
 class TestDispatcher(unittest.TestCase):
 
@@ -13,8 +22,7 @@ class TestDispatcher(unittest.TestCase):
     def test_dispatcher_send(self, mock_packer, mock_socket):
         dispatcher = Dispatcher()
         mock_packer.return_value = b"BLABLA"
-        sock_instance = MagicMock()
-        mock_socket.return_value.__enter__.return_value = sock_instance
+        sock_instance = mock_socket.return_value
         msg = ChatRelayMessage(
             uniq_msg_id=12,
             sender_ip=666,
@@ -30,14 +38,16 @@ class TestDispatcher(unittest.TestCase):
 
         dispatcher.send(msg, ips)
 
-        self.assertEqual(mock_packer.call_count, 2)
-        mock_packer.assert_has_calls([call(msg), call(msg)])
+        mock_packer.assert_called_once_with(msg)
+        self.assertEqual(msg.raw, b"BLABLA")
         mock_socket.assert_called_once()
         expected_calls = [
+            (HELLO, ("127.0.0.1", PORT)),
             (b"BLABLA", ("127.0.0.1", PORT)),
+            (HELLO, ("8.8.8.8", PORT)),
             (b"BLABLA", ("8.8.8.8", PORT)),
         ]
-        actual_calls = [c.args for c in sock_instance.sendto.call_args_list]
+        actual_calls = sent_datagrams(sock_instance)
         self.assertEqual(expected_calls, actual_calls)
 
     @patch("smplchat.udp_comms.dispatcher.socket")
@@ -57,7 +67,106 @@ class TestDispatcher(unittest.TestCase):
 
         dispatcher.send(msg, [])
 
-        sock_instance = mock_socket.return_value.__enter__.return_value
+        sock_instance = mock_socket.return_value
 
         mock_packer.assert_not_called()
         sock_instance.sendto.assert_not_called()
+
+    @patch("smplchat.udp_comms.dispatcher.socket")
+    @patch("smplchat.udp_comms.dispatcher.packer")
+    def test_dispatcher_send_raw(self, mock_packer, mock_socket):
+        dispatcher = Dispatcher()
+        sock_instance = mock_socket.return_value
+        data = packer(KeepaliveRelayMessage(uniq_msg_id=5, sender_ip=IPv4Address("1.2.3.4")))
+        msg = unpacker(data)
+
+        dispatcher.send(data, [IPv4Address("10.0.0.1")])
+        dispatcher.send(msg, [IPv4Address("10.0.0.2")])
+
+        mock_packer.assert_not_called()
+        actual_calls = sent_datagrams(sock_instance)
+        self.assertEqual(actual_calls, [(HELLO, ("10.0.0.1", PORT)),
+                                        (data, ("10.0.0.1", PORT)),
+                                        (HELLO, ("10.0.0.2", PORT)),
+                                        (data, ("10.0.0.2", PORT))])
+
+    @patch("smplchat.udp_comms.dispatcher.socket")
+    def test_dispatcher_compact_by_version(self, mock_socket):
+        dispatcher = Dispatcher()
+        sock_instance = mock_socket.return_value
+        new_peer, old_peer = IPv4Address("10.0.0.1"), IPv4Address("10.0.0.2")
+        dispatcher.hello_from(new_peer, COMPACT_VERSION)
+        self.assertEqual(sent_datagrams(sock_instance), [(HELLO, ("10.0.0.1", PORT))])
+        msg = ChatRelayMessage(
+            uniq_msg_id=12,
+            sender_ip=IPv4Address("1.2.3.4"),
+            old_message_ids=[(1700000000 << 32) + i * 1000 for i in range(50)],
+            sender_nick="n",
+            msg_text="hi")
+
+        dispatcher.send(msg, [new_peer, old_peer])
+
+        sent = {addr[0]: data for data, addr in sent_datagrams(sock_instance)
+                if data != HELLO}
+        self.assertTrue(is_compact(sent["10.0.0.1"]))
+        self.assertFalse(is_compact(sent["10.0.0.2"]))
+        self.assertEqual(sent["10.0.0.2"], packer(msg))
+        self.assertLess(len(sent["10.0.0.1"]), len(sent["10.0.0.2"]) - 250)
+        self.assertEqual(unpacker(sent["10.0.0.1"]), msg)
+
+        # forwarded compact bytes are repacked for old peer
+        sock_instance.sendto.reset_mock()
+        dispatcher.send(sent["10.0.0.1"], [old_peer, new_peer])
+        sent = [data for data, _ in sent_datagrams(sock_instance)]
+        self.assertEqual(sent, [packer(msg), packer(msg, compact=True)])
+
+    @patch("smplchat.udp_comms.dispatcher.socket")
+    def test_dispatcher_batching(self, mock_socket):
+        dispatcher = Dispatcher()
+        sock_instance = mock_socket.return_value
+        batch_peer, old_peer = IPv4Address("10.0.0.1"), IPv4Address("10.0.0.2")
+        dispatcher.hello_from(batch_peer, PROTOCOL_VERSION)
+        sock_instance.sendto.reset_mock()
+        msgs = [KeepaliveRelayMessage(uniq_msg_id=i, sender_ip=IPv4Address("1.2.3.4"))
+                for i in range(200)]
+        for msg in msgs:
+            dispatcher.send(msg, [batch_peer, old_peer])
+
+        sent = sent_datagrams(sock_instance)
+        self.assertEqual(len(sent), 201)	# HELLO and every message to old peer
+        self.assertTrue(all(addr == ("10.0.0.2", PORT) for _, addr in sent))
+
+        sock_instance.sendto.reset_mock()
+        dispatcher.flush()
+        packets = [data for data, _ in sent_datagrams(sock_instance)]
+        self.assertEqual(len(packets), 3)	# 200 * (2 + 13) bytes
+        self.assertTrue(all(len(p) <= BATCH_MTU for p in packets))
+        received = [unpacker(m) for p in packets for m in split_batch(p)]
+        self.assertEqual(received, msgs)
+
+        sock_instance.sendto.reset_mock()
+        dispatcher.flush()
+        sock_instance.sendto.assert_not_called()
+
+class TestSender(unittest.TestCase):
+
+    def test_drops_are_counted(self):
+        sock = MagicMock()
+        sock.sendto.side_effect = [8, BlockingIOError(errno.EAGAIN, "again"),
+                                   OSError(errno.ENOBUFS, "no buffers"), 8,
+                                   OSError(errno.ENOBUFS, "no buffers")]
+        sender = Sender(sock, sndbuf=65536)
+        sock.setsockopt.assert_called_once()
+        ips = [IPv4Address(f"10.0.0.{i}") for i in range(5)]
+        self.assertEqual(sender.send_batch((b"x", ip) for ip in ips), 2)
+        self.assertEqual(sender.sent, 2)
+        self.assertEqual(sender.drops, {"EAGAIN": 1, "ENOBUFS": 2})
+        self.assertIn("2 ENOBUFS", sender.stats())
+
+    def test_shared_socket(self):
+        sock = MagicMock()
+        dispatcher = Dispatcher(Sender(sock))
+        dispatcher.send(b"\x03" + bytes(12), [IPv4Address("10.0.0.1")])
+        self.assertEqual(sent_datagrams(sock)[-1], (b"\x03" + bytes(12), ("10.0.0.1", PORT)))
+        dispatcher.close()
+        sock.close.assert_not_called()
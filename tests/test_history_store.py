@@ -0,0 +1,145 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from smplchat.settings import MAX_MESSAGES
+from smplchat.message_list import MessageList, HistoryStore
+from smplchat.message import ChatRelayMessage, JoinReplyMessage
+
+class TestHistoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def store(self, **kwargs):
+        kwargs.setdefault("compact_interval", None)
+        return HistoryStore(self.path, **kwargs)
+
+    def test_put_get(self):
+        hs = self.store()
+        hs.put(1, "nick", "hello")
+        hs.put(2, "äö", "ünicode ✓")
+        self.assertEqual(hs.get(1), ("nick", "hello"))
+        self.assertEqual(hs.get(2), ("äö", "ünicode ✓"))
+        self.assertIsNone(hs.get(3))
+        self.assertIn(1, hs)
+        self.assertEqual(len(hs), 2)
+        hs.close()
+
+    def test_reopen(self):
+        hs = self.store(segment_size=100)
+        for i in range(50):
+            hs.put(i, f"n{i}", f"text {i}")
+        hs.close()
+        self.assertGreater(len(os.listdir(self.path)), 1)
+        hs = self.store(segment_size=100)
+        self.assertEqual(len(hs), 50)
+        self.assertEqual(hs.get(17), ("n17", "text 17"))
+        self.assertEqual([r[0] for r in hs.tail(5)], [45, 46, 47, 48, 49])
+        hs.put(50, "n", "after reopen")
+        self.assertEqual(hs.tail(1), [(50, "n", "after reopen")])
+        hs.close()
+
+    def test_broken_tail(self):
+        hs = self.store()
+        hs.put(1, "a", "first")
+        hs.put(2, "b", "second")
+        hs.close()
+        seg = os.path.join(self.path, os.listdir(self.path)[0])
+        os.truncate(seg, os.path.getsize(seg) - 3)
+        hs = self.store()
+        self.assertEqual(hs.get(1), ("a", "first"))
+        self.assertIsNone(hs.get(2))
+        hs.put(3, "c", "third")
+        hs.close()
+        hs = self.store()
+        self.assertEqual([r[0] for r in hs.tail(10)], [1, 3])
+        hs.close()
+
+    def test_compact_rewrites_superseded(self):
+        hs = self.store(segment_size=200)
+        for _ in range(3):
+            for i in range(10):
+                hs.put(i, "n", f"text {i}")
+        size = sum(os.path.getsize(os.path.join(self.path, f))
+                   for f in os.listdir(self.path))
+        hs.compact()
+        compacted = sum(os.path.getsize(os.path.join(self.path, f))
+                        for f in os.listdir(self.path))
+        self.assertLess(compacted, size)
+        for i in range(10):
+            self.assertEqual(hs.get(i), ("n", f"text {i}"))
+        self.assertEqual([r[0] for r in hs.tail(10)], list(range(10)))
+        hs.close()
+
+    def test_compact_keep_limit(self):
+        hs = self.store(segment_size=100, keep=10)
+        for i in range(100):
+            hs.put(i, "n", "t")
+        hs.compact()
+        self.assertLess(len(hs), 100)
+        self.assertGreaterEqual(len(hs), 10)
+        self.assertIsNone(hs.get(0))
+        self.assertEqual(hs.get(99), ("n", "t"))
+        hs.close()
+
+    def test_message_list_on_store(self):
+        hs = self.store()
+        ml = MessageList(hs)
+        for i in range(MAX_MESSAGES + 10):
+            ml.add(ChatRelayMessage(
+                uniq_msg_id=i + 1000,
+                sender_ip=55,
+                old_message_ids=[],
+                sender_nick="n",
+                msg_text=f"m{i}"))
+        ml.cleanup()
+        self.assertIsNone(ml.find(1000))
+        self.assertEqual(ml.get_by_uid(1000).message, "m0")
+        hs.close()
+
+        hs = self.store()
+        ml = MessageList(hs)
+        self.assertEqual(len(ml.get()), MAX_MESSAGES)
+        self.assertEqual(ml.get()[-1].uid, MAX_MESSAGES + 1009)
+        # message known from store is not requested again
+        ml.add(ChatRelayMessage(
+            uniq_msg_id=5,
+            sender_ip=55,
+            old_message_ids=[1000],
+            sender_nick="n",
+            msg_text="m"))
+        self.assertEqual(ml.get()[-1].uid, 5)
+        self.assertEqual(ml.get()[-2].uid, MAX_MESSAGES + 1009)
+        hs.close()
+
+    def test_restart_then_join(self):
+        hs = self.store()
+        ml = MessageList(hs)
+        for i in range(5):
+            ml.add(ChatRelayMessage(uniq_msg_id=i + 1000, sender_ip=55,
+                                    old_message_ids=[], sender_nick="n", msg_text=f"m{i}"))
+        hs.close()
+
+        def texts(ml):
+            return [e.message for e in ml.get() if hasattr(e, "nick")]
+
+        uids = [i + 1000 for i in range(5)]
+        # /join clears the list, the peer's history is our stored one
+        for join in ("reply", "missing", "snapshot"):
+            hs = self.store()
+            ml = MessageList(hs)
+            ml.clear_user_messages()
+            if join == "reply":
+                ml.add(JoinReplyMessage(uids, []))
+            elif join == "missing":
+                self.assertEqual(ml.add_missing(uids), [])
+            else:
+                self.assertEqual(ml.add_snapshot([(u, "n", "x") for u in uids]), [])
+            self.assertEqual(texts(ml), [f"m{i}" for i in range(5)], join)
+            self.assertIsNone(ml.get_waiting_message())
+            hs.close()
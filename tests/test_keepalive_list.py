@@ -1,9 +1,9 @@
 import unittest
-from time import time
 
-from smplchat.settings import NODE_TIMEOUT
+from smplchat.settings import NODE_TIMEOUT, KEEPALIVE_BUCKETS, KEEPALIVE_CAPACITY
 from smplchat.client_list import KeepaliveList
 from smplchat.utils import generate_uid
+from tests.helpers import FakeClock
 
 class TestKeepaliveList(unittest.TestCase):
 
@@ -30,10 +30,25 @@ class TestKeepaliveList(unittest.TestCase):
         self.assertEqual(kal.seen_count(u3), 0)
 
     def test_cleanup(self):
-        kal = KeepaliveList()
+        clock = FakeClock()
+        kal = KeepaliveList(clock)
         kal.add(100)
+        clock.now += NODE_TIMEOUT + 1
         kal.add(200)
-        kal._KeepaliveList__entries[100].addtime = int(time()) - NODE_TIMEOUT - 1
         kal.cleanup()
         self.assertEqual(kal.seen_count(100), 0)
         self.assertEqual(kal.seen_count(200), 1)
+
+    def test_kept_until_last_bucket(self):
+        clock = FakeClock()
+        kal = KeepaliveList(clock)
+        kal.add(100)
+        clock.now += NODE_TIMEOUT * (KEEPALIVE_BUCKETS - 1) / KEEPALIVE_BUCKETS - 1
+        kal.cleanup()
+        self.assertEqual(kal.seen_count(100), 1)
+
+    def test_capacity(self):
+        kal = KeepaliveList(FakeClock())
+        for uid in range(KEEPALIVE_CAPACITY + 1000):
+            kal.add(uid)
+        self.assertLessEqual(len(kal), KEEPALIVE_CAPACITY)
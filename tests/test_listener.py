@@ -0,0 +1,132 @@
+import socket
+import unittest
+from ipaddress import IPv4Address
+from unittest.mock import patch
+
+from smplchat.udp_comms import Listener, packer, unpacker, pack_batches
+from smplchat.udp_comms.listener import kernel_drops
+from smplchat.message import ChatRelayMessage, KeepaliveRelayMessage
+
+LOCAL = IPv4Address("127.0.0.1")
+
+def chat(uid):
+    return packer(ChatRelayMessage(uniq_msg_id=uid, sender_ip=1, old_message_ids=[],
+                                   sender_nick="bob", msg_text="hi"))
+
+def keepalive(uid):
+    return packer(KeepaliveRelayMessage(uniq_msg_id=uid, sender_ip=1))
+
+def free_port():
+    with socket.socket(type=socket.SOCK_DGRAM) as sock:
+        sock.bind((str(LOCAL), 0))
+        return sock.getsockname()[1]
+
+class TestListener(unittest.TestCase):
+
+    def make_listener(self, **kwargs):
+        with patch("smplchat.udp_comms.listener.PORT", free_port()):
+            listener = Listener(LOCAL, **kwargs)
+        self.addCleanup(listener.stop)
+        return listener
+
+    def send(self, listener, *datagrams):
+        with socket.socket(type=socket.SOCK_DGRAM) as sock:
+            for data in datagrams:
+                sock.sendto(data, listener.sock.getsockname())
+
+    def test_receive(self):
+        listener = self.make_listener()
+        self.assertEqual(listener.get_messages(), [])
+        self.send(listener, chat(1))
+        self.assertEqual(listener.get_messages(), [(chat(1), LOCAL)])
+        self.assertEqual(listener.enqueued, 1)
+
+    def test_batch_split(self):
+        listener = self.make_listener()
+        self.send(listener, *pack_batches([chat(1), chat(2)], 1400))
+        self.assertEqual([m for m, _ in listener.get_messages()], [chat(1), chat(2)])
+
+    def test_keepalives_after_others(self):
+        listener = self.make_listener()
+        self.send(listener, keepalive(1), chat(2))
+        self.assertEqual([m for m, _ in listener.get_messages()], [chat(2), keepalive(1)])
+
+    def test_limit_leaves_rest_queued(self):
+        listener = self.make_listener()
+        self.send(listener, chat(1), chat(2), chat(3))
+        self.assertEqual(len(listener.get_messages(limit=2)), 2)
+        self.assertEqual(len(listener), 1)
+        self.assertEqual(listener.get_messages(), [(chat(3), LOCAL)])
+
+    def test_drop_keepalives_first(self):
+        listener = self.make_listener(capacity=2, drop_policy="keepalives")
+        self.send(listener, chat(1), keepalive(2), chat(3))
+        self.assertEqual([m for m, _ in listener.get_messages()], [chat(1), chat(3)])
+        self.assertEqual((listener.enqueued, listener.dropped, listener.max_depth), (3, 1, 2))
+
+    def test_drop_oldest(self):
+        listener = self.make_listener(capacity=2, drop_policy="oldest")
+        self.send(listener, chat(1), keepalive(2), chat(3))
+        self.assertEqual([m for m, _ in listener.get_messages()], [chat(3), keepalive(2)])
+        self.assertIn("1 dropped", listener.stats())
+
+    def test_views_to_reused_slots(self):
+        listener = self.make_listener(capacity=1000, slots=2)
+        for round_ in range(10):
+            # 10 x 20 x 7 KB goes through the two 256 KiB slots a few times
+            self.send(listener, *(chat(round_ * 1000 + i) + bytes(7000) for i in range(20)))
+            got = []
+            while len(got) < 20:
+                messages = listener.get_messages()
+                self.assertTrue(messages)
+                self.assertIsInstance(messages[0][0], memoryview)
+                # copy before next call, the views are reused
+                got += [bytes(m[:len(chat(0))]) for m, _ in messages]
+            self.assertEqual(got, [chat(round_ * 1000 + i) for i in range(20)])
+
+    def test_flood_past_slots(self):
+        listener = self.make_listener(capacity=100, slots=2)
+        got = []
+        for round_ in range(20):
+            # 20 x 7 KB per round, consumer takes only 5: slots fill long
+            # before the queue does, then the queue bound drops by policy
+            self.send(listener, *(chat(round_ * 100 + i) + bytes(7000) for i in range(20)))
+            got += [bytes(m[:len(chat(0))]) for m, _ in listener.get_messages(limit=5)]
+        self.assertEqual(len(listener), 95)	# full queue less the last 5 taken
+        self.assertEqual(listener.dropped, 20 * 20 - 95 - len(got))
+        self.assertGreater(listener.spilled, 0)
+        self.assertIn(kernel_drops(listener.sock), (0, None))
+        got += [bytes(m[:len(chat(0))]) for m, _ in listener.get_messages(limit=1000)]
+        # newest 100 survive intact, spilled copies included
+        self.assertEqual(got[-100:], [chat(round_ * 100 + i)
+                                      for round_ in range(15, 20) for i in range(20)])
+
+    def test_unpack_view(self):
+        listener = self.make_listener()
+        self.send(listener, chat(1))
+        (msg, ip), = listener.get_messages()
+        self.assertEqual(unpacker(msg).uniq_msg_id, 1)
+        self.assertEqual(unpacker(msg).raw, chat(1))
+        self.assertEqual(ip, LOCAL)
+
+    def test_address_cached(self):
+        listener = self.make_listener()
+        self.send(listener, chat(1))
+        self.send(listener, chat(2))
+        (_, ip1), (_, ip2) = listener.get_messages()
+        self.assertIs(ip1, ip2)
+
+    def test_kernel_drops(self):
+        listener = self.make_listener()
+        drops = kernel_drops(listener.sock)
+        if drops is None:
+            self.skipTest("no /proc/net/udp")
+        self.assertEqual(drops, 0)
+        self.assertIn("kernel dropped 0", listener.stats())
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            self.make_listener(drop_policy="newest")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+from unittest.mock import patch
 from ipaddress import IPv4Address
 from smplchat.settings import MAX_MESSAGES
 from smplchat.message_list import MessageList
@@ -225,3 +226,98 @@ class TestMessageList(unittest.TestCase):
         self.assertEqual(len(ml.get()), MAX_MESSAGES)
         self.assertEqual(ml.get()[0].uid, 10)
         self.assertEqual(ml.get()[-1].uid, MAX_MESSAGES + 9)
+
+    def test_cleanup_horizon(self):
+        ml = MessageList()
+        self.assertEqual(ml.horizon, 0)
+        for i in range(MAX_MESSAGES + 10):
+            ml._MessageList__messages.append(
+                FullMessageEntry(uid=i, seen=1, nick="n", message="m")
+            )
+        ml.cleanup()
+        self.assertEqual(ml.horizon, 9)
+
+    def test_add_missing(self):
+        self.ml = MessageList()
+        self.add_chat3()
+        self.assertEqual(self.ml.add_missing([40, 13, 30, 30]), [40, 13, 30])
+        self.assertEqual(self.ml.add_missing([40, 50]), [40, 50])
+        self.assertEqual([e.uid for e in self.ml.get()], [13, 5, 40, 30, 50])
+        self.assertIsInstance(self.ml.get()[-1], WaitingMessageEntry)
+        self.assertIsNotNone(self.ml.next_fetch())
+
+    def test_add_snapshot(self):
+        self.ml = MessageList()
+        self.add_chat3()	# 13 waiting before 5
+        new = self.ml.add_snapshot([(2, "a", "two"), (13, "b", "thirteen"),
+                                    (5, "c", "ignored"), (7, "d", "seven"), (7, "d", "seven")])
+        self.assertEqual(new, [(2, "a", "two"), (13, "b", "thirteen"), (7, "d", "seven")])
+        self.assertEqual([e.uid for e in self.ml.get()], [2, 13, 5, 7])
+        self.assertEqual(self.ml.get_by_uid(13).message, "thirteen")
+        self.assertEqual(self.ml.get_by_uid(5).nick, "mokkeli")
+        self.assertEqual(self.ml.latest_messages(2), [(5, "mokkeli", "höh. ei se nyt niin saa olla."),
+                                                      (7, "d", "seven")])
+        self.assertEqual(self.ml.latest_messages(0), [])
+
+    def test_add_snapshot_order(self):
+        self.ml = MessageList()
+        # waiting in uid order, the sender has them in another order
+        self.ml.add_missing([3, 9, 10, 14, 27])
+        sent = [(9, "a", "9"), (14, "a", "14"), (10, "a", "10"), (27, "a", "27"), (3, "a", "3")]
+        self.assertEqual(sorted(self.ml.add_snapshot(sent)), sorted(sent))
+        self.assertEqual([e.uid for e in self.ml.get()], [9, 14, 10, 27, 3])
+        self.assertIsNone(self.ml.next_fetch())
+
+    def test_find_follows_inserts(self):
+        self.ml = MessageList()
+        self.add_chat_with_history2()
+        self.add_chat_with_history()
+        for uid in (3, 5, 55, 81):
+            pos = self.ml.find(uid)
+            self.assertEqual(self.ml.get()[pos].uid, uid)
+        self.assertIsNone(self.ml.find(1234))
+
+    def test_index_after_cleanup(self):
+        ml = MessageList()
+        for i in range(MAX_MESSAGES + 10):
+            ml.add(ChatRelayMessage(
+                uniq_msg_id=i + 1000,
+                sender_ip=55,
+                old_message_ids=[],
+                sender_nick="n",
+                msg_text="m"))
+        ml.cleanup()
+        self.assertIsNone(ml.find(1000))
+        self.assertEqual(ml.seen_count(1000), 0)
+        self.assertEqual(ml.find(1010), 0)
+        self.assertEqual(ml.get_by_uid(1010).uid, 1010)
+        self.assertEqual(ml.find(MAX_MESSAGES + 1009), MAX_MESSAGES - 1)
+
+    def test_index_after_clear(self):
+        self.ml = MessageList()
+        self.add_chat1()
+        self.ml.sys_message("joo")
+        self.ml.clear_user_messages()
+        self.assertIsNone(self.ml.find(3))
+        self.add_chat1()
+        self.assertEqual(self.ml.find(3), 1)
+        self.assertEqual(self.ml.seen_count(3), 1)
+
+    def test_textual_contents_limit(self):
+        self.ml = MessageList()
+        for i in range(10):
+            self.ml.sys_message(f"msg {i}")
+        lines = self.ml.get_textual_contents(3)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[-1].endswith("msg 9"))
+        self.assertEqual(self.ml.get_textual_contents()[-3:], lines)
+        self.add_chat_with_history()
+        self.assertEqual(self.ml.get_textual_contents(3)[0], "Message pending")
+
+
+class TestColumnarMessageList(TestMessageList):
+    """ same tests with the memory compact storage backend """
+    def setUp(self):
+        patcher = patch("smplchat.message_list.list.MESSAGE_BACKEND", "columnar")
+        patcher.start()
+        self.addCleanup(patcher.stop)
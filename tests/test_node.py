@@ -0,0 +1,300 @@
+import unittest
+from unittest.mock import patch
+from ipaddress import IPv4Address
+from time import time
+
+from smplchat.node import NodeCore
+from smplchat.udp_comms import Dispatcher, packer, unpacker, split_batch, PROTOCOL_VERSION
+from smplchat.message import (
+    MessageType,
+    ChatRelayMessage,
+    KeepaliveRelayMessage,
+    OldReplyMessage,
+    JoinRequestMessage)
+from smplchat.settings import KEEPALIVE_INTERVAL, ANTI_ENTROPY_INTERVAL
+from tests.helpers import FakeClock, FakeSender
+
+SELF = IPv4Address("10.0.0.1")
+PEER = IPv4Address("10.0.0.2")
+OTHER = IPv4Address("10.0.0.3")
+
+def chat(uid, text="hi", old=()):
+    return packer(ChatRelayMessage(uniq_msg_id=uid, sender_ip=int(OTHER),
+                                   old_message_ids=list(old),
+                                   sender_nick="bob", msg_text=text))
+
+class TestNodeCore(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sender = FakeSender()
+        self.node = NodeCore(SELF, "me", Dispatcher(self.sender), clock=self.clock)
+        self.delivered = []
+        self.node.subscribe(self.delivered.append)
+
+    def test_chat_delivered_once(self):
+        self.node.receive(chat(1), PEER)
+        self.node.receive(chat(1), PEER)
+        self.assertEqual([m.msg_text for m in self.delivered], ["hi"])
+        self.assertIn(PEER, self.node.client_list.get_all())
+        self.assertIsNotNone(self.node.msg_list.get_by_uid(1))
+
+    def test_chat_relayed(self):
+        self.node.client_list.add(OTHER)
+        self.node.receive(chat(1), PEER)
+        self.node.dispatcher.flush()
+        self.assertIn((chat(1), OTHER), self.sender.sent)
+
+    def test_old_reply_delivered(self):
+        self.node.receive(chat(2, old=[1]), PEER)
+        self.node.receive(packer(OldReplyMessage(
+            uniq_msg_id=1, sender_nick="bob", msg_text="earlier")), PEER)
+        self.assertEqual([m.msg_text for m in self.delivered], ["hi", "earlier"])
+
+    def test_unsubscribe(self):
+        self.node.unsubscribe(self.delivered.append)
+        self.node.receive(chat(1), PEER)
+        self.assertEqual(self.delivered, [])
+
+    def test_post(self):
+        self.node.client_list.add(PEER)
+        msg = self.node.post("hello")
+        self.node.dispatcher.flush()
+        self.assertEqual(self.sender.types(), [MessageType.CHAT_RELAY])
+        self.assertEqual(self.node.msg_list.get_by_uid(msg.uniq_msg_id).message, "hello")
+        self.assertEqual(self.delivered, [])
+
+    def test_keepalive_when_due(self):
+        self.node.client_list.add(PEER)
+        self.node.tick()
+        self.assertEqual(self.sender.types(), [])
+        self.assertEqual(self.node.next_keepalive(), 1000.0 + KEEPALIVE_INTERVAL)
+        self.clock.now += KEEPALIVE_INTERVAL
+        self.node.tick()
+        self.assertEqual(self.sender.types(), [MessageType.KEEPALIVE_RELAY])
+
+    def test_keepalive_relayed_once(self):
+        self.node.client_list.add(OTHER)
+        data = packer(KeepaliveRelayMessage(uniq_msg_id=7, sender_ip=int(PEER)))
+        for _ in range(4):
+            self.node.receive(data, PEER)
+        self.assertEqual(self.sender.types(), [MessageType.KEEPALIVE_RELAY] * 2)
+
+    def test_next_deadline(self):
+        self.assertLessEqual(self.node.next_deadline(), self.node.next_keepalive())
+
+class TwoNodes(unittest.TestCase):
+    """ nodes SELF and PEER that know each other, sent messages are
+        delivered by pump() """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.nodes = {}
+        for ip, peer in ((SELF, PEER), (PEER, SELF)):
+            sender = FakeSender()
+            node = NodeCore(ip, str(ip), Dispatcher(sender), clock=self.clock)
+            node.client_list.add(peer)
+            node.dispatcher.hello_from(peer, PROTOCOL_VERSION)
+            self.nodes[ip] = (node, sender)
+        self.pump()
+
+    def pump(self, drop=lambda msg: False):
+        """ delivers sent messages until nothing is sent, returns their
+            types. Messages for which drop(msg) is true are lost. """
+        types = []
+        while True:
+            moved = False
+            for ip, (node, sender) in self.nodes.items():
+                node.dispatcher.flush()
+                sent, sender.sent = sender.sent, []
+                for data, dest in sent:
+                    if dest not in self.nodes:
+                        continue
+                    for msg in split_batch(data):
+                        types.append(msg[0])
+                        if not drop(msg):
+                            self.nodes[dest][0].receive(msg, ip)
+                    moved = True
+            if not moved:
+                return types
+
+class TestAntiEntropy(TwoNodes):
+
+    def test_gap_filled(self):
+        a, b = self.nodes[SELF][0], self.nodes[PEER][0]
+        base = int(time()) - 3600
+        uids = [(base + i * 20) << 32 | i for i in range(150)]
+        for i, uid in enumerate(uids):
+            b.msg_list.add(unpacker(chat(uid, text=str(i))))
+            if i < 10 or i >= 140:
+                a.msg_list.add(unpacker(chat(uid, text=str(i))))
+        a.msg_list.add_missing([uids[20]])	# waiting already
+        self.pump()
+        self.assertEqual(a.send_digest(), PEER)
+        types = self.pump()
+        self.assertEqual(types.count(MessageType.DIGEST_REPLY), 1)
+        self.assertNotIn(MessageType.OLD_REQUEST, types)
+        self.assertIn(MessageType.OLD_BATCH_REQUEST, types)
+        self.assertEqual(set(a.msg_list.latest_ids()), set(uids))
+        self.assertEqual(a.msg_list.get_by_uid(uids[70]).message, "70")
+
+    def test_both_ways(self):
+        a, b = self.nodes[SELF][0], self.nodes[PEER][0]
+        base = int(time()) - 600
+        for i in range(10):
+            uid = (base + i * 30) << 32 | i
+            for node in (a, b) if i in (0, 9) else (a,) if i % 2 else (b,):
+                node.msg_list.add(unpacker(chat(uid)))
+        self.pump()
+        b.send_digest()
+        types = self.pump()
+        self.assertEqual(types.count(MessageType.DIGEST_REPLY), 2)
+        self.assertEqual(sorted(a.msg_list.latest_ids()), sorted(b.msg_list.latest_ids()))
+        self.assertEqual(len(a.msg_list.latest_ids()), 10)
+        b.send_digest()
+        self.assertEqual(self.pump(), [MessageType.DIGEST])
+
+    def test_digest_on_timer(self):
+        node = self.nodes[SELF][0]
+        self.clock.now += ANTI_ENTROPY_INTERVAL
+        node.tick()
+        self.assertIn(MessageType.DIGEST, self.pump())
+
+    def test_no_digest_to_old_peers(self):
+        node = NodeCore(SELF, "me", Dispatcher(FakeSender()), clock=self.clock)
+        node.client_list.add(OTHER)
+        self.assertIsNone(node.send_digest())
+
+
+class TestOldBatch(TwoNodes):
+
+    def test_join_history_in_batches(self):
+        a, b = self.nodes[SELF][0], self.nodes[PEER][0]
+        base = int(time()) - 3600
+        texts = {(base + i) << 32 | i: f"message {i} " + "x" * 40 for i in range(100)}
+        for uid, text in texts.items():
+            b.msg_list.add(unpacker(chat(uid, text=text)))
+        # peers from before snapshots
+        a.dispatcher.hello_from(PEER, 5)
+        b.dispatcher.hello_from(SELF, 5)
+        a.join(PEER)
+        types = self.pump()
+        self.assertNotIn(MessageType.SNAPSHOT, types)
+        self.assertEqual(types.count(MessageType.OLD_BATCH_REQUEST), 1)
+        self.assertGreater(types.count(MessageType.OLD_BATCH_REPLY), 1)
+        self.assertNotIn(MessageType.OLD_REPLY, types)
+        for uid, text in texts.items():
+            self.assertEqual(a.msg_list.get_by_uid(uid).message, text)
+
+    def test_join_history_order_kept(self):
+        a, b = self.nodes[SELF][0], self.nodes[PEER][0]
+        # sent in the same second, uid order is not the order of history
+        base = int(time()) << 32
+        uids = [base | low for low in (9, 14, 10, 27, 3, 20)]
+        for uid in uids:
+            b.msg_list.add(unpacker(chat(uid, text=str(uid & 0xff))))
+        a.dispatcher.hello_from(PEER, 5)
+        b.dispatcher.hello_from(SELF, 5)
+        a.join(PEER)
+        self.pump()
+        self.assertEqual(a.msg_list.latest_ids()[:len(uids)], uids)
+        self.assertEqual(a.msg_list.latest_ids(), b.msg_list.latest_ids())
+
+    def test_maintain_batches_due(self):
+        node = self.nodes[SELF][0]
+        with patch("smplchat.message_list.retry.FETCH_BACKOFF_BASE", 0):
+            node.msg_list.add_missing(list(range(1, 201)))
+        node.maintain()
+        types = self.pump()
+        self.assertEqual(types.count(MessageType.OLD_BATCH_REQUEST), 2)
+
+    def test_old_peer_single_requests(self):
+        node = NodeCore(SELF, "me", Dispatcher(FakeSender()), clock=self.clock)
+        node.fetch([1, 2, 3], OTHER)
+        self.assertEqual(node.dispatcher.sender.types(), [MessageType.OLD_REQUEST] * 3)
+
+
+class TestSnapshot(TwoNodes):
+
+    def setUp(self):
+        super().setUp()
+        self.a, self.b = self.nodes[SELF][0], self.nodes[PEER][0]
+        base = int(time()) - 3600
+        self.history = [((base + i) << 32 | i, "bob", f"message {i} " + "x" * 40)
+                        for i in range(300)]
+        for uid, nick, text in self.history:
+            self.b.msg_list.add(unpacker(chat(uid, text=text)))
+        self.delivered = []
+        self.a.subscribe(self.delivered.append)
+
+    def backlog(self, node):
+        """ history without join relays """
+        return [m for m in node.msg_list.latest_messages(1000) if m[1] == "bob"]
+
+    def assert_backlog(self):
+        self.assertEqual(self.backlog(self.a), self.history)
+        self.assertEqual(len(self.delivered), len(self.history))
+
+    def test_join_snapshot(self):
+        self.a.join(PEER)
+        types = self.pump()
+        self.assertGreater(types.count(MessageType.SNAPSHOT), 10)
+        self.assertNotIn(MessageType.OLD_BATCH_REQUEST, types)
+        self.assertNotIn(MessageType.SNAPSHOT_NACK, types)
+        self.assert_backlog()
+        self.assertIsNone(self.a.msg_list.next_fetch())	# join reply ids filled
+
+    def test_same_second_order(self):
+        base = int(time()) << 32
+        uids = [base | low for low in (9, 14, 10, 27, 3, 20)]
+        history = [(uid, "bob", str(uid & 0xff)) for uid in uids]
+        for uid, _, text in history:
+            self.b.msg_list.add(unpacker(chat(uid, text=text)))
+        self.history += history
+        self.a.msg_list.add_missing(sorted(uids))	# known from a digest already
+        self.a.join(PEER)
+        self.pump()
+        self.assert_backlog()
+        self.assertEqual(self.a.msg_list.latest_ids(), self.b.msg_list.latest_ids())
+        self.assertEqual(self.a.msg_list.latest_messages(1)[0][2], "*** joined the chat")
+
+    def test_lost_chunks_asked_again(self):
+        lost = set()
+        def drop(msg):
+            if msg[0] == MessageType.SNAPSHOT and unpacker(msg).seq % 3 == 1:
+                lost.add(unpacker(msg).seq)
+                return True
+            return False
+        self.a.join(PEER)
+        self.pump(drop)
+        self.assertTrue(lost)
+        self.assertLessEqual(self.a.next_maintenance(), self.clock.now + 1)
+        self.clock.now = self.a.next_maintenance()
+        self.a.maintain()
+        types = self.pump()
+        self.assertEqual(types.count(MessageType.SNAPSHOT_NACK), 1)
+        self.assertEqual(types.count(MessageType.SNAPSHOT), len(lost))
+        self.assert_backlog()
+
+    def test_partial_snapshot_after_retries(self):
+        self.a.join(PEER)
+        self.pump(lambda msg: msg[0] == MessageType.SNAPSHOT and unpacker(msg).seq == 0)
+        for _ in range(10):
+            due = self.a.next_maintenance()
+            self.clock.now = max(self.clock.now, due)
+            self.a.maintain()
+            self.pump(lambda msg: msg[0] == MessageType.SNAPSHOT)
+        got = self.backlog(self.a)
+        self.assertTrue(got)
+        self.assertEqual(got, [m for m in self.history if m in got])
+        self.assertLess(len(got), len(self.history))
+
+    def test_unsolicited_snapshot_ignored(self):
+        self.a.msg_list.add(unpacker(chat(5, text="not asked")))
+        self.a.receive(packer(JoinRequestMessage(1, "x")), PEER)
+        types = self.pump()
+        self.assertIn(MessageType.SNAPSHOT, types)
+        self.assertIsNone(self.b.msg_list.get_by_uid(5))
+
+if __name__ == "__main__":
+    unittest.main()
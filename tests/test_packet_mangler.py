@@ -3,7 +3,8 @@ from random import randrange, choice
 from ipaddress import IPv4Address
 from secrets import randbits
 
-from smplchat.udp_comms import packer, unpacker
+import struct
+from smplchat.udp_comms import packer, unpacker, peek_header, is_compact, to_legacy, pack_batches, split_batch, old_batch_replies, snapshot_chunks
 from smplchat.message import *
 
 class TestPacker(unittest.TestCase):
@@ -82,3 +83,134 @@ class TestPacker(unittest.TestCase):
                 msg_text = "".join(chr(randrange(1,4000))
                         for x in range(randrange(2000))) )
             self.assertEqual(tm, unpacker(packer(tm)))
+
+class TestPeekHeader(unittest.TestCase):
+    def test_peek_header(self):
+        msgs = [
+            ChatRelayMessage(11, IPv4Address("1.2.3.4"), [1, 2], "n", "t"),
+            JoinRelayMessage(12, IPv4Address("1.2.3.4"), [1], "n"),
+            LeaveRelayMessage(13, IPv4Address("1.2.3.4"), [], "n"),
+            KeepaliveRelayMessage(14, IPv4Address("1.2.3.4")),
+            JoinRequestMessage(15, "n"),
+            OldRequestMessage(16),
+            OldReplyMessage(17, "n", "t")]
+        for msg in msgs:
+            msg_type, uid = peek_header(packer(msg))
+            self.assertEqual(uid, msg.uniq_msg_id)
+            self.assertEqual(msg_type, packer(msg)[0])
+            relay = msg_type <= MessageType.KEEPALIVE_RELAY
+            self.assertEqual(unpacker(packer(msg)).raw, packer(msg) if relay else None)
+        self.assertEqual(peek_header(packer(JoinReplyMessage([1], []))),
+                         (MessageType.JOIN_REPLY, None))
+        self.assertEqual(peek_header(b"\x00\x01"), (0, None))
+        self.assertEqual(peek_header(b"\x55" * 20), (0x55, None))
+        self.assertEqual(peek_header(b""), (None, None))
+
+class TestCompactIds(unittest.TestCase):
+    def test_compact_roundtrip(self):
+        for _ in range(100):
+            base = randrange(1 << 31) << 32
+            ids = [base + randrange(-(1 << 34), 1 << 34) for _ in range(randrange(60))]
+            ids = [max(0, min(uid, (1 << 64) - 1)) for uid in ids]
+            msgs = [
+                ChatRelayMessage(randbits(64), IPv4Address(randbits(32)), ids, "n", "t"),
+                JoinRelayMessage(randbits(64), IPv4Address(randbits(32)), ids, "nick"),
+                LeaveRelayMessage(randbits(64), IPv4Address(randbits(32)), ids, "nick"),
+                JoinReplyMessage(ids, [IPv4Address(randbits(32)) for _ in range(5)])]
+            for tm in msgs:
+                data = packer(tm, compact=True)
+                self.assertTrue(is_compact(data))
+                self.assertEqual(tm, unpacker(data))
+                self.assertEqual(to_legacy(data), packer(tm))
+
+    def test_extreme_ids(self):
+        ids = [0, (1 << 64) - 1, 0, 1, (1 << 63)]
+        tm = ChatRelayMessage(1, IPv4Address(1), ids, "n", "t")
+        self.assertEqual(unpacker(packer(tm, compact=True)).old_message_ids, ids)
+
+    def test_compact_flag_ignored_without_ids(self):
+        tm = KeepaliveRelayMessage(5, IPv4Address(7))
+        self.assertEqual(packer(tm, compact=True), packer(tm))
+        self.assertFalse(is_compact(packer(tm)))
+
+    def test_truncated(self):
+        tm = ChatRelayMessage(1, IPv4Address(1), [1 << 40, 1 << 50], "n", "t")
+        data = packer(tm, compact=True)
+        with self.assertRaises(struct.error):
+            unpacker(data[:27])
+
+    def test_peek_compact(self):
+        tm = ChatRelayMessage(99, IPv4Address(1), [1, 2, 3], "n", "t")
+        self.assertEqual(peek_header(packer(tm, compact=True)), (MessageType.CHAT_RELAY, 99))
+
+    def test_hello(self):
+        self.assertEqual(unpacker(packer(HelloMessage(7))), HelloMessage(7))
+        self.assertEqual(peek_header(packer(HelloMessage(7))), (MessageType.HELLO, None))
+
+    def test_digest(self):
+        tm = DigestMessage(7, [(8, 2, 1 << 63), (10, 1, 5)])
+        self.assertEqual(unpacker(packer(tm)), tm)
+        self.assertEqual(peek_header(packer(tm)), (MessageType.DIGEST, None))
+        self.assertEqual(unpacker(packer(DigestMessage(0, []))), DigestMessage(0, []))
+
+    def test_digest_reply(self):
+        uids = sorted(randbits(64) for _ in range(20))
+        tm = DigestReplyMessage([8, 10], uids)
+        self.assertEqual(unpacker(packer(tm)), tm)
+        self.assertEqual(peek_header(packer(tm)), (MessageType.DIGEST_REPLY, None))
+        self.assertRaises(struct.error, unpacker, packer(tm)[:-1])
+
+    def test_old_batch_request(self):
+        tm = OldBatchRequestMessage([randbits(64) for _ in range(30)])
+        self.assertEqual(unpacker(packer(tm)), tm)
+        self.assertEqual(peek_header(packer(tm)), (MessageType.OLD_BATCH_REQUEST, None))
+
+    def test_old_batch_reply(self):
+        tm = OldBatchReplyMessage([(randbits(64), "n" * i, "tëxt" * i) for i in range(10)])
+        self.assertEqual(unpacker(packer(tm)), tm)
+        self.assertEqual(peek_header(packer(tm)), (MessageType.OLD_BATCH_REPLY, None))
+        self.assertRaises(struct.error, unpacker, packer(tm)[:-1])
+
+    def test_old_batch_replies_fit(self):
+        messages = [(randbits(64), "nick", "ä" * randrange(300)) for _ in range(50)]
+        messages.append((1, "big", "x" * 3000))
+        replies = old_batch_replies(messages, 1400)
+        self.assertEqual([m for r in replies for m in r.messages], messages)
+        self.assertEqual(replies[-1].messages, [(1, "big", "x" * 3000)])
+        for reply in replies[:-1]:
+            self.assertLessEqual(len(packer(reply)), 1400)
+        self.assertEqual(old_batch_replies([], 1400), [])
+
+    def test_snapshot(self):
+        tm = SnapshotMessage(randbits(32), 3, 9, [(randbits(64), "nick", "tëxt")] * 3)
+        self.assertEqual(unpacker(packer(tm)), tm)
+        self.assertEqual(peek_header(packer(tm)), (MessageType.SNAPSHOT, None))
+        tm = SnapshotNackMessage(randbits(32), [0, 5, 65535])
+        self.assertEqual(unpacker(packer(tm)), tm)
+
+    def test_snapshot_chunks(self):
+        messages = [(randbits(64), "nick", "ä" * randrange(300)) for _ in range(50)]
+        chunks = snapshot_chunks(7, messages, 1400)
+        self.assertEqual([m for c in chunks for m in c.messages], messages)
+        self.assertEqual([(c.snapshot_id, c.seq, c.total) for c in chunks],
+                         [(7, i, len(chunks)) for i in range(len(chunks))])
+        for chunk in chunks:
+            self.assertLessEqual(len(packer(chunk)), 1400)
+
+class TestBatch(unittest.TestCase):
+    def test_batches(self):
+        msgs = [bytes([3]) + bytes(randrange(1, 700)) for _ in range(100)]
+        packets = pack_batches(msgs, 1400)
+        self.assertTrue(all(len(p) <= 1400 for p in packets))
+        self.assertLess(len(packets), len(msgs))
+        self.assertEqual([m for p in packets for m in split_batch(p)], msgs)
+
+    def test_single_and_large(self):
+        small, large = b"\x03" * 10, b"\x00" * 2000
+        self.assertEqual(pack_batches([small], 1400), [small])
+        self.assertEqual(pack_batches([small, large, small], 1400), [small, large, small])
+        self.assertEqual(split_batch(small), [small])
+
+    def test_truncated_batch(self):
+        packet = pack_batches([b"\x03" * 10, b"\x03" * 20], 1400)[0]
+        self.assertEqual(split_batch(packet[:-5]), [b"\x03" * 10])
@@ -0,0 +1,53 @@
+import os
+import signal
+import socket
+import threading
+import unittest
+from time import monotonic
+
+from smplchat.poller import Poller
+
+class TestPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+        self.poller = Poller(self.a)
+
+    def tearDown(self):
+        self.poller.close()
+        self.a.close()
+        self.b.close()
+
+    def test_readable(self):
+        self.b.send(b"x")
+        self.assertEqual(self.poller.wait(monotonic() + 5), [self.a])
+
+    def test_deadline(self):
+        start = monotonic()
+        self.assertEqual(self.poller.wait(start + 0.05), [])
+        self.assertGreaterEqual(monotonic() - start, 0.04)
+
+    def test_past_deadline_returns_at_once(self):
+        self.assertEqual(self.poller.wait(monotonic() - 1), [])
+
+    def test_wake_from_thread(self):
+        threading.Timer(0.05, self.poller.wake).start()
+        start = monotonic()
+        self.assertEqual(self.poller.wait(None), [])
+        self.assertLess(monotonic() - start, 5)
+
+    @unittest.skipUnless(hasattr(signal, "SIGUSR1"), "needs SIGUSR1")
+    def test_signal_wakes(self):
+        caught = []
+        old = signal.signal(signal.SIGUSR1, lambda *_: caught.append(1))
+        try:
+            threading.Timer(0.05, os.kill, (os.getpid(), signal.SIGUSR1)).start()
+            start = monotonic()
+            self.poller.wait(start + 5)
+            self.assertLess(monotonic() - start, 4)
+            self.assertEqual(caught, [1])
+        finally:
+            signal.signal(signal.SIGUSR1, old)
+
+if __name__ == "__main__":
+    unittest.main()
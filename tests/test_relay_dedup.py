@@ -0,0 +1,45 @@
+import unittest
+
+from smplchat.client_list import RelayDedup
+from tests.helpers import FakeClock
+
+class TestRelayDedup(unittest.TestCase):
+
+    def test_add_returns_previous_count(self):
+        rd = RelayDedup(capacity=100)
+        self.assertEqual(rd.add(1), 0)
+        self.assertEqual(rd.add(1), 1)
+        self.assertEqual(rd.add(2), 0)
+        self.assertEqual(rd.seen_count(1), 2)
+        self.assertEqual(rd.seen_count(2), 1)
+        self.assertEqual(rd.seen_count(3), 0)
+
+    def test_capacity(self):
+        rd = RelayDedup(capacity=100, generations=4)
+        for uid in range(1000):
+            rd.add(uid)
+        self.assertLessEqual(len(rd), 100)
+        self.assertEqual(rd.seen_count(0), 0)
+        self.assertEqual(rd.seen_count(999), 1)
+
+    def test_time_rotation(self):
+        clock = FakeClock(0.0)
+        rd = RelayDedup(capacity=100, generations=2, rotate_interval=10, clock=clock)
+        rd.add(1)
+        clock.now = 11
+        rd.add(2)
+        self.assertEqual(rd.seen_count(1), 1)
+        clock.now = 22
+        rd.add(3)
+        self.assertEqual(rd.seen_count(1), 0)
+        self.assertEqual(rd.seen_count(2), 1)
+
+    def test_seen_again_survives_rotation(self):
+        clock = FakeClock(0.0)
+        rd = RelayDedup(capacity=100, generations=2, rotate_interval=10, clock=clock)
+        rd.add(1)
+        clock.now = 11
+        self.assertEqual(rd.add(1), 1)
+        clock.now = 22
+        rd.add(2)
+        self.assertEqual(rd.seen_count(1), 2)
@@ -0,0 +1,75 @@
+import unittest
+from unittest.mock import patch
+
+from smplchat.settings import FETCH_GIVE_UP
+from smplchat.message_list.retry import RetryScheduler
+from smplchat.message_list import MessageList
+from smplchat.message_list.list import GivenUpMessageEntry, WaitingMessageEntry
+from smplchat.message import JoinReplyMessage
+from tests.helpers import FakeClock
+
+class TestRetryScheduler(unittest.TestCase):
+
+    def test_not_due_before_delay(self):
+        clock = FakeClock()
+        rs = RetryScheduler(clock)
+        rs.add(1)
+        self.assertIsNone(rs.pop_due())
+        clock.now += 100
+        self.assertEqual(rs.pop_due(), (1, 0))
+        self.assertIsNone(rs.pop_due())
+
+    def test_backoff_grows(self):
+        with patch("smplchat.message_list.retry.uniform", return_value=1.0):
+            delays = [RetryScheduler.delay(i) for i in range(4)]
+        self.assertEqual(delays, sorted(delays))
+        self.assertLess(delays[0], delays[-1])
+
+    def test_give_up(self):
+        clock = FakeClock()
+        rs = RetryScheduler(clock)
+        rs.add(5)
+        for attempt in range(FETCH_GIVE_UP + 1):
+            clock.now += 10000
+            self.assertEqual(rs.pop_due(), (5, attempt))
+        self.assertNotIn(5, rs)
+        clock.now += 10000
+        self.assertIsNone(rs.pop_due())
+
+    def test_discard_and_readd(self):
+        clock = FakeClock()
+        rs = RetryScheduler(clock)
+        rs.add(7)
+        rs.discard(7)
+        self.assertIsNone(rs.next_due())
+        clock.now += 100
+        rs.add(7)
+        self.assertIsNone(rs.pop_due())
+        self.assertEqual(len(rs), 1)
+
+    def test_earliest_first(self):
+        clock = FakeClock()
+        rs = RetryScheduler(clock)
+        rs.add(1)
+        clock.now += 0.5
+        rs.add(2)
+        clock.now += 100
+        self.assertEqual(rs.pop_due()[0], 1)
+        self.assertEqual(rs.pop_due()[0], 2)
+
+class TestWaitingMessages(unittest.TestCase):
+
+    def test_waiting_message_fetch(self):
+        clock = FakeClock()
+        with patch("smplchat.message_list.retry.monotonic", clock):
+            ml = MessageList()
+        ml.add(JoinReplyMessage(old_message_ids=[3], ip_addresses=[]))
+        self.assertIsNone(ml.get_waiting_message())
+        for attempt in range(FETCH_GIVE_UP):
+            clock.now += 10000
+            self.assertEqual(ml.get_waiting_message(), 3)
+            self.assertEqual(ml.get()[0].fetch_count, attempt + 1)
+            self.assertIsInstance(ml.get()[0], WaitingMessageEntry)
+        clock.now += 10000
+        self.assertIsNone(ml.get_waiting_message())
+        self.assertIsInstance(ml.get()[0], GivenUpMessageEntry)
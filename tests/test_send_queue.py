@@ -0,0 +1,112 @@
+import unittest
+from ipaddress import IPv4Address
+
+from smplchat.udp_comms import SendQueue, packer, pack_batches
+from smplchat.udp_comms.send_queue import traffic_class, CONTROL, CHAT, BACKGROUND
+from smplchat.udp_comms.packer import pack_hello_message
+from smplchat.message import ChatRelayMessage, KeepaliveRelayMessage, HelloMessage
+from tests.helpers import FakeClock, FakeSender
+
+HELLO = pack_hello_message(HelloMessage(3))
+CHAT_MSG = packer(ChatRelayMessage(uniq_msg_id=1, sender_ip=2, old_message_ids=[3],
+                                   sender_nick="bob", msg_text="hi"))
+KEEPALIVE = packer(KeepaliveRelayMessage(uniq_msg_id=4, sender_ip=5))
+CHAT_COMPACT = packer(ChatRelayMessage(uniq_msg_id=1, sender_ip=2, old_message_ids=[3],
+                                       sender_nick="bob", msg_text="hi"), compact=True)
+
+A = IPv4Address("10.0.0.1")
+B = IPv4Address("10.0.0.2")
+
+def make_queue(**kwargs):
+    clock = FakeClock()
+    sender = FakeSender()
+    kwargs.setdefault("limit", 100)
+    kwargs.setdefault("rate", 0)
+    kwargs.setdefault("peer_rate", 0)
+    return SendQueue(sender, clock=clock, start=False, **kwargs), sender, clock
+
+class TestTrafficClass(unittest.TestCase):
+
+    def test_classes(self):
+        self.assertEqual(traffic_class(HELLO), CONTROL)
+        self.assertEqual(traffic_class(CHAT_MSG), CHAT)
+        self.assertEqual(traffic_class(CHAT_COMPACT), CHAT)
+        self.assertEqual(traffic_class(KEEPALIVE), BACKGROUND)
+        self.assertEqual(traffic_class(b""), BACKGROUND)
+
+    def test_batch_goes_by_first(self):
+        batch = pack_batches([CHAT_MSG, KEEPALIVE], 1400)
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(traffic_class(batch[0]), CHAT)
+
+class TestSendQueue(unittest.TestCase):
+
+    def test_priority_order(self):
+        queue, sender, _ = make_queue()
+        queue.send_batch([(KEEPALIVE, A), (CHAT_MSG, A), (HELLO, B)])
+        self.assertEqual(len(queue), 3)
+        self.assertIsNone(queue.pump())
+        self.assertEqual(sender.sent, [(HELLO, B), (CHAT_MSG, A), (KEEPALIVE, A)])
+        self.assertEqual(len(queue), 0)
+
+    def test_shed_background_first(self):
+        queue, sender, _ = make_queue(limit=2)
+        queue.send_batch([(KEEPALIVE, A), (KEEPALIVE, B)])
+        self.assertEqual(queue.send_batch([(CHAT_MSG, A)]), 1)
+        self.assertEqual(queue.send_batch([(KEEPALIVE, A)]), 0)
+        self.assertEqual(queue.shed, [0, 0, 2])
+        queue.pump()
+        self.assertEqual(sender.sent, [(CHAT_MSG, A), (KEEPALIVE, B)])
+
+    def test_shed_new_when_nothing_less_important(self):
+        queue, _, _ = make_queue(limit=1)
+        queue.sendto(CHAT_MSG, A)
+        queue.sendto(CHAT_MSG, B)
+        self.assertEqual(queue.shed, [0, 1, 0])
+        self.assertEqual(len(queue), 1)
+
+    def test_global_rate(self):
+        queue, sender, clock = make_queue(rate=2)
+        queue.send_batch([(CHAT_MSG, A)] * 5)
+        self.assertAlmostEqual(queue.pump(), 0.5)
+        self.assertEqual(len(sender.sent), 2)
+        clock.now += 0.5
+        queue.pump()
+        self.assertEqual(len(sender.sent), 3)
+        clock.now += 10
+        self.assertIsNone(queue.pump())
+        self.assertEqual(len(sender.sent), 5)
+
+    def test_peer_rate_does_not_block_others(self):
+        queue, sender, clock = make_queue(peer_rate=1)
+        queue.send_batch([(CHAT_MSG, A), (KEEPALIVE, A), (KEEPALIVE, B)])
+        self.assertAlmostEqual(queue.pump(), 1.0)
+        self.assertEqual(sender.sent, [(CHAT_MSG, A), (KEEPALIVE, B)])
+        self.assertEqual(len(queue), 1)
+        clock.now += 1.0
+        self.assertIsNone(queue.pump())
+        self.assertEqual(sender.sent[-1], (KEEPALIVE, A))
+        self.assertEqual(len(queue), 0)
+
+    def test_stop_drains(self):
+        queue, sender, _ = make_queue()
+        queue.send_batch([(CHAT_MSG, A), (HELLO, B)])
+        queue.stop()
+        self.assertEqual(len(sender.sent), 2)
+
+    def test_thread_sends(self):
+        sender = FakeSender()
+        queue = SendQueue(sender, limit=10, rate=0, peer_rate=0)
+        queue.sendto(CHAT_MSG, A)
+        queue.stop()
+        self.assertEqual(sender.sent, [(CHAT_MSG, A)])
+
+    def test_stats(self):
+        queue, _, _ = make_queue(limit=1)
+        queue.sendto(KEEPALIVE, A)
+        queue.sendto(KEEPALIVE, B)
+        self.assertIn("queued 1", queue.stats())
+        self.assertIn("1 background", queue.stats())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from ipaddress import IPv4Address
+
+from smplchat.snapshot import SnapshotSender, SnapshotReceiver, SNAPSHOT_KEEP, SNAPSHOT_WAIT
+from smplchat.message import SnapshotMessage, SnapshotNackMessage
+from smplchat.settings import SNAPSHOT_NACK_DELAY, SNAPSHOT_RETRIES
+from tests.helpers import FakeClock
+
+PEER = IPv4Address("10.0.0.2")
+OTHER = IPv4Address("10.0.0.3")
+
+MESSAGES = [(i, "nick", "x" * 300) for i in range(20)]
+
+def chunks(snapshot_id, total=4):
+    return [SnapshotMessage(snapshot_id, seq, total, [(seq, "n", str(seq))])
+            for seq in range(total)]
+
+class TestSnapshotSender(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sender = SnapshotSender(clock=self.clock)
+
+    def test_resend(self):
+        sent = self.sender.start(PEER, MESSAGES, 1400)
+        sid = sent[0].snapshot_id
+        self.assertEqual([m for c in sent for m in c.messages], MESSAGES)
+        self.assertEqual(self.sender.resend(PEER, SnapshotNackMessage(sid, [3, 1, 3, 99])),
+                         [sent[3], sent[1]])
+        self.assertEqual(self.sender.resend(OTHER, SnapshotNackMessage(sid, [1])), [])
+        self.clock.now += SNAPSHOT_KEEP
+        self.assertEqual(self.sender.resend(PEER, SnapshotNackMessage(sid, [1])), [])
+
+    def test_bounded(self):
+        for _ in range(100):
+            self.sender.start(PEER, MESSAGES, 1400)
+        self.assertLessEqual(len(self.sender), 16)
+
+class TestSnapshotReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.receiver = SnapshotReceiver(clock=self.clock)
+
+    def test_complete_in_order(self):
+        self.receiver.expect(PEER)
+        parts = chunks(7)
+        for chunk in (parts[2], parts[0], parts[3]):
+            self.assertIsNone(self.receiver.add(PEER, chunk))
+        self.assertEqual(self.receiver.add(PEER, parts[1]),
+                         [(i, "n", str(i)) for i in range(4)])
+        self.assertIsNone(self.receiver.next_deadline())
+
+    def test_not_expected(self):
+        self.assertIsNone(self.receiver.add(PEER, chunks(7, total=1)[0]))
+        self.receiver.expect(PEER)
+        self.clock.now += SNAPSHOT_WAIT + 1
+        self.assertIsNone(self.receiver.add(PEER, chunks(7, total=1)[0]))
+
+    def test_nack_and_give_up(self):
+        self.receiver.expect(PEER)
+        parts = chunks(7)
+        self.receiver.add(PEER, parts[1])
+        self.assertEqual(self.receiver.next_deadline(), self.clock.now + SNAPSHOT_NACK_DELAY)
+        self.assertEqual(self.receiver.poll(), ([], []))
+        self.clock.now = self.receiver.next_deadline()
+        self.assertEqual(self.receiver.poll(), ([(PEER, SnapshotNackMessage(7, [0, 2, 3]))], []))
+        self.receiver.add(PEER, parts[3])
+        for _ in range(SNAPSHOT_RETRIES - 1):
+            self.clock.now = self.receiver.next_deadline()
+            nacks, _ = self.receiver.poll()
+            self.assertEqual(nacks, [(PEER, SnapshotNackMessage(7, [0, 2]))])
+        self.clock.now = self.receiver.next_deadline()
+        self.assertEqual(self.receiver.poll(), ([], [[(1, "n", "1"), (3, "n", "3")]]))
+        self.assertIsNone(self.receiver.next_deadline())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from unittest.mock import patch
+
+from smplchat.settings import NODE_TIMEOUT, KEEPALIVE_BUCKETS
+from smplchat.client_list import TimingWheel, ClientList, KeepaliveList
+from tests.helpers import FakeClock
+
+class TestTimingWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.fired = []
+
+    def fire(self, key):
+        self.fired.append((key, self.clock.now))
+
+    def run_until(self, wheel, end, step=1.0):
+        while self.clock.now < end:
+            self.clock.now += step
+            wheel.advance()
+
+    def test_fires_on_time(self):
+        wheel = TimingWheel(slots=8, levels=3, clock=self.clock)
+        for delay in (1, 5, 7, 8, 9, 63, 64, 65, 100, 511, 700, 2000):
+            wheel.schedule(delay, delay, self.fire)
+        self.run_until(wheel, 4000)
+        self.assertEqual(self.fired, [(d, 1000.0 + d) for d in
+                         (1, 5, 7, 8, 9, 63, 64, 65, 100, 511, 700, 2000)])
+        self.assertEqual(len(wheel), 0)
+
+    def test_reschedule_and_cancel(self):
+        wheel = TimingWheel(slots=8, levels=2, clock=self.clock)
+        wheel.schedule("a", 10, self.fire)
+        wheel.schedule("b", 10, self.fire)
+        self.run_until(wheel, 1005)
+        wheel.schedule("a", 10, self.fire)
+        wheel.cancel("b")
+        self.assertNotIn("b", wheel)
+        self.run_until(wheel, 1100)
+        self.assertEqual(self.fired, [("a", 1015.0)])
+
+    def test_callback_reschedules(self):
+        wheel = TimingWheel(slots=4, levels=2, clock=self.clock)
+        def again(key):
+            self.fire(key)
+            wheel.schedule(key, 3, again)
+        wheel.schedule("p", 3, again)
+        self.run_until(wheel, 1012)
+        self.assertEqual([t for _, t in self.fired], [1003.0, 1006.0, 1009.0, 1012.0])
+
+    def test_idle_advance(self):
+        wheel = TimingWheel(slots=8, levels=2, clock=self.clock)
+        wheel.schedule("x", 30, self.fire)
+        self.clock.now += 1000
+        self.assertEqual(wheel.advance(), 1)
+
+    def test_next_deadline(self):
+        wheel = TimingWheel(slots=8, levels=3, clock=self.clock)
+        self.assertIsNone(wheel.next_deadline())
+        wheel.schedule("far", 300, self.fire)
+        self.assertEqual(wheel.next_deadline(), 1300.0)
+        wheel.schedule("near", 6, self.fire)
+        self.assertEqual(wheel.next_deadline(), 1006.0)
+
+    def test_client_list_expiry(self):
+        wheel = TimingWheel(clock=self.clock)
+        with patch("smplchat.client_list.clients.time", self.clock):
+            cl = ClientList(0, wheel)
+            cl.add(1)
+            cl.add(2)
+            self.run_until(wheel, 1000 + NODE_TIMEOUT / 2)
+            cl.add(2)
+            self.run_until(wheel, 1000 + NODE_TIMEOUT + 2)
+            self.assertEqual(cl.get_all(), [2])
+            self.run_until(wheel, 1000 + NODE_TIMEOUT * 2)
+            self.assertEqual(cl.get_all(), [])
+            self.assertEqual(len(wheel), 0)
+
+    def test_keepalive_expiry(self):
+        wheel = TimingWheel(clock=self.clock)
+        kal = KeepaliveList(clock=self.clock, wheel=wheel)
+        kal.add(100)
+        self.run_until(wheel, 1000 + NODE_TIMEOUT * (KEEPALIVE_BUCKETS - 1) / KEEPALIVE_BUCKETS - 1)
+        self.assertEqual(kal.seen_count(100), 1)
+        self.run_until(wheel, 1000 + NODE_TIMEOUT + 1)
+        self.assertEqual(kal.seen_count(100), 0)
@@ -0,0 +1,97 @@
+import socket
+import unittest
+from ipaddress import IPv4Address
+from time import monotonic, sleep
+
+from smplchat.udp_comms import Dispatcher, WorkerPool, packer, PROTOCOL_VERSION
+from smplchat.udp_comms.workers import RelayWorker, pack_news, unpack_news
+from smplchat.message import (
+    ChatRelayMessage,
+    KeepaliveRelayMessage,
+    OldRequestMessage,
+    HelloMessage)
+from tests.helpers import FakeSender
+
+SELF = IPv4Address("10.0.0.1")
+PEER = IPv4Address("10.0.0.2")
+OTHER = IPv4Address("10.0.0.3")
+LOCAL = IPv4Address("127.0.0.1")
+
+def chat(uid):
+    return packer(ChatRelayMessage(uniq_msg_id=uid, sender_ip=int(OTHER), old_message_ids=[],
+                                   sender_nick="bob", msg_text="hi"))
+
+class TestRelayWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = FakeSender()
+        self.funneled = []
+        self.worker = RelayWorker(SELF, Dispatcher(self.sender),
+                                  lambda msg, ip: self.funneled.append((msg, ip)))
+
+    def test_relay_forwarded_and_funneled_once(self):
+        for _ in range(4):
+            self.worker.receive(chat(1), PEER)
+        self.assertEqual(self.funneled, [(chat(1), PEER)])
+        # forwarded to the original sender, the only peer besides PEER
+        self.assertEqual(self.sender.payloads(), [chat(1), chat(1)])
+        self.assertIn(OTHER, self.worker.client_list.get_all())
+
+    def test_keepalive(self):
+        data = packer(KeepaliveRelayMessage(uniq_msg_id=5, sender_ip=int(OTHER)))
+        self.worker.receive(data, PEER)
+        self.worker.receive(data, PEER)
+        self.assertEqual(self.funneled, [(data, PEER)])
+
+    def test_other_messages_funneled(self):
+        data = packer(OldRequestMessage(uniq_msg_id=5))
+        self.worker.receive(data, PEER)
+        self.worker.receive(data, PEER)
+        self.assertEqual(self.funneled, [(data, PEER)] * 2)
+        self.assertEqual(self.sender.payloads(), [])
+
+    def test_hello_recorded_not_answered(self):
+        data = packer(HelloMessage(PROTOCOL_VERSION))
+        self.worker.receive(data, PEER)
+        self.assertEqual(self.funneled, [(data, PEER)])
+        self.assertEqual(self.sender.sent, [])
+        self.assertEqual(self.worker.dispatcher.version(PEER), PROTOCOL_VERSION)
+        self.assertEqual(self.worker.take_news(), {PEER: PROTOCOL_VERSION})
+        self.assertEqual(self.worker.take_news(), {})
+
+    def test_news_shared(self):
+        self.worker.receive(chat(1), PEER)
+        news = unpack_news(pack_news(self.worker.take_news()))
+        self.assertEqual(news, {PEER: 0, OTHER: 0})
+        other = RelayWorker(SELF, Dispatcher(FakeSender()), lambda msg, ip: None)
+        other.learn(news)
+        other.learn({PEER: PROTOCOL_VERSION})
+        self.assertEqual(sorted(other.client_list.get_all()), [PEER, OTHER])
+        self.assertEqual(other.dispatcher.version(PEER), PROTOCOL_VERSION)
+        self.assertEqual(other.take_news(), {})	# learned news is not passed on again
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_funnel(self):
+        with socket.socket(type=socket.SOCK_DGRAM) as probe:
+            probe.bind((str(LOCAL), 0))
+            port = probe.getsockname()[1]
+        pool = WorkerPool(2, SELF, bind_ip=LOCAL, port=port)
+        self.addCleanup(pool.stop)
+        self.assertTrue(pool.relays)
+        self.assertEqual(pool.sock.getsockname(), (str(LOCAL), port))
+        senders = [socket.socket(type=socket.SOCK_DGRAM) for _ in range(8)]
+        for i, sock in enumerate(senders):
+            sock.sendto(chat(i), (str(LOCAL), port))
+            sock.sendto(chat(i), (str(LOCAL), port))	# duplicate from same peer
+            sock.close()
+        got = []
+        end = monotonic() + 5
+        while len(got) < 8 and monotonic() < end:
+            got += pool.get_messages()
+            sleep(0.01)
+        self.assertEqual(sorted(got), sorted((chat(i), LOCAL) for i in range(8)))
+        self.assertIn("2 receive workers", pool.stats())
+
+if __name__ == "__main__":
+    unittest.main()